@@ -16,16 +16,13 @@ import threading
 import warnings
 import random
 import importlib
-try:
-    from zoneinfo import ZoneInfo
-except Exception:
-    ZoneInfo = None
+from urllib.parse import quote
 
 import pandas as pd
 import dash
 from dash import html, dcc
 from dash.dependencies import Output, Input, State
-from flask import abort, send_from_directory
+from flask import abort, send_from_directory, send_file, jsonify, request, Response
 
 try:
     from dotenv import load_dotenv
@@ -44,14 +41,13 @@ config_db = get_database_config()
 # Importar función de conexión
 db_module = importlib.import_module(config_db["module"])
 get_connection = db_module.get_connection
+get_db_circuit_status = getattr(db_module, "get_circuit_status", lambda: None)
 
 from functions import (
     get_current_record,
     get_current_lote_from_detalle,
     get_cajas_por_turno,
-    get_cajas_por_hora_turno,
     get_kg_por_turno,
-    get_kg_por_hora_turno,
     get_fermo_macchina_minuti,
     get_lotti_inizio_fine_map,
     get_kg_lote_vw_partita,
@@ -75,6 +71,22 @@ from icons import (
     STACK_ICON_SVG,
     KILOS_ICON_SVG,
 )
+from panel_cache import PanelSnapshotCache
+from metrics import REGISTRY, CONTENT_TYPE, SIMULATOR_TICK_SECONDS, medir_callback, registrar_cache
+import profiler
+import memory_telemetry
+import data_freshness
+import production_ledger
+import production_rollups
+import clock
+import regen_coordinator
+import db_maintenance
+import eta_predictor
+import downtime_detector
+import kpi_ring
+import throughput
+import lot_stats
+from profiler import perfilar
 
 TURN_TIME_ICON_SVG = """<svg viewBox="0 0 24 24" fill="none" xmlns="http://www.w3.org/2000/svg" stroke="#ffffff"><g id="SVGRepo_bgCarrier" stroke-width="0"></g><g id="SVGRepo_tracerCarrier" stroke-linecap="round" stroke-linejoin="round"></g><g id="SVGRepo_iconCarrier"> <path d="M12 21C16.9706 21 21 16.9706 21 12C21 7.02944 16.9706 3 12 3C7.02944 3 3 7.02944 3 12C3 16.9706 7.02944 21 12 21Z" stroke="#ffffff" stroke-width="1.5" stroke-linecap="round" stroke-linejoin="round"></path> <path d="M12 6V12" stroke="#ffffff" stroke-width="1.5" stroke-linecap="round" stroke-linejoin="round"></path> <path d="M16.24 16.24L12 12" stroke="#ffffff" stroke-width="1.5" stroke-linecap="round" stroke-linejoin="round"></path> </g></svg>"""
 
@@ -95,20 +107,294 @@ DEMO_EXPORTADORES = ["Exportadora Global S.A.", "Frutas del Mundo Ltda.", "AgroE
 
 CHILE_TZ_NAME = "America/Santiago"
 
+logger = logging.getLogger(__name__)
+
+LOG_DIR = os.environ.get("PANEL_LOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs"))
+
+
+def _configurar_log_rotativo(nombre_logger, archivo, prefijo_env, descripcion):
+    """Handler de archivo con rotacion para un logger propio (una linea por registro)."""
+    log = logging.getLogger(nombre_logger)
+    if log.handlers:
+        return
+    try:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        handler = RotatingFileHandler(
+            os.path.join(LOG_DIR, archivo),
+            maxBytes=int(os.environ.get(f"{prefijo_env}_MAX_BYTES", str(5 * 1024 * 1024))),
+            backupCount=int(os.environ.get(f"{prefijo_env}_BACKUPS", "5")),
+            encoding="utf-8",
+        )
+    except Exception as e:
+        print(f"[WARN] No se pudo abrir el log de {descripcion}: {e}")
+        return
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+
+# Consultas lentas (JSON lines)
+_configurar_log_rotativo("panel.slow_sql", "slow_queries.jsonl", "SLOW_QUERY_LOG", "consultas lentas")
+# Volcados de memoria al superar PANEL_MEM_DUMP_MB
+_configurar_log_rotativo("panel.memory", "memory.jsonl", "MEMORY_LOG", "memoria")
+memory_telemetry.iniciar_desde_entorno()
+# Mantenimiento de la base SQLite en la ventana tranquila (04:00-07:00 por defecto)
+if is_demo_mode():
+    db_maintenance.iniciar_desde_entorno(getattr(db_module, "demo_db_path", None))
+
 
 def now_chile():
-    if ZoneInfo:
-        try:
-            return datetime.datetime.now(ZoneInfo(CHILE_TZ_NAME)).replace(tzinfo=None)
-        except Exception:
-            pass
-    return datetime.datetime.now()
+    # Hora de planta (real o virtual acelerada, ver clock.py)
+    return clock.now_local(CHILE_TZ_NAME)
 
 app = dash.Dash(__name__, title=APP_CONFIG['title'])
 server = app.server
 
+# Ultima foto valida del panel (stale-while-revalidate ante fallas de BD)
+_PANEL_CACHE = PanelSnapshotCache(
+    backoff_inicial_s=float(os.environ.get("PANEL_SWR_BACKOFF_S", "2") or 2),
+    backoff_max_s=float(os.environ.get("PANEL_SWR_BACKOFF_MAX_S", "60") or 60),
+)
+# Escrituras y observadores del panel (ver _tick_panel): una vez por tick, no por cliente
+PANEL_TICK_MIN_S = float(os.environ.get("PANEL_TICK_MIN_S", "4") or 4)
+_TICK_LOCK = threading.Lock()
+_ultimo_tick = {"ts": None}
+# Ultimo exportador consultado (lote, nombre): cambia solo cuando cambia el lote
+_ultimo_exportador = {"lote": None, "nombre": None}
+
+
+@server.route("/status/panel")
+def status_panel():
+    """Estado del cache del panel: segundos desactualizado y fallos de refresco."""
+    return jsonify(_PANEL_CACHE.estado())
+
+
+@server.route("/status/clock")
+def status_clock():
+    """Reloj del panel (real o virtual acelerado)."""
+    return jsonify(clock.get_clock().estado())
+
+
+@server.route("/status/db")
+def status_db():
+    """Estado del circuit breaker de la BD (closed / open / half_open) y de la regeneracion."""
+    estado = dict(get_db_circuit_status() or {"estado": "desconocido"})
+    if is_demo_mode():
+        estado["regeneracion"] = _coordinador_regen().estado()
+    return jsonify(estado)
+
+
+@server.route("/status/maintenance")
+def status_maintenance():
+    """Planificador de mantenimiento de la BD (ventana, retencion y ultimos informes)."""
+    planificador = db_maintenance.planificador()
+    if planificador is None:
+        return jsonify({"activo": False})
+    return jsonify(planificador.estado())
+
+
+@server.route("/api/lot-stats")
+def api_lot_stats():
+    """Duracion tipica de lotes: ?proceso= (todas sus claves) y opcional &variedad=&productor= (la mas especifica)."""
+    proceso = (request.args.get("proceso") or "").strip()
+    if not proceso:
+        return jsonify({"error": "indicar proceso"}), 400
+    variedad = (request.args.get("variedad") or "").strip() or None
+    productor = (request.args.get("productor") or "").strip() or None
+    conn = get_connection()
+    try:
+        if variedad or productor:
+            resultado = lot_stats.consultar(conn, proceso, variedad, productor)
+        else:
+            resultado = lot_stats.listar(conn, proceso)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+    finally:
+        conn.close()
+    if not resultado:
+        return jsonify({"error": "sin estadisticas"}), 404
+    return jsonify(resultado)
+
+
+@server.route("/api/kpi-history")
+def api_kpi_history():
+    """Historial reducido de los KPIs del turno: ?horas=&puntos= (&serie=, por defecto la planta; ?estado=1 da el uso de memoria)."""
+    if request.args.get("estado"):
+        return jsonify(kpi_ring.HISTORIAL.estado())
+    serie = (request.args.get("serie") or "").strip() or kpi_ring.PLANTA
+    try:
+        horas = float(request.args.get("horas") or kpi_ring.KPI_RING_HOURS)
+        puntos = max(2, min(500, int(request.args.get("puntos") or 60)))
+    except ValueError:
+        return jsonify({"error": "horas/puntos invalidos"}), 400
+    return jsonify(kpi_ring.HISTORIAL.serie(serie, now_chile().timestamp(), horas=horas, puntos=puntos))
+
+
+@server.route("/api/kpi-sparkline.svg")
+def api_kpi_sparkline():
+    """Sparkline SVG de un KPI del turno (?kpi=cajas|kg|cajas_h|kg_h|progreso&color=&puntos=&serie=)."""
+    serie_kpi = (request.args.get("serie") or "").strip() or kpi_ring.PLANTA
+    kpi = request.args.get("kpi") or "cajas_h"
+    if kpi not in kpi_ring.CAMPOS:
+        return jsonify({"error": f"kpi debe ser uno de {list(kpi_ring.CAMPOS)}"}), 400
+    color = request.args.get("color") or "#2563eb"
+    if not re.fullmatch(r"#[0-9a-fA-F]{3,8}", color):
+        color = "#2563eb"
+    try:
+        puntos = max(2, min(200, int(request.args.get("puntos") or 48)))
+    except ValueError:
+        puntos = 48
+    serie = kpi_ring.HISTORIAL.serie(serie_kpi, now_chile().timestamp(), puntos=puntos)
+    respuesta = Response(kpi_ring.sparkline_svg(serie[kpi], color=color), mimetype="image/svg+xml")
+    respuesta.headers["Cache-Control"] = "private, max-age=60"
+    return respuesta
+
+
+@server.route("/status/eta")
+def status_eta():
+    """Estimadores de ritmo por lote que alimentan el ETA del panel."""
+    return jsonify(eta_predictor.PREDICTOR.estado())
+
+
+_FRESHNESS = data_freshness.FreshnessTracker()
+
+
+@server.route("/api/freshness", methods=["POST"])
+def freshness_report():
+    """Render informado por el navegador (callback clientside sobre panel-snapshot)."""
+    recibido_ms = time.time() * 1000.0
+    datos = request.get_json(silent=True) or {}
+    try:
+        cliente = str(datos.get("cliente") or "anon")[:64]
+        _FRESHNESS.registrar(
+            cliente,
+            int(datos["version"]),
+            float(datos["write_ts_ms"]),
+            float(datos["served_ms"]),
+            float(datos["render_ms"]),
+            float(datos["sent_ms"]),
+            recibido_ms,
+        )
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+    return ("", 204)
+
+
+@server.route("/status/freshness")
+def status_freshness():
+    """Percentiles de desfase escritura en BD -> render, por cliente."""
+    return jsonify(_FRESHNESS.resumen())
+
+
+@server.route("/api/ledger")
+def api_ledger():
+    """Agregados del libro de eventos: ?proceso=&lote= (lote e historia), ?proceso= (linea), ?turno= (turno)."""
+    proceso = (request.args.get("proceso") or "").strip()
+    lote = (request.args.get("lote") or "").strip()
+    turno = (request.args.get("turno") or "").strip()
+    if not (proceso or turno):
+        return jsonify({"error": "indicar proceso (y lote) o turno"}), 400
+    conn = get_connection()
+    try:
+        if turno:
+            resultado = production_ledger.turno(conn, turno)
+        elif lote:
+            resultado = production_ledger.lote(conn, proceso, lote)
+            if resultado is not None:
+                resultado["eventos_detalle"] = production_ledger.eventos_lote(conn, proceso, lote)
+        else:
+            resultado = production_ledger.linea(conn, proceso)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+    finally:
+        conn.close()
+    if resultado is None:
+        return jsonify({"error": "sin eventos"}), 404
+    return jsonify(resultado)
+
+
+def _colector_estado_panel():
+    """Metricas del cache del panel y del circuit breaker (se leen al exponer /metrics)."""
+    cache = _PANEL_CACHE.estado()
+    familias = [
+        ("panel_snapshot_stale_seconds", "gauge", "Segundos sirviendo la ultima foto valida del panel",
+         [({}, cache["stale_segundos"])]),
+        ("panel_snapshot_refresh_failures_total", "counter", "Fallos al construir/refrescar el panel",
+         [({}, cache["fallos_refresco_total"])]),
+        ("panel_snapshot_served_total", "counter", "Respuestas del panel por frescura",
+         [({"freshness": "fresh"}, cache["servidos_frescos_total"]),
+          ({"freshness": "stale"}, cache["servidos_stale_total"])]),
+    ]
+    circuito = get_db_circuit_status()
+    if circuito:
+        estados = ("closed", "open", "half_open")
+        familias.append(
+            ("panel_db_circuit_state", "gauge", "Estado del circuit breaker de la BD (1 = estado actual)",
+             [({"state": e}, 1 if circuito.get("estado") == e else 0) for e in estados])
+        )
+        familias.append(
+            ("panel_db_circuit_rejections_total", "counter", "Conexiones rechazadas con el circuito abierto",
+             [({}, circuito.get("rechazos_total", 0))])
+        )
+    familias.append(
+        ("panel_process_resident_memory_bytes", "gauge", "RSS del proceso del panel",
+         [({}, memory_telemetry.rss_bytes())])
+    )
+    telemetria = memory_telemetry.telemetria()
+    if telemetria is not None:
+        memoria = telemetria.estado()
+        traced = memoria["historial"][-1]["traced_bytes"] if memoria["historial"] else None
+        familias.append(
+            ("panel_tracemalloc_traced_bytes", "gauge", "Memoria trazada por tracemalloc en la ultima muestra",
+             [({}, traced)])
+        )
+    return familias
+
+
+REGISTRY.registrar_colector(_colector_estado_panel)
+
+
+@server.route("/metrics")
+def metrics_endpoint():
+    """Metricas en formato de texto Prometheus."""
+    return Response(REGISTRY.exponer(), content_type=CONTENT_TYPE)
+
+
+@server.route("/debug/profile")
+def profile_status():
+    """Objetivos de perfilado (PANEL_PROFILE) y ultimos volcados."""
+    if not profiler.habilitado():
+        abort(404)
+    return jsonify(profiler.estado())
+
+
+@server.route("/debug/profile/<objetivo>")
+def profile_latest(objetivo):
+    """Descarga el ultimo perfil (?format=pstats|folded, ?flush=1 vuelca el intervalo en curso)."""
+    if not profiler.habilitado():
+        abort(404)
+    formato = request.args.get("format", "pstats")
+    if formato not in ("pstats", "folded"):
+        abort(400)
+    info = profiler.ultimo_perfil(objetivo, volcar=request.args.get("flush") == "1")
+    if not info or not os.path.exists(info[formato]):
+        abort(404)
+    return send_file(info[formato], as_attachment=True, download_name=os.path.basename(info[formato]))
+
+
+@server.route("/debug/memory")
+def memory_status():
+    """RSS, memoria trazada y sitios de asignacion que mas crecen (PANEL_MEMTRACE=1)."""
+    telemetria = memory_telemetry.telemetria()
+    if telemetria is None:
+        abort(404)
+    if request.args.get("snapshot") == "1":
+        telemetria.tomar_muestra()
+    return jsonify(telemetria.estado())
+
 # Función para crear tarjetas métricas (igual que el original)
-def construir_metric_card(label, value, subtext="", accent="#2563eb", icon_svg=None, theme="blue", badge_text=""):
+def construir_metric_card(label, value, subtext="", accent="#2563eb", icon_svg=None, theme="blue", badge_text="", sparkline=None):
     # El problema: React parsea las etiquetas SVG como componentes en lugar de HTML
     # Solución: usar html.Iframe con srcdoc para renderizar el SVG como HTML crudo
     # Esto evita que React parse el SVG y permite renderizar HTML directamente
@@ -147,6 +433,8 @@ def construir_metric_card(label, value, subtext="", accent="#2563eb", icon_svg=N
             html.Div(badge_text, className="metric-badge") if badge_text else html.Div(),
             html.Div(label, className="metric-label"),
             html.Div(value, className="metric-value", style={"color": accent}),
+            # Sparkline desde el historial en memoria (kpi_ring) servida como SVG por /api/kpi-sparkline.svg
+            html.Img(src=sparkline, className="metric-sparkline", alt="") if sparkline else html.Div(),
             html.Div(subtext, className="metric-subtext") if subtext else html.Div(),
         ],
         className=f"metric-card metric-{theme}",
@@ -195,6 +483,7 @@ def _parse_db_datetime(value):
                 return None
     return None
 
+@perfilar()
 def _get_current_lot_schedule(conn, now):
     shift_type, shift_start, shift_end, shift_cfg = _get_shift_window(now)
     cur = conn.cursor()
@@ -237,7 +526,24 @@ def _get_current_lot_schedule(conn, now):
     next_dt = schedule[current_idx + 1]["dt"] if current_idx + 1 < len(schedule) else shift_end
     return current, next_dt, (shift_type, shift_start, shift_end, shift_cfg), schedule
 
-_DEMO_REGEN_STATE = {"last_key": None, "last_ts": 0.0}
+def _coordinador_regen():
+    from database_demo import demo_db_path
+    return regen_coordinator.para_base(demo_db_path)
+
+
+def _rollover_turno(now, shift_key):
+    """Agrega los lotes del turno nuevo (sin borrar historial)."""
+    from demo_db_generator import DemoDatabaseGenerator
+    from database_demo import demo_db_path
+
+    generator = DemoDatabaseGenerator(demo_db_path)
+    try:
+        agregados = generator.rollover_shift(now)
+    finally:
+        generator.close_connection()
+    if agregados:
+        print(f"[DEMO] Turno {shift_key}: {agregados} lotes agregados")
+    return agregados
 
 
 def _ensure_demo_shift_data(now):
@@ -245,52 +551,43 @@ def _ensure_demo_shift_data(now):
         return
     shift_type, shift_start, shift_end, _ = _get_shift_window(now)
     shift_key = f"{shift_type}|{shift_start.date().isoformat()}"
-    if (
-        _DEMO_REGEN_STATE["last_key"] == shift_key
-        and (time.time() - float(_DEMO_REGEN_STATE["last_ts"] or 0.0)) < 300.0
-    ):
+    coordinador = _coordinador_regen()
+    if coordinador.reciente(shift_key, 300.0):
         return
 
-    count = 0
     try:
         conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT COUNT(*) FROM VW_LottiIngresso
-            WHERE DataLettura >= ? AND DataLettura <= ?
-            """,
-            (shift_start, shift_end),
-        )
-        row = cur.fetchone()
-        count = int(row[0] or 0) if row else 0
-        conn.close()
-    except Exception:
         try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT COUNT(*) FROM VW_LottiIngresso
+                WHERE DataLettura >= ? AND DataLettura <= ?
+                """,
+                (shift_start, shift_end),
+            )
+            row = cur.fetchone()
+            count = int(row[0] or 0) if row else 0
+        finally:
             conn.close()
-        except Exception:
-            pass
-        count = 0
+    except Exception:
+        # Sin poder verificar no se toca la base; se reintenta en el proximo refresco
+        return
 
     if count > 0:
-        _DEMO_REGEN_STATE["last_key"] = shift_key
-        _DEMO_REGEN_STATE["last_ts"] = time.time()
+        coordinador.marcar(shift_key)
         return
 
-    try:
-        from demo_db_generator import DemoDatabaseGenerator
-        from database_demo import demo_db_path
-
-        generator = DemoDatabaseGenerator(demo_db_path)
-        generator.create_database()
-        generator.close_connection()
-        _DEMO_REGEN_STATE["last_key"] = shift_key
-        _DEMO_REGEN_STATE["last_ts"] = time.time()
-    except Exception:
-        pass
+    # Un solo cambio de turno a la vez (entre hilos y procesos), en segundo plano:
+    # el callback sigue sirviendo los datos actuales mientras tanto
+    coordinador.en_segundo_plano(
+        "shift_rollover", lambda: _rollover_turno(now, shift_key), clave=shift_key
+    )
 
+@perfilar()
 def update_demo_progress():
     """Avanza el demo en cada refresh (sin cambios aleatorios)."""
+    inicio = time.perf_counter()
     try:
         now = now_chile()
         _ensure_demo_shift_data(now)
@@ -348,6 +645,35 @@ def update_demo_progress():
         variedad_nombre = row_info[1] or "N/A"
         exportador_nombre = row_info[2] or "N/A"
 
+        # Libro de eventos: cerrar el lote anterior, registrar las cajas nuevas y
+        # proyectar el avance acumulado a VW_LottiIngresso. Solo se cierran lotes que
+        # quedaron atras en el horario: el simulador puede haber puesto uno posterior en
+        # VW_MON_Partita_Corrente y ese sigue abierto hasta que le toque (el libro no reabre).
+        cur.execute(
+            """
+            SELECT c.ProcessoCodice, c.LottoCodice, c.UnitaPianificate, c.UnitaSvuotate, c.PesoNetto,
+                   (SELECT MAX(l.DataLettura) FROM VW_LottiIngresso l
+                    WHERE l.CodiceLotto = c.LottoCodice AND l.CodiceProcesso = c.ProcessoCodice)
+            FROM VW_MON_Partita_Corrente c
+            """
+        )
+        for proceso_ant, lote_ant, plan_ant, vaciadas_ant, peso_ant, lectura_ant in cur.fetchall():
+            lectura_ant = _parse_db_datetime(lectura_ant)
+            atras = lectura_ant is None or lectura_ant < lot_start
+            if (proceso_ant, lote_ant) != (current["proceso"], current["lote"]) and atras:
+                kg_caja_ant = (float(peso_ant or 0) / 1000.0) / vaciadas_ant if vaciadas_ant else 0.0
+                production_ledger.cerrar_lote(
+                    cur, proceso_ant, lote_ant, lot_start, plan_ant, kg_caja_ant, fuente="update_demo_progress"
+                )
+        production_ledger.asegurar_lote(cur, current["proceso"], current["lote"], lot_start,
+                                        fuente="update_demo_progress")
+        production_ledger.avanzar_lote(cur, current["proceso"], current["lote"], now, nuevas_unidades,
+                                       kg_por_caja, fuente="update_demo_progress")
+        proyectadas = production_ledger.proyectar_lote(cur, current["proceso"], current["lote"])
+        if proyectadas is not None:
+            nuevas_unidades = min(proyectadas, unita_pianificate)
+            peso_actual = nuevas_unidades * kg_por_caja * 1000
+
         cur.execute(
             """
             UPDATE VW_MON_Partita_Corrente
@@ -374,21 +700,6 @@ def update_demo_progress():
             ),
         )
 
-        cur.execute(
-            """
-            UPDATE VW_LottiIngresso
-            SET UnitaIn = ?, UnitaRestanti = ?, PesoNetto = ?
-            WHERE CodiceLotto = ? AND CodiceProcesso = ?
-            """,
-            (
-                nuevas_unidades,
-                max(0, unita_pianificate - nuevas_unidades),
-                peso_total,
-                current["lote"],
-                current["proceso"],
-            ),
-        )
-
         shift_total_sec = max(1.0, shift_cfg["duracion_h"] * 3600.0)
         shift_elapsed_sec = max(0.0, (now - shift_start).total_seconds())
         shift_ratio = min(1.0, shift_elapsed_sec / shift_total_sec)
@@ -417,10 +728,13 @@ def update_demo_progress():
             ),
         )
 
+        data_freshness.sellar(cur, "update_demo_progress")
         conn.commit()
         conn.close()
     except Exception:
         pass
+    finally:
+        SIMULATOR_TICK_SECONDS.observe(time.perf_counter() - inicio, source="update_demo_progress")
 
 # Layout principal del dashboard (igual que el original app.py)
 app.layout = html.Div([
@@ -489,6 +803,7 @@ app.layout = html.Div([
                             ],
                             className="update-time-row",
                         ),
+                        html.Div(id="panel-stale-badge"),
                     ],
                     className="update-badge header-stat",
                 ),
@@ -519,6 +834,7 @@ app.layout = html.Div([
         children=[
             dcc.Tab(label="Análisis Gráfico", value="tab-analisis", className="tab-analisis"),
             dcc.Tab(label="Detalle Completo", value="tab-detalle", className="tab-detalle"),
+            dcc.Tab(label="Tendencia Histórica", value="tab-tendencia", className="tab-tendencia"),
         ],
         className="tabs-container",
     ),
@@ -567,6 +883,35 @@ app.layout = html.Div([
         )
     ], id="tab-detalle-container", style={"margin": "0 1.5rem 2rem 1.5rem"}),
 
+    # Contenedor del tab de tendencia (solo lee los rollups por hora/turno)
+    html.Div([
+        html.Div([
+            dcc.RadioItems(
+                id="tendencia-granularidad",
+                options=[{"label": "Por turno", "value": "turno"}, {"label": "Por hora", "value": "hora"}],
+                value="turno",
+                inline=True,
+                className="trend-control",
+            ),
+            dcc.Dropdown(
+                id="tendencia-dias",
+                options=[{"label": f"Últimos {d} días", "value": d} for d in (7, 30, 90)],
+                value=30,
+                clearable=False,
+                className="trend-control trend-dropdown",
+            ),
+            dcc.Dropdown(
+                id="tendencia-proceso",
+                options=[{"label": "Todas las líneas", "value": ""}]
+                + [{"label": p, "value": p} for p in DEMO_PROCESOS],
+                value="",
+                clearable=False,
+                className="trend-control trend-dropdown",
+            ),
+        ], className="trend-controls"),
+        dcc.Graph(id="tendencia-grafico", config={"displaylogo": False}, className="chart-card"),
+    ], id="tab-tendencia-container", style={"display": "none"}),
+
     # Intervalos para actualización automática
     dcc.Interval(id="interval-act", interval=5 * 1000, n_intervals=0),
     dcc.Interval(id="interval-notif", interval=60 * 1000, n_intervals=0),
@@ -594,7 +939,7 @@ def formatear_entero(valor):
         return "0"
 
 # Callbacks principales (basados en el app.py original)
-print("[DEBUG] Registering actualizar_panel callback...")
+logger.debug("Registering actualizar_panel callback...")
 @app.callback(
     [
         Output("metricas-lote", "children"),
@@ -616,573 +961,836 @@ print("[DEBUG] Registering actualizar_panel callback...")
      State("lote-finish-store", "data"),
      State("eta-store", "data")],
 )
+@medir_callback("actualizar_panel")
+@perfilar("actualizar_panel")
 def actualizar_panel(_, prev_snapshot, fermo_baseline_prev, lote_finish_prev, eta_prev):
-    print(f"[DEBUG] actualizar_panel FUNCTION CALLED: n_intervals={_}")
+    logger.debug("actualizar_panel called: n_intervals=%s", _)
     try:
-        now = now_chile()
-        update_demo_progress()
-        try:
-            cajas_por_hora_turno = get_cajas_por_hora_turno() or 0
-            kg_por_hora_turno = get_kg_por_hora_turno() or 0
-        except Exception:
-            cajas_por_hora_turno = 0
-            kg_por_hora_turno = 0
+        _tick_panel()
+        # Stale-while-revalidate: si la BD falla se sirve la ultima foto valida
+        resultado, stale = _PANEL_CACHE.obtener(_construir_panel)
+        registrar_cache("panel_swr", hit=stale)
+        return resultado
+    except Exception as e:
+        # Sin foto previa: devolver valores por defecto
+        error_msg = f"Error: {str(e)}"
+        return (
+            [construir_metric_card("Error", error_msg, "", "#ef4444", theme="red")],
+            html.Div("Error cargando filtros", className="filter-grid"),
+            html.Div(error_msg, style={"padding": "20px", "color": "red"}),
+            html.Div(error_msg, style={"padding": "20px", "color": "red"}),
+            [],
+            [],
+            [],
+            {},
+            None,
+            None,
+            None,
+            None,  # eta-store
+        )
 
 
-        hora = now.strftime("%d/%m/%Y %H:%M:%S")
+def _verificar_bd():
+    """
+    Consulta minima: si la BD no responde se lanza la excepcion para servir la foto previa.
+    Retorna el sello de version de datos (data_freshness) o None.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM VW_MON_Partita_Corrente LIMIT 1")
+        cur.fetchall()
+        return data_freshness.leer_version(conn)
+    finally:
+        conn.close()
 
-        # Obtener datos actuales
-        current_record = get_current_record()
-        lote_detalle = get_current_lote_from_detalle()
 
-        if lote_detalle:
-            datos_lote = lote_detalle
-            productor = current_record["Productor"] if current_record else "N/A"
-        else:
-            datos_lote = current_record
-            productor = current_record["Productor"] if current_record else "N/A"
+def _detectar_detenciones(ahora, fermo_min, cajas_turno, activo, proceso, lote):
+    """Alimenta el detector de detenciones y guarda sus eventos (PROD_Fermate + libro)."""
+    detector = downtime_detector.DETECTOR
+    eventos = detector.observar(
+        ahora, fermo_min, cajas_turno, production_ledger.clave_turno(ahora), activo=activo,
+        proceso=proceso, lote=str(lote) if lote else None,
+    )
+    if not eventos and not detector.necesita_carga:
+        return
+    conn = get_connection()
+    try:
+        detector.cargar_turno(conn)
+        if eventos:
+            downtime_detector.guardar_eventos(conn.cursor(), eventos)
+            conn.commit()
+            for tipo, detencion in eventos:
+                logger.info("[FERMO] %s %s desde %s (%.1f min)", tipo, detencion.get("proceso"),
+                            detencion["inicio"], detencion.get("minutos") or 0.0)
+    finally:
+        conn.close()
+
+
+def _datos_lote_actual():
+    """(datos_lote, current_record): el lote en curso segun el detalle o, si no hay, el registro actual."""
+    current_record = get_current_record()
+    lote_detalle = get_current_lote_from_detalle()
+    return (lote_detalle or current_record), current_record
+
 
-        lote_actual = datos_lote["Lote"] if datos_lote and datos_lote.get("Lote") else None
-        
-        # Obtener exportador
-        exportador = None
+def _fila_turno():
+    """Ultima fila de VW_MON_Produttivita_Turno_Corrente (o None)."""
+    conn = get_connection()
+    try:
+        df = read_sql_adapted(
+            """
+            SELECT FermoMacchinaMinuti, UnitaSvuotate, PesoSvuotato, UnitaSvuotateOra, PesoSvuotatoOra, TurnoInizio
+            FROM VW_MON_Produttivita_Turno_Corrente
+            ORDER BY DataAcquisizione DESC
+            LIMIT 1
+            """,
+            conn,
+        )
+    finally:
+        conn.close()
+    return None if df.empty else df.iloc[0]
+
+
+def _ritmo_turno(fila_turno, ahora, shift_start_dt):
+    """(cajas/h, kg/h, ritmo): el medido por throughput o, sin ventana suficiente, el de la vista."""
+    cajas_h = kg_h = 0
+    if pd.notna(fila_turno.get("UnitaSvuotateOra")):
+        cajas_h = int(fila_turno.get("UnitaSvuotateOra"))
+    if pd.notna(fila_turno.get("PesoSvuotatoOra")):
+        kg_h = float(fila_turno.get("PesoSvuotatoOra"))
+    inicio_turno = _parse_db_datetime(fila_turno.get("TurnoInizio")) or shift_start_dt
+    ritmo = throughput.MOTOR.ritmo(ahora.timestamp(), inicio_turno.replace(tzinfo=None).timestamp())
+    if ritmo.get("cajas_h_15") is not None:
+        cajas_h = ritmo["cajas_h_15"]
+        kg_h = ritmo["kg_h_15"]
+    return cajas_h, kg_h, ritmo
+
+
+def _acumulados_turno(ahora):
+    """(cajas, kg) del turno hasta el lote actual: lotes anteriores + avance del actual."""
+    cajas = 0
+    kg = 0
+    try:
+        conn = get_connection()
         try:
-            prev_kpis = (prev_snapshot or {}).get("kpis") if isinstance(prev_snapshot, dict) else None
-            prev_filtros = (prev_snapshot or {}).get("filtros") if isinstance(prev_snapshot, dict) else None
-            prev_lote = (prev_kpis or {}).get("lote") if isinstance(prev_kpis, dict) else None
-            prev_exportador = (prev_filtros or {}).get("Exportador") if isinstance(prev_filtros, dict) else None
+            current, next_dt, _, schedule = _get_current_lot_schedule(conn, ahora)
+        finally:
+            conn.close()
+        if current and schedule:
+            lot_start = current["dt"]
+            lot_end = max(lot_start, next_dt)
+            total_sec = max(1.0, (lot_end - lot_start).total_seconds())
+            elapsed_sec = max(0.0, (ahora - lot_start).total_seconds())
+            progress_ratio = min(1.0, elapsed_sec / total_sec)
+
+            for item in schedule:
+                if item["dt"] < lot_start:
+                    cajas += int(item.get("plan") or 0)
+                    kg += float(item.get("peso_total") or 0) / 1000.0
+                elif item["dt"] == lot_start:
+                    cajas += int(round((item.get("plan") or 0) * progress_ratio))
+                    kg += (float(item.get("peso_total") or 0) / 1000.0) * progress_ratio
+    except Exception:
+        return 0, 0
+    return cajas, kg
 
-            if lote_actual and prev_lote == str(lote_actual) and prev_exportador and str(prev_exportador).strip().upper() != "N/A":
-                exportador = prev_exportador
-            else:
-                if lote_actual:
-                    # Intentar obtener exportador
-                    exportador = get_exportador_nombre(str(lote_actual))
-                else:
-                    exportador = "N/A"
 
-        except Exception as e:
-            exportador = "N/A"
+def _tick_panel():
+    """Avanza el demo y alimenta detector, ritmo, ETA e historial de KPIs, una vez por tick.
 
-        # Filtros actuales (información del lote en curso)
-        filtros = {
-            "Exportador": exportador or "N/A",
-            "Productor": productor,
-            "Variedad": datos_lote["Variedad"] if datos_lote else "N/A",
-            "Proceso": datos_lote["Proceso"] if datos_lote else "N/A",
-            "Lote": datos_lote["Lote"] if datos_lote else "N/A",
-        }
-        filtros = {k: truncar_texto(v) for k, v in filtros.items()}
+    Single-flight: si otro cliente lo esta corriendo o corrio hace menos de
+    PANEL_TICK_MIN_S segundos no hace nada. Asi _construir_panel queda de solo lectura
+    y los reintentos del cache SWR no repiten escrituras ni muestras.
+    """
+    if not _TICK_LOCK.acquire(blocking=False):
+        return False
+    try:
+        ahora_mono = time.monotonic()
+        if _ultimo_tick["ts"] is not None and ahora_mono - _ultimo_tick["ts"] < PANEL_TICK_MIN_S:
+            return False
+        _ultimo_tick["ts"] = ahora_mono
+        update_demo_progress()
+        _observar_tick(now_chile())
+        return True
+    except Exception as e:
+        logger.warning("[TICK] Observacion del tick fallida: %s", e)
+        return False
+    finally:
+        _TICK_LOCK.release()
+
+
+def _observar_tick(now):
+    datos_lote, _ = _datos_lote_actual()
+    proceso = datos_lote.get("Proceso") if datos_lote else None
+    lote_actual = datos_lote["Lote"] if datos_lote and datos_lote.get("Lote") else None
+    _, shift_start_dt, shift_end_dt, _ = _get_shift_window(now)
+
+    cajas_h = kg_h = 0
+    fila_turno = _fila_turno()
+    if fila_turno is not None:
+        fermo_min = float(fila_turno.get("FermoMacchinaMinuti", 0) or 0)
+        _detectar_detenciones(
+            now, 0 if pd.isna(fermo_min) else fermo_min, fila_turno.get("UnitaSvuotate"), now <= shift_end_dt,
+            proceso, lote_actual,
+        )
+        throughput.MOTOR.observar(
+            now.timestamp(), fila_turno.get("UnitaSvuotate"), fila_turno.get("PesoSvuotato"),
+            turno=production_ledger.clave_turno(now),
+        )
+        cajas_h, kg_h, _ = _ritmo_turno(fila_turno, now, shift_start_dt)
+
+    pct_cajas = 0
+    if datos_lote:
+        cajas_totales = int(datos_lote.get("UnitaPianificate", 0) or 0)
+        cajas_vaciadas = int(datos_lote.get("UnitaSvuotate", 0) or 0)
+        pct_cajas = (cajas_vaciadas / cajas_totales * 100) if cajas_totales > 0 else 0
+        if lote_actual:
+            # Ritmo real de vaciado del lote en curso (ETA)
+            eta_predictor.PREDICTOR.observar(proceso, lote_actual, now.timestamp(), cajas_vaciadas)
+
+    # Historial de KPIs por tick (buffer en memoria) para las sparklines de las tarjetas:
+    # son numeros del turno de la planta, no de la linea del lote en curso
+    cajas_acum, kg_acum = _acumulados_turno(now)
+    kpi_ring.HISTORIAL.registrar(
+        kpi_ring.PLANTA, now.timestamp(), cajas=cajas_acum, kg=kg_acum, cajas_h=cajas_h, kg_h=kg_h,
+        progreso=pct_cajas,
+    )
 
-        filtros_children = html.Div([
-            html.Div([
-                html.Div([
-                    html.Div((k[:2] if k else "?").upper(), className="filter-icon"),
-                    html.Div(k, className="filter-label"),
-                ], className="filter-header"),
-                html.Div(v, className="filter-value"),
-            ], className="filter-item")
-            for k, v in filtros.items()
-        ], className="filter-grid")
-
-        # Métricas principales
-        if datos_lote:
-            cajas_totales = int(datos_lote.get("UnitaPianificate", 0) or 0)
-            cajas_vaciadas = int(datos_lote.get("UnitaSvuotate", 0) or 0)
-            cajas_restantes = int(datos_lote.get("UnitaRestanti", 0) or 0)
-
-            # Calcular kg
-            kg_totales = get_kg_total_lote(datos_lote.get("Lote")) or 0
-            if kg_totales == 0 and datos_lote.get("PesoNetto", 0) > 0:
-                kg_totales = float(datos_lote["PesoNetto"])
-
-            kg_por_caja = get_kg_por_caja_lote(datos_lote.get("Lote")) or 0
-            if kg_por_caja == 0 and cajas_totales > 0 and kg_totales > 0:
-                kg_por_caja = kg_totales / cajas_totales
-
-            if kg_por_caja > 0:
-                kg_restantes = kg_por_caja * max(0, cajas_restantes)
-                kg_vaciados = kg_totales - kg_restantes
+
+def _subtexto_detenciones(estado):
+    """'tiempo total' + barra del turno con las detenciones (cerradas y en curso) marcadas."""
+    detenciones = list(estado["timeline"])
+    if estado["parada_actual"]:
+        detenciones.append(dict(estado["parada_actual"], fin=now_chile()))
+    if not detenciones:
+        return "tiempo total"
+    _, inicio_turno, fin_turno, _ = _get_shift_window(now_chile())
+    total_s = max(1.0, (fin_turno - inicio_turno).total_seconds())
+    segmentos = []
+    for d in detenciones:
+        desde = max(0.0, (d["inicio"] - inicio_turno).total_seconds()) / total_s
+        hasta = min(total_s, max(0.0, (d["fin"] - inicio_turno).total_seconds())) / total_s
+        segmentos.append(html.Div(
+            className="fermo-segment" + (" fermo-segment-active" if d is detenciones[-1] and estado["parada_actual"] else ""),
+            title=f"{d['inicio']:%H:%M} - {d['fin']:%H:%M} ({d['minutos']:.0f} min)",
+            style={"left": f"{desde * 100:.2f}%", "width": f"{max(0.4, (hasta - desde) * 100):.2f}%"},
+        ))
+    return html.Div([
+        html.Span(f"tiempo total · {len(detenciones)} detenciones"),
+        html.Div(segmentos, className="fermo-timeline"),
+    ])
+
+
+def _subtexto_ritmo(ritmo, campo, unidad):
+    """'cajas/h' (valor de la vista) o 'ultimos 15 min · 60 min: N · turno: M' con el ritmo medido."""
+    if ritmo.get(f"{campo}_h_15") is None:
+        return unidad
+    partes = [f"{unidad} ultimos 15 min"]
+    for clave, etiqueta in ((f"{campo}_h_60", "60 min"), (f"{campo}_h_turno", "turno")):
+        if ritmo.get(clave) is not None:
+            partes.append(f"{etiqueta}: {formatear_entero(ritmo[clave])}")
+    return " · ".join(partes)
+
+
+def _duracion_tipica_lote(conn, proceso, lote):
+    """(stats de lot_stats para el proceso/variedad/productor del lote, inicio del lote) o None."""
+    variedad, productor, _, _ = lot_stats.clave_lote(conn, proceso, lote)
+    stats = lot_stats.consultar(conn, proceso, variedad, productor)
+    agregado = production_ledger.lote(conn, proceso, str(lote))
+    inicio = None
+    if agregado and agregado.get("inicio"):
+        inicio = datetime.datetime.fromisoformat(str(agregado["inicio"])).replace(tzinfo=None)
+    return stats, inicio
+
+
+def _construir_panel():
+    """Construye todas las salidas de actualizar_panel. Lanza excepcion si la BD no responde.
+
+    Solo lectura e independiente del cliente (el cache SWR la reintenta y sirve su
+    resultado a todos): las escrituras y observaciones del tick van en _tick_panel.
+    """
+    now = now_chile()
+    sello_datos = _verificar_bd()
+    # Reinicia la animacion de los indicadores de carga en cada construccion
+    clave_carga = int(now.timestamp())
+
+    hora = now.strftime("%d/%m/%Y %H:%M:%S")
+
+    # Obtener datos actuales
+    datos_lote, current_record = _datos_lote_actual()
+    productor = current_record["Productor"] if current_record else "N/A"
+
+    lote_actual = datos_lote["Lote"] if datos_lote and datos_lote.get("Lote") else None
+    
+    # Obtener exportador (se reutiliza mientras el lote no cambie)
+    exportador = None
+    try:
+        previo = dict(_ultimo_exportador)
+        if lote_actual and previo["lote"] == str(lote_actual) and previo["nombre"] and str(previo["nombre"]).strip().upper() != "N/A":
+            exportador = previo["nombre"]
+            registrar_cache("exportador", hit=True)
+        else:
+            registrar_cache("exportador", hit=False)
+            if lote_actual:
+                # Intentar obtener exportador
+                exportador = get_exportador_nombre(str(lote_actual))
+                _ultimo_exportador.update(lote=str(lote_actual), nombre=exportador)
             else:
-                kg_restantes = kg_vaciados = 0
+                exportador = "N/A"
 
-            pct_cajas = (cajas_vaciadas / cajas_totales * 100) if cajas_totales > 0 else 0
+    except Exception as e:
+        exportador = "N/A"
+
+    # Filtros actuales (información del lote en curso)
+    filtros = {
+        "Exportador": exportador or "N/A",
+        "Productor": productor,
+        "Variedad": datos_lote["Variedad"] if datos_lote else "N/A",
+        "Proceso": datos_lote["Proceso"] if datos_lote else "N/A",
+        "Lote": datos_lote["Lote"] if datos_lote else "N/A",
+    }
+    filtros = {k: truncar_texto(v) for k, v in filtros.items()}
+
+    filtros_children = html.Div([
+        html.Div([
+            html.Div([
+                html.Div((k[:2] if k else "?").upper(), className="filter-icon"),
+                html.Div(k, className="filter-label"),
+            ], className="filter-header"),
+            html.Div(v, className="filter-value"),
+        ], className="filter-item")
+        for k, v in filtros.items()
+    ], className="filter-grid")
+
+    # Métricas principales
+    if datos_lote:
+        cajas_totales = int(datos_lote.get("UnitaPianificate", 0) or 0)
+        cajas_vaciadas = int(datos_lote.get("UnitaSvuotate", 0) or 0)
+        cajas_restantes = int(datos_lote.get("UnitaRestanti", 0) or 0)
+
+        # Calcular kg
+        kg_totales = get_kg_total_lote(datos_lote.get("Lote")) or 0
+        if kg_totales == 0 and datos_lote.get("PesoNetto", 0) > 0:
+            kg_totales = float(datos_lote["PesoNetto"])
+
+        kg_por_caja = get_kg_por_caja_lote(datos_lote.get("Lote")) or 0
+        if kg_por_caja == 0 and cajas_totales > 0 and kg_totales > 0:
+            kg_por_caja = kg_totales / cajas_totales
+
+        if kg_por_caja > 0:
+            kg_restantes = kg_por_caja * max(0, cajas_restantes)
+            kg_vaciados = kg_totales - kg_restantes
         else:
-            cajas_totales = cajas_vaciadas = cajas_restantes = 0
-            kg_totales = kg_vaciados = kg_restantes = 0
-            pct_cajas = 0
+            kg_restantes = kg_vaciados = 0
 
-        # Calcular tiempo de turno (acumulado hasta el lote actual)
+        pct_cajas = (cajas_vaciadas / cajas_totales * 100) if cajas_totales > 0 else 0
+    else:
+        cajas_totales = cajas_vaciadas = cajas_restantes = 0
+        kg_totales = kg_vaciados = kg_restantes = 0
+        pct_cajas = 0
+
+    # Calcular tiempo de turno (acumulado hasta el lote actual)
+    turno_s = 0
+    fermo_min = 0
+    # Ritmo por hora: el medido (throughput) o, mientras no hay ventana suficiente, el de la vista
+    cajas_por_hora_turno = kg_por_hora_turno = 0
+    ritmo = {}
+    try:
+        now_turno = now_chile()
+        _, shift_start_dt, shift_end_dt, _ = _get_shift_window(now_turno)
+        now_clamped = min(now_turno, shift_end_dt)
+        turno_s = int((now_clamped - shift_start_dt).total_seconds())
+        turno_s = max(0, turno_s)
+
+        fila_turno = _fila_turno()
+        if fila_turno is not None:
+            fermo_min = float(fila_turno.get("FermoMacchinaMinuti", 0) or 0)
+            if pd.isna(fermo_min):
+                fermo_min = 0
+            cajas_por_hora_turno, kg_por_hora_turno, ritmo = _ritmo_turno(fila_turno, now_turno, shift_start_dt)
+    except Exception:
         turno_s = 0
         fermo_min = 0
-        try:
-            now_turno = now_chile()
-            _, shift_start_dt, shift_end_dt, _ = _get_shift_window(now_turno)
-            now_clamped = min(now_turno, shift_end_dt)
-            turno_s = int((now_clamped - shift_start_dt).total_seconds())
-            turno_s = max(0, turno_s)
-
-            conn = get_connection()
-            query_turno_completo = """
-            SELECT FermoMacchinaMinuti
-            FROM VW_MON_Produttivita_Turno_Corrente
-            ORDER BY DataAcquisizione DESC
-            LIMIT 1
-            """
-            df_turno_completo = read_sql_adapted(query_turno_completo, conn)
-            conn.close()
-            if not df_turno_completo.empty:
-                fermo_min = float(df_turno_completo.iloc[0].get("FermoMacchinaMinuti", 0) or 0)
-                if pd.isna(fermo_min):
-                    fermo_min = 0
-        except Exception:
-            turno_s = 0
-            fermo_min = 0
-        
-        # Formatear tiempo de detención
-        det_hms = f"{int(fermo_min):02d}:{int((fermo_min % 1) * 60):02d}"
-
-        # Acumulados por turno hasta el lote actual (sumando lotes anteriores + avance actual)
-        cajas_acum_turno = 0
-        kg_acum_turno = 0
-        try:
-            now_sum = now_chile()
-            conn_sum = get_connection()
-            current_sum, next_dt_sum, _, schedule_sum = _get_current_lot_schedule(conn_sum, now_sum)
-            conn_sum.close()
-            if current_sum and schedule_sum:
-                lot_start_sum = current_sum["dt"]
-                lot_end_sum = max(lot_start_sum, next_dt_sum)
-                total_sec_sum = max(1.0, (lot_end_sum - lot_start_sum).total_seconds())
-                elapsed_sec_sum = max(0.0, (now_sum - lot_start_sum).total_seconds())
-                progress_ratio_sum = min(1.0, elapsed_sec_sum / total_sec_sum)
-
-                for item in schedule_sum:
-                    if item["dt"] < lot_start_sum:
-                        cajas_acum_turno += int(item.get("plan") or 0)
-                        kg_acum_turno += float(item.get("peso_total") or 0) / 1000.0
-                    elif item["dt"] == lot_start_sum:
-                        cajas_acum_turno += int(round((item.get("plan") or 0) * progress_ratio_sum))
-                        kg_acum_turno += (float(item.get("peso_total") or 0) / 1000.0) * progress_ratio_sum
-        except Exception:
-            cajas_acum_turno = 0
-            kg_acum_turno = 0
-
-        # Métricas
-        metricas = [
-            construir_metric_card(
-                "Cajas Totales",
-                f"{formatear_entero(cajas_acum_turno)}",
-                "acumulado turno",
-                accent="#2563eb",
-                icon_svg=BOX_ICON_SVG,
-                theme="blue",
-            ),
-            construir_metric_card(
-                "Cajas por Hora",
-                formatear_entero(cajas_por_hora_turno),
-                "cajas/h",
-                accent="#7c3aed",
-                icon_svg=BOXES_EMPTIED_ICON_SVG,
-                theme="purple",
-            ),
-            construir_metric_card(
-                "Kg Totales",
-                f"{round(kg_acum_turno):,}".replace(",", ".") if kg_acum_turno else "0",
-                "acumulado turno",
-                accent="#f97316",
-                icon_svg=PROCESS_ICON_SVG,
-                theme="orange",
-            ),
-            construir_metric_card(
-                "Kg por Hora",
-                f"{round(kg_por_hora_turno):,}".replace(",", ".") if kg_por_hora_turno else "0",
-                "kg/h",
-                accent="#10b981",
-                icon_svg=CAPACITY_ICON_SVG,
-                theme="green",
-            ),
-            # Quinta métrica: tiempo de turno con detención
-            construir_metric_card(
-                "Tiempo Turno",
-                f"{turno_s // 3600:02d}:{(turno_s % 3600) // 60:02d}:{turno_s % 60:02d}",
-                "tiempo total",
-                accent="#991b1b",
-                icon_svg=TURN_TIME_ICON_SVG,
-                theme="red",
-                badge_text=html.Span(
-                    [
-                        html.Span("Detención: ", className="metric-badge-label"),
-                        html.Span(det_hms, className="metric-badge-time"),
-                    ]
-                ),
-            ),
-        ]
 
-        # Gráfico de cajas
-        pct_cajas = round(pct_cajas, 1)
-        # Calcular bins (cajas por bin, asumiendo ~20 cajas por bin)
-        bins_por_caja = 20.0
-        bins_totales = cajas_totales / bins_por_caja if cajas_totales > 0 else 0
-        bins_vaciadas = cajas_vaciadas / bins_por_caja if cajas_vaciadas > 0 else 0
-        bins_restantes = cajas_restantes / bins_por_caja if cajas_restantes > 0 else 0
-        
-        chart_cajas = [
+    # Detenciones del turno (detector en memoria): parada en curso y linea de tiempo
+    estado_fermo = downtime_detector.DETECTOR.estado(now_chile())
+    fermo_min = max(float(fermo_min or 0), estado_fermo["total_min"])
+    parada_actual = estado_fermo["parada_actual"]
+
+    # Formatear tiempo de detención
+    det_hms = f"{int(fermo_min):02d}:{int((fermo_min % 1) * 60):02d}"
+
+    # Acumulados por turno hasta el lote actual (sumando lotes anteriores + avance actual)
+    cajas_acum_turno, kg_acum_turno = _acumulados_turno(now_chile())
+
+    # Sparklines desde el historial de KPIs que llena _tick_panel
+    def sparkline(kpi, color):
+        version = int(now.timestamp() // kpi_ring.KPI_RING_MIN_S)
+        return f"/api/kpi-sparkline.svg?kpi={kpi}&color={quote(color)}&v={version}"
+
+    # Métricas
+    metricas = [
+        construir_metric_card(
+            "Cajas Totales",
+            f"{formatear_entero(cajas_acum_turno)}",
+            "acumulado turno",
+            accent="#2563eb",
+            icon_svg=BOX_ICON_SVG,
+            theme="blue",
+            sparkline=sparkline("cajas", "#2563eb"),
+        ),
+        construir_metric_card(
+            "Cajas por Hora",
+            formatear_entero(cajas_por_hora_turno),
+            _subtexto_ritmo(ritmo, "cajas", "cajas/h"),
+            accent="#7c3aed",
+            icon_svg=BOXES_EMPTIED_ICON_SVG,
+            theme="purple",
+            sparkline=sparkline("cajas_h", "#7c3aed"),
+        ),
+        construir_metric_card(
+            "Kg Totales",
+            f"{round(kg_acum_turno):,}".replace(",", ".") if kg_acum_turno else "0",
+            "acumulado turno",
+            accent="#f97316",
+            icon_svg=PROCESS_ICON_SVG,
+            theme="orange",
+            sparkline=sparkline("kg", "#f97316"),
+        ),
+        construir_metric_card(
+            "Kg por Hora",
+            f"{round(kg_por_hora_turno):,}".replace(",", ".") if kg_por_hora_turno else "0",
+            _subtexto_ritmo(ritmo, "kg", "kg/h"),
+            accent="#10b981",
+            icon_svg=CAPACITY_ICON_SVG,
+            theme="green",
+            sparkline=sparkline("kg_h", "#10b981"),
+        ),
+        # Quinta métrica: tiempo de turno con detención
+        construir_metric_card(
+            "Tiempo Turno",
+            f"{turno_s // 3600:02d}:{(turno_s % 3600) // 60:02d}:{turno_s % 60:02d}",
+            _subtexto_detenciones(estado_fermo),
+            accent="#991b1b",
+            icon_svg=TURN_TIME_ICON_SVG,
+            theme="red",
+            badge_text=html.Span(
+                [
+                    html.Span("Detención: ", className="metric-badge-label"),
+                    html.Span(det_hms, className="metric-badge-time"),
+                ]
+                + (
+                    [html.Span(
+                        f" · detenida {int(parada_actual['minutos']):02d}:{int((parada_actual['minutos'] % 1) * 60):02d}",
+                        className="metric-badge-alert",
+                    )]
+                    if parada_actual else []
+                )
+            ),
+        ),
+    ]
+
+    # Gráfico de cajas
+    pct_cajas = round(pct_cajas, 1)
+    # Calcular bins (cajas por bin, asumiendo ~20 cajas por bin)
+    bins_por_caja = 20.0
+    bins_totales = cajas_totales / bins_por_caja if cajas_totales > 0 else 0
+    bins_vaciadas = cajas_vaciadas / bins_por_caja if cajas_vaciadas > 0 else 0
+    bins_restantes = cajas_restantes / bins_por_caja if cajas_restantes > 0 else 0
+    
+    chart_cajas = [
+        html.Div([
+            html.Div("Cajas Vaciadas", className="chart-title"),
+            html.Div(className="chart-loader chart-loader-cajas", key=f"cajas-{clave_carga}"),
+        ], className="chart-title-row"),
+        html.Div("Porcentaje completado del lote", className="chart-subtitle"),
+        html.Div([
+            html.Span(f"{pct_cajas}%", style={"fontSize": "3rem", "fontWeight": "900", "color": "#2563eb"}),
             html.Div([
-                html.Div("Cajas Vaciadas", className="chart-title"),
-                html.Div(className="chart-loader chart-loader-cajas", key=f"cajas-{_}"),
-            ], className="chart-title-row"),
-            html.Div("Porcentaje completado del lote", className="chart-subtitle"),
+                html.Div("Capacidad", style={"fontSize": "1rem", "color": "#6b7280"}),
+                html.Div(
+                    f"{formatear_entero(cajas_vaciadas)} de {formatear_entero(cajas_totales)} cajas",
+                    style={"fontSize": "1.1rem"},
+                ),
+            ], className="chart-right-block"),
+        ], style={"display": "flex", "justifyContent": "space-between", "alignItems": "center", "margin": "1rem 0"}),
+        html.Div(
+            html.Div(className="progress-bar", style={"width": f"{pct_cajas}%" if pct_cajas >= 0 else "0%"}),
+            className="progress-bar-container",
+        ),
+        html.Div(className="chart-divider"),
+        html.Div([
             html.Div([
-                html.Span(f"{pct_cajas}%", style={"fontSize": "3rem", "fontWeight": "900", "color": "#2563eb"}),
-                html.Div([
-                    html.Div("Capacidad", style={"fontSize": "1rem", "color": "#6b7280"}),
-                    html.Div(
-                        f"{formatear_entero(cajas_vaciadas)} de {formatear_entero(cajas_totales)} cajas",
-                        style={"fontSize": "1.1rem"},
-                    ),
-                ], className="chart-right-block"),
-            ], style={"display": "flex", "justifyContent": "space-between", "alignItems": "center", "margin": "1rem 0"}),
-            html.Div(
-                html.Div(className="progress-bar", style={"width": f"{pct_cajas}%" if pct_cajas >= 0 else "0%"}),
-                className="progress-bar-container",
-            ),
-            html.Div(className="chart-divider"),
+                html.Div("Planificadas", className="breakdown-label"),
+                html.Div(formatear_entero(cajas_totales), className="breakdown-value"),
+                html.Div(
+                    f"{bins_totales:.1f} bins",
+                    style={"fontSize": "0.85rem", "color": "#6b7280", "marginTop": "2px"},
+                ),
+            ], className="breakdown-item"),
             html.Div([
-                html.Div([
-                    html.Div("Planificadas", className="breakdown-label"),
-                    html.Div(formatear_entero(cajas_totales), className="breakdown-value"),
-                    html.Div(
-                        f"{bins_totales:.1f} bins",
-                        style={"fontSize": "0.85rem", "color": "#6b7280", "marginTop": "2px"},
-                    ),
-                ], className="breakdown-item"),
-                html.Div([
-                    html.Div("Usadas", className="breakdown-label"),
-                    html.Div(
-                        formatear_entero(cajas_vaciadas),
-                        className="breakdown-value",
-                        style={"color": "#2563eb"},
-                    ),
-                    html.Div(
-                        f"{bins_vaciadas:.1f} bins",
-                        style={"fontSize": "0.85rem", "color": "#6b7280", "marginTop": "2px"},
-                    ),
-                ], className="breakdown-item"),
-                html.Div([
-                    html.Div("Disponibles", className="breakdown-label"),
-                    html.Div(
-                        formatear_entero(cajas_restantes),
-                        className="breakdown-value",
-                        style={"color": "#f97316"},
-                    ),
-                    html.Div(
-                        f"{bins_restantes:.1f} bins",
-                        style={"fontSize": "0.85rem", "color": "#6b7280", "marginTop": "2px"},
-                    ),
-                ], className="breakdown-item"),
-            ], className="breakdown-grid"),
-        ]
-
-        # Gráfico de kg
-        kg_totales_safe = kg_totales if kg_totales and kg_totales > 0 else 1
-        pct_kg_restantes = round((kg_restantes / kg_totales_safe) * 100, 1) if kg_totales > 0 else 0
-        chart_kg = [
+                html.Div("Usadas", className="breakdown-label"),
+                html.Div(
+                    formatear_entero(cajas_vaciadas),
+                    className="breakdown-value",
+                    style={"color": "#2563eb"},
+                ),
+                html.Div(
+                    f"{bins_vaciadas:.1f} bins",
+                    style={"fontSize": "0.85rem", "color": "#6b7280", "marginTop": "2px"},
+                ),
+            ], className="breakdown-item"),
             html.Div([
-                html.Div("Kilogramos Restantes", className="chart-title"),
-                html.Div(className="chart-loader chart-loader-kg", key=f"kg-{_}"),
-            ], className="chart-title-row"),
-            html.Div("Disponibilidad en almacén", className="chart-subtitle"),
+                html.Div("Disponibles", className="breakdown-label"),
+                html.Div(
+                    formatear_entero(cajas_restantes),
+                    className="breakdown-value",
+                    style={"color": "#f97316"},
+                ),
+                html.Div(
+                    f"{bins_restantes:.1f} bins",
+                    style={"fontSize": "0.85rem", "color": "#6b7280", "marginTop": "2px"},
+                ),
+            ], className="breakdown-item"),
+        ], className="breakdown-grid"),
+    ]
+
+    # Gráfico de kg
+    kg_totales_safe = kg_totales if kg_totales and kg_totales > 0 else 1
+    pct_kg_restantes = round((kg_restantes / kg_totales_safe) * 100, 1) if kg_totales > 0 else 0
+    chart_kg = [
+        html.Div([
+            html.Div("Kilogramos Restantes", className="chart-title"),
+            html.Div(className="chart-loader chart-loader-kg", key=f"kg-{clave_carga}"),
+        ], className="chart-title-row"),
+        html.Div("Disponibilidad en almacén", className="chart-subtitle"),
+        html.Div([
+            html.Span(
+                f"{pct_kg_restantes}%",
+                style={"fontSize": "3rem", "fontWeight": "900", "color": "#10b981"},
+            ),
             html.Div([
-                html.Span(
-                    f"{pct_kg_restantes}%",
-                    style={"fontSize": "3rem", "fontWeight": "900", "color": "#10b981"},
+                html.Div("Restantes", style={"fontSize": "1rem", "color": "#6b7280"}),
+                html.Div(
+                    f"{formatear_entero(kg_restantes)} kg",
+                    style={"fontSize": "1.1rem"},
                 ),
-                html.Div([
-                    html.Div("Restantes", style={"fontSize": "1rem", "color": "#6b7280"}),
-                    html.Div(
-                        f"{formatear_entero(kg_restantes)} kg",
-                        style={"fontSize": "1.1rem"},
-                    ),
-                ], className="chart-right-block"),
-            ], style={"display": "flex", "justifyContent": "space-between", "alignItems": "center", "margin": "1rem 0"}),
+            ], className="chart-right-block"),
+        ], style={"display": "flex", "justifyContent": "space-between", "alignItems": "center", "margin": "1rem 0"}),
+        html.Div(
             html.Div(
+                className="progress-bar",
+                style={
+                    "width": f"{pct_kg_restantes}%" if pct_kg_restantes >= 0 else "0%",
+                    "background": "linear-gradient(90deg, #10b981, #059669)",
+                },
+            ),
+            className="progress-bar-container",
+        ),
+        html.Div(className="chart-divider"),
+        html.Div([
+            html.Div([
+                html.Div("Total", className="breakdown-label"),
+                html.Div(formatear_entero(kg_totales), className="breakdown-value"),
+            ], className="breakdown-item"),
+            html.Div([
+                html.Div("Usado", className="breakdown-label"),
                 html.Div(
-                    className="progress-bar",
-                    style={
-                        "width": f"{pct_kg_restantes}%" if pct_kg_restantes >= 0 else "0%",
-                        "background": "linear-gradient(90deg, #10b981, #059669)",
-                    },
+                    formatear_entero(kg_vaciados),
+                    className="breakdown-value",
+                    style={"color": "#f97316"},
                 ),
-                className="progress-bar-container",
-            ),
-            html.Div(className="chart-divider"),
+            ], className="breakdown-item"),
             html.Div([
-                html.Div([
-                    html.Div("Total", className="breakdown-label"),
-                    html.Div(formatear_entero(kg_totales), className="breakdown-value"),
-                ], className="breakdown-item"),
-                html.Div([
-                    html.Div("Usado", className="breakdown-label"),
-                    html.Div(
-                        formatear_entero(kg_vaciados),
-                        className="breakdown-value",
-                        style={"color": "#f97316"},
-                    ),
-                ], className="breakdown-item"),
-                html.Div([
-                    html.Div("Disponible", className="breakdown-label"),
-                    html.Div(
-                        formatear_entero(kg_restantes),
-                        className="breakdown-value",
-                        style={"color": "#10b981"},
-                    ),
-                ], className="breakdown-item"),
-            ], className="breakdown-grid"),
-        ]
+                html.Div("Disponible", className="breakdown-label"),
+                html.Div(
+                    formatear_entero(kg_restantes),
+                    className="breakdown-value",
+                    style={"color": "#10b981"},
+                ),
+            ], className="breakdown-item"),
+        ], className="breakdown-grid"),
+    ]
 
-        # Tabla de detalle
-        detalle_df = get_detalle_lotti_ingresso()
+    # Tabla de detalle
+    detalle_df = get_detalle_lotti_ingresso()
 
-        if detalle_df is not None and not detalle_df.empty:
-            columnas_ordenadas = [
-                "Fecha y Hora", "CSG", "Productor", "Proceso", "Lote",
-                "Cjs Planificadas", "Cjs Vaciadas", "Cjs Restantes", "Var Real", "Peso (Kg)"
-            ]
-            columnas_existentes = [c for c in columnas_ordenadas if c in detalle_df.columns]
-            df_detalle_para_tabla = detalle_df.copy()
+    if detalle_df is not None and not detalle_df.empty:
+        columnas_ordenadas = [
+            "Fecha y Hora", "CSG", "Productor", "Proceso", "Lote",
+            "Cjs Planificadas", "Cjs Vaciadas", "Cjs Restantes", "Var Real", "Peso (Kg)"
+        ]
+        columnas_existentes = [c for c in columnas_ordenadas if c in detalle_df.columns]
+        df_detalle_para_tabla = detalle_df.copy()
 
-            # Mostrar solo registros del turno actual:
-            # - Turno dia: 07:00 a 17:00
-            # - Turno noche: 17:30 a 04:00 (cruza de dia)
-            # Mantener siempre el lote actual aunque quede fuera de rango.
-            try:
-                if "Fecha y Hora" in df_detalle_para_tabla.columns:
-                    df_detalle_para_tabla["_fecha_dt"] = pd.to_datetime(
-                        df_detalle_para_tabla["Fecha y Hora"], format="%d/%m/%Y %H:%M:%S", errors="coerce"
-                    )
-                    if lote_actual is not None:
-                        mask_current = df_detalle_para_tabla["Lote"].astype(str) == str(lote_actual)
-                    else:
-                        mask_current = pd.Series([False] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
-                    now = now_chile()
-                    t = now.time()
-                    day_start = datetime.time(7, 0)
-                    day_end = datetime.time(17, 0)
-                    night_start = datetime.time(17, 0)
-                    night_end = datetime.time(4, 0)
-                    if t >= night_start or t < night_end:
-                        # Turno noche: desde hoy 17:30 o desde ayer 17:30 si es madrugada
-                        if t < night_end:
-                            start_dt = datetime.datetime.combine(now.date() - datetime.timedelta(days=1), night_start)
-                            end_dt = datetime.datetime.combine(now.date(), night_end)
-                        else:
-                            start_dt = datetime.datetime.combine(now.date(), night_start)
-                            end_dt = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), night_end)
+        # Mostrar solo registros del turno actual:
+        # - Turno dia: 07:00 a 17:00
+        # - Turno noche: 17:30 a 04:00 (cruza de dia)
+        # Mantener siempre el lote actual aunque quede fuera de rango.
+        try:
+            if "Fecha y Hora" in df_detalle_para_tabla.columns:
+                df_detalle_para_tabla["_fecha_dt"] = pd.to_datetime(
+                    df_detalle_para_tabla["Fecha y Hora"], format="%d/%m/%Y %H:%M:%S", errors="coerce"
+                )
+                if lote_actual is not None:
+                    mask_current = df_detalle_para_tabla["Lote"].astype(str) == str(lote_actual)
+                else:
+                    mask_current = pd.Series([False] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
+                now = now_chile()
+                t = now.time()
+                day_start = datetime.time(7, 0)
+                day_end = datetime.time(17, 0)
+                night_start = datetime.time(17, 0)
+                night_end = datetime.time(4, 0)
+                if t >= night_start or t < night_end:
+                    # Turno noche: desde hoy 17:30 o desde ayer 17:30 si es madrugada
+                    if t < night_end:
+                        start_dt = datetime.datetime.combine(now.date() - datetime.timedelta(days=1), night_start)
+                        end_dt = datetime.datetime.combine(now.date(), night_end)
                     else:
-                        # Turno dia (incluye 17:00-17:30 si cae en ese rango)
-                        start_dt = datetime.datetime.combine(now.date(), day_start)
-                        end_dt = datetime.datetime.combine(now.date(), day_end)
-                    mask_shift = (df_detalle_para_tabla["_fecha_dt"] >= start_dt) & (
-                        df_detalle_para_tabla["_fecha_dt"] <= end_dt
-                    )
-                    # Ocultar lotes futuros: solo mostrar procesados (fecha <= ahora) y lote actual
-                    mask_processed = df_detalle_para_tabla["_fecha_dt"] <= now
-                    df_detalle_para_tabla = df_detalle_para_tabla.loc[(mask_shift & mask_processed) | mask_current]
-            except Exception:
-                pass
+                        start_dt = datetime.datetime.combine(now.date(), night_start)
+                        end_dt = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), night_end)
+                else:
+                    # Turno dia (incluye 17:00-17:30 si cae en ese rango)
+                    start_dt = datetime.datetime.combine(now.date(), day_start)
+                    end_dt = datetime.datetime.combine(now.date(), day_end)
+                mask_shift = (df_detalle_para_tabla["_fecha_dt"] >= start_dt) & (
+                    df_detalle_para_tabla["_fecha_dt"] <= end_dt
+                )
+                # Ocultar lotes futuros: solo mostrar procesados (fecha <= ahora) y lote actual
+                mask_processed = df_detalle_para_tabla["_fecha_dt"] <= now
+                df_detalle_para_tabla = df_detalle_para_tabla.loc[(mask_shift & mask_processed) | mask_current]
+        except Exception:
+            pass
 
-            # Asegurar fecha/hora visible para el lote actual si viene vacia
-            try:
-                if "Fecha y Hora" in df_detalle_para_tabla.columns and lote_actual is not None:
-                    mask_current = df_detalle_para_tabla["Lote"].astype(str) == str(lote_actual)
-                    empty_mask = df_detalle_para_tabla["Fecha y Hora"].isna() | (
-                        df_detalle_para_tabla["Fecha y Hora"].astype(str).str.strip().isin(["", "nan", "None", "NaT"])
-                    )
-                    if (mask_current & empty_mask).any():
+        # Asegurar fecha/hora visible para el lote actual si viene vacia
+        try:
+            if "Fecha y Hora" in df_detalle_para_tabla.columns and lote_actual is not None:
+                mask_current = df_detalle_para_tabla["Lote"].astype(str) == str(lote_actual)
+                empty_mask = df_detalle_para_tabla["Fecha y Hora"].isna() | (
+                    df_detalle_para_tabla["Fecha y Hora"].astype(str).str.strip().isin(["", "nan", "None", "NaT"])
+                )
+                if (mask_current & empty_mask).any():
+                    fecha_lote = None
+                    try:
+                        fecha_lote = datos_lote.get("Fecha y Hora") if isinstance(datos_lote, dict) else None
+                    except Exception:
                         fecha_lote = None
-                        try:
-                            fecha_lote = datos_lote.get("Fecha y Hora") if isinstance(datos_lote, dict) else None
-                        except Exception:
-                            fecha_lote = None
-                        if fecha_lote:
-                            df_detalle_para_tabla.loc[mask_current & empty_mask, "Fecha y Hora"] = fecha_lote
-            except Exception:
-                pass
+                    if fecha_lote:
+                        df_detalle_para_tabla.loc[mask_current & empty_mask, "Fecha y Hora"] = fecha_lote
+        except Exception:
+            pass
 
-            # Dejar solo registros ya procesados + lote actual
-            try:
-                if "Cjs Vaciadas" in df_detalle_para_tabla.columns:
-                    cjs_vac = pd.to_numeric(df_detalle_para_tabla["Cjs Vaciadas"], errors="coerce").fillna(0)
-                    if lote_actual is not None:
-                        mask_current = df_detalle_para_tabla["Lote"].astype(str) == str(lote_actual)
-                    else:
-                        mask_current = pd.Series([False] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
-                    keep_mask = (cjs_vac > 0) | mask_current
-                    df_detalle_para_tabla = df_detalle_para_tabla.loc[keep_mask]
-            except Exception:
-                pass
+        # Dejar solo registros ya procesados + lote actual
+        try:
+            if "Cjs Vaciadas" in df_detalle_para_tabla.columns:
+                cjs_vac = pd.to_numeric(df_detalle_para_tabla["Cjs Vaciadas"], errors="coerce").fillna(0)
+                if lote_actual is not None:
+                    mask_current = df_detalle_para_tabla["Lote"].astype(str) == str(lote_actual)
+                else:
+                    mask_current = pd.Series([False] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
+                keep_mask = (cjs_vac > 0) | mask_current
+                df_detalle_para_tabla = df_detalle_para_tabla.loc[keep_mask]
+        except Exception:
+            pass
 
-            # Ajustar "Cjs Vaciadas" / "Cjs Restantes" para lotes no actuales:
-            # - Lotes anteriores al actual: Vaciadas = Planificadas, Restantes = 0.
-            # - Lotes posteriores al actual: Vaciadas = 0, Restantes = Planificadas.
-            try:
-                if (
-                    "Cjs Restantes" in df_detalle_para_tabla.columns
-                    and "Cjs Planificadas" in df_detalle_para_tabla.columns
-                    and "Cjs Vaciadas" in df_detalle_para_tabla.columns
-                ):
-                    cjs_plan = pd.to_numeric(df_detalle_para_tabla["Cjs Planificadas"], errors="coerce").fillna(0)
-                    dt_col = "_orden_dt"
-                    if "Fecha y Hora" in df_detalle_para_tabla.columns:
-                        df_detalle_para_tabla[dt_col] = pd.to_datetime(
-                            df_detalle_para_tabla["Fecha y Hora"], format="%d/%m/%Y %H:%M:%S", errors="coerce"
-                        )
-                    else:
-                        df_detalle_para_tabla[dt_col] = pd.NaT
-                    if lote_actual is not None:
-                        mask_current = df_detalle_para_tabla["Lote"].astype(str) == str(lote_actual)
-                    else:
-                        mask_current = pd.Series([False] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
+        # Ajustar "Cjs Vaciadas" / "Cjs Restantes" para lotes no actuales:
+        # - Lotes anteriores al actual: Vaciadas = Planificadas, Restantes = 0.
+        # - Lotes posteriores al actual: Vaciadas = 0, Restantes = Planificadas.
+        try:
+            if (
+                "Cjs Restantes" in df_detalle_para_tabla.columns
+                and "Cjs Planificadas" in df_detalle_para_tabla.columns
+                and "Cjs Vaciadas" in df_detalle_para_tabla.columns
+            ):
+                cjs_plan = pd.to_numeric(df_detalle_para_tabla["Cjs Planificadas"], errors="coerce").fillna(0)
+                dt_col = "_orden_dt"
+                if "Fecha y Hora" in df_detalle_para_tabla.columns:
+                    df_detalle_para_tabla[dt_col] = pd.to_datetime(
+                        df_detalle_para_tabla["Fecha y Hora"], format="%d/%m/%Y %H:%M:%S", errors="coerce"
+                    )
+                else:
+                    df_detalle_para_tabla[dt_col] = pd.NaT
+                if lote_actual is not None:
+                    mask_current = df_detalle_para_tabla["Lote"].astype(str) == str(lote_actual)
+                else:
+                    mask_current = pd.Series([False] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
+                current_dt = None
+                try:
+                    if mask_current.any():
+                        current_dt = df_detalle_para_tabla.loc[mask_current, dt_col].min()
+                except Exception:
                     current_dt = None
+                if "Proceso" in df_detalle_para_tabla.columns and current_dt is not None and pd.notna(current_dt):
+                    cur_proc = None
                     try:
                         if mask_current.any():
-                            current_dt = df_detalle_para_tabla.loc[mask_current, dt_col].min()
+                            cur_proc = str(df_detalle_para_tabla.loc[mask_current, "Proceso"].iloc[0])
                     except Exception:
-                        current_dt = None
-                    if "Proceso" in df_detalle_para_tabla.columns and current_dt is not None and pd.notna(current_dt):
                         cur_proc = None
-                        try:
-                            if mask_current.any():
-                                cur_proc = str(df_detalle_para_tabla.loc[mask_current, "Proceso"].iloc[0])
-                        except Exception:
-                            cur_proc = None
-                        if cur_proc:
-                            in_proc = df_detalle_para_tabla["Proceso"].astype(str) == cur_proc
-                        else:
-                            in_proc = pd.Series([True] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
-                        before_current = in_proc & (df_detalle_para_tabla[dt_col] < current_dt)
-                        after_current = in_proc & (df_detalle_para_tabla[dt_col] > current_dt)
+                    if cur_proc:
+                        in_proc = df_detalle_para_tabla["Proceso"].astype(str) == cur_proc
                     else:
-                        before_current = pd.Series([False] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
-                        after_current = pd.Series([False] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
-                    mask_other = ~mask_current
-                    mask_past = mask_other & before_current
-                    mask_future = mask_other & after_current
-                    # Anteriores: ya completados
-                    df_detalle_para_tabla.loc[mask_past, "Cjs Vaciadas"] = cjs_plan[mask_past]
-                    df_detalle_para_tabla.loc[mask_past, "Cjs Restantes"] = 0
-                    # Posteriores: aún no iniciados
-                    df_detalle_para_tabla.loc[mask_future, "Cjs Vaciadas"] = 0
-                    df_detalle_para_tabla.loc[mask_future, "Cjs Restantes"] = cjs_plan[mask_future]
-            except Exception:
-                pass
-
-            # Convertir columnas numéricas a string para filtrado
-            for col in ["Cjs Planificadas", "Cjs Vaciadas", "Cjs Restantes", "Peso (Kg)"]:
-                if col in df_detalle_para_tabla.columns:
-                    df_detalle_para_tabla[col] = df_detalle_para_tabla[col].fillna('').astype(str)
-
-            data = df_detalle_para_tabla.to_dict("records")
-            columns = [{"name": c, "id": c, "type": "text"} for c in columnas_existentes]
-
-            # Resaltar lote actual
-            style_conditional = []
-            if lote_actual and "Lote" in df_detalle_para_tabla.columns:
-                query = f'{{Lote}} = "{lote_actual}"'
-                style_conditional.append({
-                    "if": {"filter_query": query},
-                    "backgroundColor": "rgba(16,185,129,0.10)",
-                    "fontWeight": "800",
-                    "borderTop": "1px solid rgba(16,185,129,0.18)",
-                    "borderBottom": "1px solid rgba(16,185,129,0.18)",
-                })
-        else:
-            data, columns, style_conditional = [], [], []
+                        in_proc = pd.Series([True] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
+                    before_current = in_proc & (df_detalle_para_tabla[dt_col] < current_dt)
+                    after_current = in_proc & (df_detalle_para_tabla[dt_col] > current_dt)
+                else:
+                    before_current = pd.Series([False] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
+                    after_current = pd.Series([False] * len(df_detalle_para_tabla), index=df_detalle_para_tabla.index)
+                mask_other = ~mask_current
+                mask_past = mask_other & before_current
+                mask_future = mask_other & after_current
+                # Anteriores: ya completados
+                df_detalle_para_tabla.loc[mask_past, "Cjs Vaciadas"] = cjs_plan[mask_past]
+                df_detalle_para_tabla.loc[mask_past, "Cjs Restantes"] = 0
+                # Posteriores: aún no iniciados
+                df_detalle_para_tabla.loc[mask_future, "Cjs Vaciadas"] = 0
+                df_detalle_para_tabla.loc[mask_future, "Cjs Restantes"] = cjs_plan[mask_future]
+        except Exception:
+            pass
+
+        # Convertir columnas numéricas a string para filtrado
+        for col in ["Cjs Planificadas", "Cjs Vaciadas", "Cjs Restantes", "Peso (Kg)"]:
+            if col in df_detalle_para_tabla.columns:
+                df_detalle_para_tabla[col] = df_detalle_para_tabla[col].fillna('').astype(str)
+
+        data = df_detalle_para_tabla.to_dict("records")
+        columns = [{"name": c, "id": c, "type": "text"} for c in columnas_existentes]
+
+        # Resaltar lote actual
+        style_conditional = []
+        if lote_actual and "Lote" in df_detalle_para_tabla.columns:
+            query = f'{{Lote}} = "{lote_actual}"'
+            style_conditional.append({
+                "if": {"filter_query": query},
+                "backgroundColor": "rgba(16,185,129,0.10)",
+                "fontWeight": "800",
+                "borderTop": "1px solid rgba(16,185,129,0.18)",
+                "borderBottom": "1px solid rgba(16,185,129,0.18)",
+            })
+    else:
+        data, columns, style_conditional = [], [], []
 
-        # Calcular ETA (tiempo estimado de fin de lote) basado en horario real del turno
+    # Calcular ETA (tiempo estimado de fin de lote): ritmo de vaciado o, en su defecto, horario del turno
+    try:
+        conn_eta = get_connection()
+        now_eta = now_chile()
+        stats_lote = inicio_lote = None
         try:
-            conn_eta = get_connection()
-            now_eta = now_chile()
             current_eta, next_dt_eta, _, _ = _get_current_lot_schedule(conn_eta, now_eta)
+            if lote_actual and datos_lote:
+                stats_lote, inicio_lote = _duracion_tipica_lote(conn_eta, datos_lote.get("Proceso"), lote_actual)
+        finally:
             conn_eta.close()
-            if current_eta and next_dt_eta:
-                fin_estimado = max(current_eta["dt"], next_dt_eta)
-                remaining_s = max(0, int((fin_estimado - now_eta).total_seconds()))
-                eta_store = {
-                    "lote": str(current_eta.get("lote")) if current_eta.get("lote") else None,
-                    "remaining_s": remaining_s,
-                    "generated_ms": int(time.time() * 1000.0),
-                    "end_iso": fin_estimado.isoformat(),
-                }
-            else:
-                eta_store = {
-                    "lote": str(lote_actual) if lote_actual else None,
-                    "remaining_s": 0,
-                    "generated_ms": int(time.time() * 1000.0),
-                    "end_iso": now_chile().isoformat(),
-                }
-        except Exception:
+        # Ritmo real de vaciado del lote en curso; sin muestras suficientes se usa el horario
+        prediccion = None
+        if lote_actual and datos_lote:
+            prediccion = eta_predictor.PREDICTOR.predecir(datos_lote.get("Proceso"), lote_actual, cajas_restantes, now_eta)
+        fin_horario = max(current_eta["dt"], next_dt_eta) if current_eta and next_dt_eta else None
+        if prediccion:
+            fin_estimado = prediccion["fin"]
+            eta_store = {
+                "lote": str(lote_actual),
+                "remaining_s": max(0, int((fin_estimado - now_eta).total_seconds())),
+                "generated_ms": int(clock.time() * 1000.0),
+                "end_iso": fin_estimado.isoformat(),
+                "end_min_iso": prediccion["fin_min"].isoformat(),
+                "end_max_iso": prediccion["fin_max"].isoformat() if prediccion["fin_max"] else None,
+                "tasa_cpm": prediccion["tasa_cpm"],
+                "schedule_end_iso": fin_horario.isoformat() if fin_horario else None,
+                "fuente": "ritmo",
+            }
+        elif fin_horario:
+            fin_estimado = fin_horario
+            remaining_s = max(0, int((fin_estimado - now_eta).total_seconds()))
+            eta_store = {
+                "lote": str(current_eta.get("lote")) if current_eta.get("lote") else None,
+                "remaining_s": remaining_s,
+                "generated_ms": int(clock.time() * 1000.0),
+                "end_iso": fin_estimado.isoformat(),
+                "fuente": "horario",
+            }
+        elif stats_lote and inicio_lote:
+            # Sin ritmo ni horario: inicio del lote + duracion mediana de lotes parecidos
+            fin_estimado = max(now_eta, inicio_lote + datetime.timedelta(minutes=stats_lote["p50_min"]))
+            eta_store = {
+                "lote": str(lote_actual),
+                "remaining_s": max(0, int((fin_estimado - now_eta).total_seconds())),
+                "generated_ms": int(clock.time() * 1000.0),
+                "end_iso": fin_estimado.isoformat(),
+                "fuente": "historico",
+            }
+        else:
             eta_store = {
                 "lote": str(lote_actual) if lote_actual else None,
                 "remaining_s": 0,
-                "generated_ms": int(time.time() * 1000.0),
+                "generated_ms": int(clock.time() * 1000.0),
                 "end_iso": now_chile().isoformat(),
             }
-
-        # Snapshot para optimización
-        next_snapshot = {
-            "kpis": {
-                "lote": str(lote_actual) if lote_actual else None,
-                "cajas_totales": cajas_totales,
-                "cajas_vaciadas": cajas_vaciadas,
-                "kg_totales": float(kg_totales),
-            },
-            "filtros": filtros,
+        if stats_lote and inicio_lote:
+            transcurrido = lot_stats.evaluar_duracion(stats_lote, (now_eta - inicio_lote).total_seconds() / 60.0)
+            if transcurrido:
+                eta_store.update(
+                    p50_min=stats_lote["p50_min"],
+                    p90_min=transcurrido["p90_min"],
+                    lote_largo=transcurrido["excedido"],
+                )
+    except Exception:
+        eta_store = {
+            "lote": str(lote_actual) if lote_actual else None,
+            "remaining_s": 0,
+            "generated_ms": int(clock.time() * 1000.0),
+            "end_iso": now_chile().isoformat(),
         }
 
+    # Snapshot para optimización
+    next_snapshot = {
+        "kpis": {
+            "lote": str(lote_actual) if lote_actual else None,
+            "cajas_totales": cajas_totales,
+            "cajas_vaciadas": cajas_vaciadas,
+            "kg_totales": float(kg_totales),
+        },
+        "filtros": filtros,
+        # Frescura: version/hora de escritura de los datos y hora de esta respuesta (reloj del servidor)
+        "freshness": dict(sello_datos or {}, served_ms=int(time.time() * 1000.0)),
+    }
+
+
+    return (
+        metricas,
+        filtros_children,
+        chart_cajas,
+        chart_kg,
+        data,
+        columns,
+        style_conditional,
+        next_snapshot,
+        {  # fermo-baseline-store
+            "turno": estado_fermo["turno"],
+            "total_min": estado_fermo["total_min"],
+            "parada_desde": parada_actual["inicio"].isoformat() if parada_actual else None,
+        },
+        None,  # lote-finish-store
+        None,  # det-por-lote-store
+        eta_store,  # eta-store
+    )
 
-        return (
-            metricas,
-            filtros_children,
-            chart_cajas,
-            chart_kg,
-            data,
-            columns,
-            style_conditional,
-            next_snapshot,
-            None,  # fermo-baseline-store
-            None,  # lote-finish-store
-            None,  # det-por-lote-store
-            eta_store,  # eta-store
-        )
-
-    except Exception as e:
-        # En caso de error, devolver valores por defecto
-        error_msg = f"Error: {str(e)}"
-        return (
-            [construir_metric_card("Error", error_msg, "", "#ef4444", theme="red")],
-            html.Div("Error cargando filtros", className="filter-grid"),
-            html.Div(error_msg, style={"padding": "20px", "color": "red"}),
-            html.Div(error_msg, style={"padding": "20px", "color": "red"}),
-            [],
-            [],
-            [],
-            {},
-            None,
-            None,
-            None,
-            None,  # eta-store
-        )
-
-    # Callbacks para actualizar la hora y el indicador de refresh
+# Callbacks para actualizar la hora y el indicador de refresh
 @app.callback(
     Output("hora-actual", "children"),
     Output("refresh-indicator", "children"),
     Input("interval-eta", "n_intervals"),
 )
+@medir_callback("update_time_and_refresh")
 def update_time_and_refresh(n):
-    hora = now_chile().strftime("%d/%m/%Y %H:%M:%S")
+    ahora = now_chile()
+    estado = _PANEL_CACHE.estado()
+    if estado.get("stale") and estado.get("ultimo_ok_ts"):
+        # Mostrar la hora de la ultima foto valida, no la hora actual
+        ahora = ahora - datetime.timedelta(seconds=max(0.0, time.time() - estado["ultimo_ok_ts"]) * clock.factor())
+    hora = ahora.strftime("%d/%m/%Y %H:%M:%S")
     # Indicador de refresh (igual que el original)
     refresh_indicator = html.Div(
         [
@@ -1191,12 +1799,47 @@ def update_time_and_refresh(n):
     )
     return hora, refresh_indicator
 
+# Badges de estado de datos: foto desactualizada y circuito de BD abierto
+@app.callback(
+    Output("panel-stale-badge", "children"),
+    Input("interval-eta", "n_intervals"),
+)
+@medir_callback("update_stale_badge")
+def update_stale_badge(n):
+    badges = []
+    estado = _PANEL_CACHE.estado()
+    if estado.get("stale"):
+        stale_s = int(estado.get("stale_segundos") or 0)
+        texto = f"Datos desactualizados hace {stale_s // 60:02d}:{stale_s % 60:02d}"
+        if estado.get("refresco_en_curso"):
+            texto += " · reintentando"
+        badges.append(html.Div(texto, className="stale-badge", title=estado.get("ultimo_error") or ""))
+
+    circuito = get_db_circuit_status() or {}
+    if circuito.get("estado") == "open":
+        reintento_s = int(round(circuito.get("reintento_en_s") or 0))
+        badges.append(
+            html.Div(
+                f"BD sin conexión · reintento en {reintento_s}s",
+                className="stale-badge circuit-badge circuit-open",
+                title=circuito.get("ultimo_error") or "",
+            )
+        )
+    elif circuito.get("estado") == "half_open":
+        badges.append(html.Div("BD: probando conexión", className="stale-badge circuit-badge circuit-half-open"))
+
+    reloj = clock.get_clock()
+    if reloj.virtual:
+        badges.append(html.Div(f"Reloj virtual x{reloj.factor:g}", className="stale-badge clock-badge"))
+    return badges or None
+
 # Callback para el tiempo estimado de fin de lote
 @app.callback(
     Output("eta-lote", "children"),
     Input("interval-eta", "n_intervals"),
     State("eta-store", "data"),
 )
+@medir_callback("update_eta")
 def update_eta(n, eta_data):
     if not eta_data:
         return "--:--:--"
@@ -1239,21 +1882,153 @@ def update_eta(n, eta_data):
 
             result = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
             fecha_actual = now_chile().strftime("%d/%m/%Y")
-            return f"{fecha_actual} {result}"
+            texto = f"{fecha_actual} {result}"
+            detalle = []
+            if eta_data.get("fuente") == "ritmo":
+                rango = [
+                    (eta_data.get(k) or "")[11:16] or "?"
+                    for k in ("end_min_iso", "end_max_iso")
+                ]
+                detalle.append(f"Ritmo {eta_data.get('tasa_cpm')} cajas/min · fin entre {rango[0]} y {rango[1]}")
+            elif eta_data.get("fuente") == "historico":
+                detalle.append("Estimado con la duracion mediana de lotes similares")
+            if eta_data.get("p90_min"):
+                detalle.append(
+                    f"Lotes similares: p50 {eta_data.get('p50_min'):.0f} min, p90 {eta_data['p90_min']:.0f} min"
+                )
+            if not detalle:
+                return texto
+            return html.Span(
+                texto,
+                title=" · ".join(detalle),
+                className="eta-lote-largo" if eta_data.get("lote_largo") else None,
+            )
         return "--:--:--"
     except Exception:
         return "--:--:--"
 
-# Callbacks para tabs (Análisis Gráfico / Detalle Completo)
+# Callbacks para tabs (Análisis Gráfico / Detalle Completo / Tendencia Histórica)
 @app.callback(
     [Output("tab-analisis-container", "style"),
-     Output("tab-detalle-container", "style")],
+     Output("tab-detalle-container", "style"),
+     Output("tab-tendencia-container", "style")],
     [Input("tabs", "value")],
 )
+@medir_callback("render_tab")
 def render_tab(tab_value):
+    oculto = {"display": "none"}
     if tab_value == "tab-detalle":
-        return {"display": "none"}, {"display": "block", "margin": "0 1.5rem 2rem 1.5rem"}
-    return {"display": "block"}, {"display": "none"}
+        return oculto, {"display": "block", "margin": "0 1.5rem 2rem 1.5rem"}, oculto
+    if tab_value == "tab-tendencia":
+        return oculto, oculto, {"display": "block", "margin": "0 1.5rem 2rem 1.5rem"}
+    return {"display": "block"}, oculto, oculto
+
+@app.callback(
+    Output("tendencia-grafico", "figure"),
+    [Input("tabs", "value"),
+     Input("tendencia-granularidad", "value"),
+     Input("tendencia-dias", "value"),
+     Input("tendencia-proceso", "value"),
+     Input("interval-notif", "n_intervals")],
+)
+@medir_callback("actualizar_tendencia")
+def actualizar_tendencia(tab_value, granularidad, dias, proceso, _n):
+    # Solo se consulta con el tab visible; la serie sale de los rollups (cientos de filas)
+    if tab_value != "tab-tendencia":
+        return dash.no_update
+    try:
+        conn = get_connection()
+        try:
+            serie = production_rollups.serie(
+                conn, granularidad or "turno", dias or 30, proceso or None, ahora=now_chile()
+            )
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"[WARN] Tendencia no disponible: {e}")
+        serie = []
+
+    periodos = [f["periodo"] for f in serie]
+    return {
+        "data": [
+            {
+                "type": "bar",
+                "name": "Cajas",
+                "x": periodos,
+                "y": [f["cajas"] for f in serie],
+                "marker": {"color": "#2563eb"},
+            },
+            {
+                "type": "scatter",
+                "mode": "lines+markers",
+                "name": "Duración media lote (min)",
+                "x": periodos,
+                "y": [f["duracion_media_min"] for f in serie],
+                "yaxis": "y2",
+                "line": {"color": "#f59e0b"},
+            },
+            {
+                "type": "scatter",
+                "mode": "lines",
+                "name": "Detención (min)",
+                "x": periodos,
+                "y": [f["fermo_min"] for f in serie],
+                "yaxis": "y2",
+                "line": {"color": "#dc2626", "dash": "dot"},
+            },
+        ],
+        "layout": {
+            "title": {"text": "Cajas vaciadas" + (f" - {proceso}" if proceso else "")},
+            "xaxis": {"type": "category", "nticks": 12},
+            "yaxis": {"title": {"text": "Cajas"}},
+            "yaxis2": {"title": {"text": "Minutos"}, "overlaying": "y", "side": "right", "rangemode": "tozero"},
+            "legend": {"orientation": "h", "y": -0.2},
+            "margin": {"l": 60, "r": 60, "t": 50, "b": 60},
+            "height": 460,
+        },
+    }
+
+# Frescura: al pintar un snapshot nuevo el navegador informa version y hora de render
+app.clientside_callback(
+    """
+    function(snapshot) {
+        var f = snapshot && snapshot.freshness;
+        if (!f || f.version === undefined || f.version === null) {
+            return window.dash_clientside.no_update;
+        }
+        var cliente = "anon";
+        try {
+            cliente = window.localStorage.getItem("panel-client-id");
+            if (!cliente) {
+                cliente = Math.random().toString(36).slice(2, 10) + Date.now().toString(36);
+                window.localStorage.setItem("panel-client-id", cliente);
+            }
+        } catch (e) {}
+        var info = {
+            cliente: cliente,
+            version: f.version,
+            write_ts_ms: f.write_ts_ms,
+            served_ms: f.served_ms,
+            recibido_ms: Date.now()
+        };
+        window.requestAnimationFrame(function () {
+            var reporte = Object.assign({}, info, {render_ms: Date.now()});
+            reporte.sent_ms = Date.now();
+            try {
+                fetch("/api/freshness", {
+                    method: "POST",
+                    headers: {"Content-Type": "application/json"},
+                    body: JSON.stringify(reporte),
+                    keepalive: true
+                });
+            } catch (e) {}
+        });
+        return info;
+    }
+    """,
+    Output("client-debug-store", "data"),
+    Input("panel-snapshot", "data"),
+)
 
 if __name__ == "__main__":
     print(f"[START] Iniciando {APP_CONFIG['title']}")
@@ -0,0 +1 @@
+"""Benchmarks del camino de datos del panel (ver benchmarks/bench_panel.py)."""
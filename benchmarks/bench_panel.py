@@ -0,0 +1,209 @@
+"""
+Benchmark del camino de datos del panel a distintas escalas de datos.
+
+Uso (desde la raiz del repo):
+
+    python -m benchmarks.bench_panel --sizes turno,mes --output bench.json
+    python -m benchmarks.bench_panel --compare bench_base.json
+
+Para cada tamano (ver benchmarks/datasets.py) construye una base sintetica en un
+directorio temporal, apunta database_demo a ella y mide p50/p95 de cada funcion
+y el pico de memoria (tracemalloc, en una corrida aparte para no afectar los
+tiempos). El JSON incluye el commit de git para comparar corridas entre commits.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+os.environ.setdefault("MODO_OPERACION", "DEMO")
+
+from benchmarks.comun import git_commit, percentil  # noqa: E402
+from benchmarks.datasets import SIZES, SIZES_EXTRA, SEED, build_dataset, parametros  # noqa: E402
+
+
+def _casos():
+    """Funciones a medir: nombre -> callable sin argumentos."""
+    import app_demo
+    import functions
+    from database_demo import get_connection
+
+    def schedule():
+        conn = get_connection()
+        try:
+            return app_demo._get_current_lot_schedule(conn, app_demo.now_chile())
+        finally:
+            conn.close()
+
+    lote_actual = (functions.get_current_lote_from_detalle() or {}).get("Lote") or "1008"
+
+    def exportador():
+        return functions.get_exportador_nombre(lote_actual)
+
+    def panel():
+        return app_demo.actualizar_panel(0, None, None, None, None)
+
+    return {
+        "get_detalle_lotti_ingresso": functions.get_detalle_lotti_ingresso,
+        "get_current_lote_from_detalle": functions.get_current_lote_from_detalle,
+        "_get_current_lot_schedule": schedule,
+        "get_exportador_nombre": exportador,
+        "actualizar_panel": panel,
+    }
+
+
+def _reiniciar_estado(db_path):
+    """Apunta la capa de datos a la base del benchmark y limpia caches de proceso."""
+    import app_demo
+    import database_demo
+    import functions
+    import regen_coordinator
+    from panel_cache import PanelSnapshotCache
+
+    database_demo.demo_db_path = db_path
+    functions._EXPORTADOR_PLAN = None
+    app_demo._PANEL_CACHE = PanelSnapshotCache()
+    regen_coordinator.para_base(db_path).olvidar()
+
+
+def medir(fn, repeticiones, calentamiento):
+    for _ in range(calentamiento):
+        fn()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - inicio) * 1000.0)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _actual, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "n": len(tiempos),
+        "p50_ms": round(percentil(tiempos, 50), 3),
+        "p95_ms": round(percentil(tiempos, 95), 3),
+        "media_ms": round(statistics.fmean(tiempos), 3),
+        "max_ms": round(max(tiempos), 3),
+        "pico_memoria_kb": round(pico / 1024.0, 1),
+    }
+
+
+def ejecutar(sizes, repeticiones, calentamiento, directorio):
+    resultados = {}
+    for size in sizes:
+        db_path = os.path.join(directorio, f"bench_{size}.db")
+        inicio = time.perf_counter()
+        filas = build_dataset(db_path, size)
+        construccion_s = time.perf_counter() - inicio
+        _reiniciar_estado(db_path)
+
+        casos = {}
+        for nombre, fn in _casos().items():
+            casos[nombre] = medir(fn, repeticiones, calentamiento)
+            print(f"[BENCH] {size:<11} {nombre:<32} p50={casos[nombre]['p50_ms']:>9.3f} ms  "
+                  f"p95={casos[nombre]['p95_ms']:>9.3f} ms  pico={casos[nombre]['pico_memoria_kb']:>9.1f} KB",
+                  file=sys.stderr)
+
+        import app_demo
+
+        resultados[size] = {
+            "parametros": dict(parametros(size), seed=SEED),
+            "filas": filas,
+            "construccion_s": round(construccion_s, 3),
+            "fallos_panel": app_demo._PANEL_CACHE.estado()["fallos_refresco_total"],
+            "casos": casos,
+        }
+    return resultados
+
+
+def comparar(actual, base, tolerancia):
+    """Imprime la variacion de p50/p95 contra una corrida previa. Retorna True si hay regresion."""
+    regresion = False
+    print(f"[COMPARE] base={base.get('commit')} actual={actual.get('commit')} tolerancia={tolerancia:.0%}",
+          file=sys.stderr)
+    for size, datos in actual["resultados"].items():
+        base_size = base.get("resultados", {}).get(size)
+        if not base_size:
+            continue
+        for nombre, caso in datos["casos"].items():
+            caso_base = base_size["casos"].get(nombre)
+            if not caso_base:
+                continue
+            for clave in ("p50_ms", "p95_ms"):
+                previo, nuevo = caso_base[clave], caso[clave]
+                if not previo:
+                    continue
+                delta = (nuevo - previo) / previo
+                marca = ""
+                if delta > tolerancia:
+                    marca = "  << REGRESION"
+                    regresion = True
+                print(f"  {size:<11} {nombre:<32} {clave} {previo:>9.3f} -> {nuevo:>9.3f} ({delta:+.1%}){marca}",
+                      file=sys.stderr)
+    return regresion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del camino de datos del panel")
+    parser.add_argument("--sizes", default=",".join(SIZES), help=f"Tamanos separados por coma ({', '.join(list(SIZES) + list(SIZES_EXTRA))})")
+    parser.add_argument("--repeat", type=int, default=30, help="Repeticiones medidas por funcion")
+    parser.add_argument("--warmup", type=int, default=3, help="Repeticiones de calentamiento")
+    parser.add_argument("--output", help="Archivo JSON de salida (por defecto stdout)")
+    parser.add_argument("--compare", help="JSON de una corrida previa para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="Regresion tolerada en p50/p95 (0.20 = 20%%)")
+    parser.add_argument("--keep-dir", help="Directorio donde dejar las bases generadas (por defecto temporal)")
+    args = parser.parse_args()
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    desconocidos = [s for s in sizes if s not in SIZES and s not in SIZES_EXTRA]
+    if desconocidos:
+        parser.error(f"Tamanos desconocidos: {', '.join(desconocidos)}")
+
+    # Los print del generador y de la app van a stderr: stdout queda solo para el JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.keep_dir:
+            os.makedirs(args.keep_dir, exist_ok=True)
+            resultados = ejecutar(sizes, args.repeat, args.warmup, args.keep_dir)
+        else:
+            with tempfile.TemporaryDirectory(prefix="panel-bench-") as directorio:
+                resultados = ejecutar(sizes, args.repeat, args.warmup, directorio)
+
+    informe = {
+        "commit": git_commit(),
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "repeticiones": args.repeat,
+        "resultados": resultados,
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        if comparar(informe, base, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""Utilidades compartidas por los benchmarks."""
+import os
+import subprocess
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) con interpolacion lineal; None si no hay valores."""
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    k = (len(ordenados) - 1) * p / 100.0
+    inf = int(k)
+    sup = min(inf + 1, len(ordenados) - 1)
+    return ordenados[inf] + (ordenados[sup] - ordenados[inf]) * (k - inf)
+
+
+def git_commit():
+    """Commit corto de HEAD (con sufijo -dirty si hay cambios sin commitear)."""
+    try:
+        salida = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True
+        )
+        commit = salida.stdout.strip()
+        sucio = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=RAIZ,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if sucio else "")
+    except Exception:
+        return None
@@ -0,0 +1,52 @@
+"""
+Bases de datos sinteticas para benchmarks.
+
+Usa la generacion masiva de DemoDatabaseGenerator (generate_bulk_data): dias hacia
+atras, lineas y lotes por turno, con semilla fija para que las corridas sean
+comparables entre commits. Rollups y estadisticas de lotes no se reconstruyen: el
+camino de datos medido no los lee.
+"""
+import os
+import sqlite3
+
+from demo_db_generator import DemoDatabaseGenerator
+
+# nombre -> parametros de generate_bulk_data
+SIZES = {
+    "turno": {"days": 1, "lineas": ["CAL001"], "lotes_por_turno": 10},
+    "mes": {"days": 30, "lineas": ["CAL001"], "lotes_por_turno": 10},
+    "temporada": {"days": 180, "lineas": ["CAL001"], "lotes_por_turno": 10},
+    "multilinea": {"days": 30, "lineas": None, "lotes_por_turno": 10},
+}
+# Escala de produccion (~1M filas en VW_LottiIngresso); solo a pedido con --sizes
+SIZES_EXTRA = {
+    "produccion": {"days": 365, "lineas": None, "lotes_por_turno": 274},
+}
+SEED = 42
+
+
+def parametros(size):
+    return SIZES.get(size) or SIZES_EXTRA[size]
+
+
+def build_dataset(path, size):
+    """Crea (reemplazando) la base sintetica `size` en `path`. Retorna cantidad de filas por tabla."""
+    for sufijo in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + sufijo):
+            os.remove(path + sufijo)
+
+    generator = DemoDatabaseGenerator(path)
+    generator.create_bulk_database(derivadas=False, seed=SEED, **parametros(size))
+    generator.close_connection()
+
+    conn = sqlite3.connect(path)
+    try:
+        tablas = (
+            "VW_LottiIngresso",
+            "PROD_Lotto",
+            "PROD_Unita_OUT",
+            "VW_MON_Partita_Storico_Agent",
+        )
+        return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in tablas}
+    finally:
+        conn.close()
@@ -0,0 +1,412 @@
+"""
+Prueba de carga: N clientes de navegador simulados contra el panel.
+
+Uso (desde la raiz del repo):
+
+    # Levanta el panel en el mismo proceso sobre una base sintetica
+    python -m benchmarks.load_test --clients 1,5,10,20 --duration 30
+
+    # Contra un panel ya levantado (por ejemplo en otra maquina de la planta)
+    python -m benchmarks.load_test --url http://localhost:8050 --clients 5,10
+
+Cada cliente lee /_dash-dependencies y /_dash-layout igual que el navegador y
+envia los POST reales a /_dash-update-component de los callbacks disparados por
+interval-act e interval-eta, con la cadencia configurada en el layout (+/- jitter)
+y guardando los dcc.Store devueltos para enviarlos como State en el siguiente
+ciclo. Por cada nivel de concurrencia reporta throughput, percentiles de latencia
+(global y por callback), tasa de error y consultas SQL por segundo (leidas de
+/metrics del panel).
+
+Simplificaciones: los callbacks encadenados que el navegador dispararia al cambiar
+un Store no se simulan, y cada cliente envia sus POST en secuencia (el navegador
+puede abrir varias conexiones en paralelo).
+"""
+import argparse
+import contextlib
+import datetime
+import heapq
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+os.environ.setdefault("MODO_OPERACION", "DEMO")
+
+from benchmarks.comun import git_commit, percentil  # noqa: E402
+
+INTERVALOS = ("interval-act", "interval-eta")
+# Metricas de /metrics que se convierten en tasas por segundo
+_METRICAS_TASA = {
+    "db_consultas_s": "panel_db_query_duration_seconds_count",
+    "db_conexiones_s": "panel_db_connections_total",
+}
+
+
+class ClienteHTTP:
+    """Conexion HTTP/1.1 persistente (una por cliente simulado)."""
+
+    def __init__(self, url_base, timeout_s):
+        partes = urllib.parse.urlsplit(url_base)
+        self.host = partes.hostname
+        self.port = partes.port or (443 if partes.scheme == "https" else 80)
+        self.https = partes.scheme == "https"
+        self.prefijo = partes.path.rstrip("/")
+        self.timeout_s = timeout_s
+        self._conn = None
+
+    def _conexion(self):
+        if self._conn is None:
+            clase = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self._conn = clase(self.host, self.port, timeout=self.timeout_s)
+        return self._conn
+
+    def pedir(self, metodo, ruta, cuerpo=None):
+        """Retorna (status, bytes). Reintenta una vez si el servidor cerro la conexion."""
+        cabeceras = {"Content-Type": "application/json"} if cuerpo is not None else {}
+        for intento in range(2):
+            conn = self._conexion()
+            try:
+                conn.request(metodo, self.prefijo + ruta, body=cuerpo, headers=cabeceras)
+                respuesta = conn.getresponse()
+                return respuesta.status, respuesta.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.cerrar()
+                if intento:
+                    raise
+            except Exception:
+                self.cerrar()
+                raise
+
+    def get_json(self, ruta):
+        status, datos = self.pedir("GET", ruta)
+        if status != 200:
+            raise RuntimeError(f"GET {ruta} -> HTTP {status}")
+        return json.loads(datos)
+
+    def cerrar(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+
+def _partir_output(output):
+    """'..a.b...c.d..' -> [('a', 'b'), ('c', 'd')]; 'a.b' -> [('a', 'b')]."""
+    multi = output.startswith("..") and output.endswith("..")
+    partes = output[2:-2].split("...") if multi else [output]
+    return [tuple(p.rsplit(".", 1)) for p in partes], multi
+
+
+def callbacks_de_intervalos(dependencias):
+    """Callbacks de servidor disparados por interval-act / interval-eta."""
+    callbacks = []
+    for dep in dependencias:
+        if dep.get("clientside_function"):
+            continue
+        disparadores = [i for i in dep.get("inputs", []) if i["id"] in INTERVALOS and i["property"] == "n_intervals"]
+        if not disparadores:
+            continue
+        # Ids con patron (dict) no se simulan
+        if any(not isinstance(i["id"], str) for i in dep.get("inputs", []) + dep.get("state", [])):
+            continue
+        salidas, multi = _partir_output(dep["output"])
+        callbacks.append(
+            {
+                "nombre": salidas[0][0] if len(salidas) == 1 else f"{salidas[0][0]}+{len(salidas) - 1}",
+                "intervalo": disparadores[0]["id"],
+                "output": dep["output"],
+                "salidas": salidas,
+                "multi": multi,
+                "inputs": dep["inputs"],
+                "state": dep.get("state", []),
+            }
+        )
+    return callbacks
+
+
+def cadencias_de_layout(layout, defecto_ms=5000):
+    """Intervalo (ms) de cada dcc.Interval simulado segun /_dash-layout."""
+    cadencias = {}
+    pila = [layout]
+    while pila:
+        nodo = pila.pop()
+        if isinstance(nodo, list):
+            pila.extend(nodo)
+            continue
+        if not isinstance(nodo, dict):
+            continue
+        props = nodo.get("props") or {}
+        if nodo.get("type") == "Interval" and props.get("id") in INTERVALOS:
+            cadencias[props["id"]] = float(props.get("interval") or defecto_ms)
+        hijos = props.get("children")
+        if hijos is not None:
+            pila.append(hijos)
+    for intervalo in INTERVALOS:
+        cadencias.setdefault(intervalo, float(defecto_ms))
+    return cadencias
+
+
+def construir_payload(callback, valores, n_intervals):
+    def valor(item):
+        if item["id"] in INTERVALOS and item["property"] == "n_intervals":
+            return n_intervals
+        return valores.get((item["id"], item["property"]))
+
+    salidas = [{"id": i, "property": p} for i, p in callback["salidas"]]
+    return {
+        "output": callback["output"],
+        "outputs": salidas if callback["multi"] else salidas[0],
+        "inputs": [dict(i, value=valor(i)) for i in callback["inputs"]],
+        "changedPropIds": [f"{callback['intervalo']}.n_intervals"],
+        "state": [dict(s, value=valor(s)) for s in callback["state"]],
+    }
+
+
+class Resultados:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencias = {}
+        self.errores = {}
+        self.ejemplos_error = []
+
+    def registrar(self, nombre, latencia_ms, error=None):
+        with self._lock:
+            self.latencias.setdefault(nombre, []).append(latencia_ms)
+            if error is not None:
+                self.errores[nombre] = self.errores.get(nombre, 0) + 1
+                if len(self.ejemplos_error) < 5:
+                    self.ejemplos_error.append(f"{nombre}: {error}")
+
+
+def ejecutar_cliente(url, callbacks, cadencias, jitter, hasta, resultados, timeout_s, semilla):
+    rnd = random.Random(semilla)
+    http_cliente = ClienteHTTP(url, timeout_s)
+    valores = {}
+    n_intervals = {i: 0 for i in INTERVALOS}
+    por_intervalo = {i: [c for c in callbacks if c["intervalo"] == i] for i in INTERVALOS}
+
+    # Cada pantalla abre en un momento distinto: fase aleatoria dentro del primer periodo
+    agenda = []
+    ahora = time.monotonic()
+    for intervalo in INTERVALOS:
+        if por_intervalo[intervalo]:
+            heapq.heappush(agenda, (ahora + rnd.uniform(0, cadencias[intervalo] / 1000.0), intervalo))
+
+    try:
+        while agenda:
+            cuando, intervalo = heapq.heappop(agenda)
+            if cuando >= hasta:
+                break
+            espera = cuando - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            for callback in por_intervalo[intervalo]:
+                cuerpo = json.dumps(construir_payload(callback, valores, n_intervals[intervalo]))
+                inicio = time.perf_counter()
+                error = None
+                try:
+                    status, datos = http_cliente.pedir("POST", "/_dash-update-component", cuerpo)
+                    if status == 200:
+                        respuesta = json.loads(datos).get("response", {})
+                        for componente, props in respuesta.items():
+                            for prop, v in props.items():
+                                valores[(componente, prop)] = v
+                    elif status != 204:
+                        error = f"HTTP {status}"
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                resultados.registrar(callback["nombre"], (time.perf_counter() - inicio) * 1000.0, error)
+            n_intervals[intervalo] += 1
+            periodo = cadencias[intervalo] / 1000.0
+            heapq.heappush(agenda, (cuando + periodo * rnd.uniform(1.0 - jitter, 1.0 + jitter), intervalo))
+    finally:
+        http_cliente.cerrar()
+
+
+def leer_metricas(url, timeout_s):
+    """Suma de cada metrica de _METRICAS_TASA en /metrics (None si el panel no la expone)."""
+    cliente = ClienteHTTP(url, timeout_s)
+    try:
+        status, datos = cliente.pedir("GET", "/metrics")
+    except Exception:
+        return None
+    finally:
+        cliente.cerrar()
+    if status != 200:
+        return None
+    totales = {clave: 0.0 for clave in _METRICAS_TASA}
+    for linea in datos.decode("utf-8", "replace").splitlines():
+        if linea.startswith("#"):
+            continue
+        for clave, metrica in _METRICAS_TASA.items():
+            if linea.startswith(metrica + "{") or linea.startswith(metrica + " "):
+                try:
+                    totales[clave] += float(linea.rsplit(" ", 1)[1])
+                except ValueError:
+                    pass
+    return totales
+
+
+def ejecutar_nivel(url, callbacks, cadencias, clientes, duracion_s, jitter, timeout_s, semilla):
+    resultados = Resultados()
+    metricas_antes = leer_metricas(url, timeout_s)
+    inicio = time.monotonic()
+    hasta = inicio + duracion_s
+    hilos = [
+        threading.Thread(
+            target=ejecutar_cliente,
+            args=(url, callbacks, cadencias, jitter, hasta, resultados, timeout_s, semilla * 1000 + i),
+            daemon=True,
+        )
+        for i in range(clientes)
+    ]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    transcurrido = time.monotonic() - inicio
+    metricas_despues = leer_metricas(url, timeout_s)
+
+    todas = [ms for lista in resultados.latencias.values() for ms in lista]
+    errores = sum(resultados.errores.values())
+
+    def resumen(lista):
+        return {
+            "n": len(lista),
+            "p50_ms": round(percentil(lista, 50), 3) if lista else None,
+            "p95_ms": round(percentil(lista, 95), 3) if lista else None,
+            "p99_ms": round(percentil(lista, 99), 3) if lista else None,
+            "max_ms": round(max(lista), 3) if lista else None,
+        }
+
+    nivel = {
+        "clientes": clientes,
+        "duracion_s": round(transcurrido, 3),
+        "peticiones": len(todas),
+        "throughput_rps": round(len(todas) / transcurrido, 3) if transcurrido > 0 else None,
+        "errores": errores,
+        "tasa_error": round(errores / len(todas), 4) if todas else None,
+        "latencia": resumen(todas),
+        "por_callback": {
+            nombre: dict(resumen(lista), errores=resultados.errores.get(nombre, 0))
+            for nombre, lista in sorted(resultados.latencias.items())
+        },
+        "ejemplos_error": resultados.ejemplos_error,
+    }
+    if metricas_antes is not None and metricas_despues is not None and transcurrido > 0:
+        for clave in _METRICAS_TASA:
+            nivel[clave] = round((metricas_despues[clave] - metricas_antes[clave]) / transcurrido, 3)
+    return nivel
+
+
+@contextlib.contextmanager
+def servidor_local(size, directorio):
+    """Levanta app_demo en un hilo (servidor WSGI multihilo) sobre una base sintetica."""
+    from werkzeug.serving import make_server
+
+    from benchmarks.datasets import build_dataset
+
+    db_path = os.path.join(directorio, f"load_{size}.db")
+    build_dataset(db_path, size)
+    import database_demo
+
+    database_demo.demo_db_path = db_path
+    import app_demo
+
+    # Sin log por peticion de werkzeug (miles de lineas por nivel)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    servidor = make_server("127.0.0.1", 0, app_demo.server, threaded=True)
+    hilo = threading.Thread(target=servidor.serve_forever, name="load-test-server", daemon=True)
+    hilo.start()
+    try:
+        yield f"http://127.0.0.1:{servidor.server_port}"
+    finally:
+        servidor.shutdown()
+        hilo.join(timeout=5)
+
+
+def ejecutar(url, niveles, duracion_s, jitter, timeout_s, semilla):
+    cliente = ClienteHTTP(url, timeout_s)
+    try:
+        dependencias = cliente.get_json("/_dash-dependencies")
+        layout = cliente.get_json("/_dash-layout")
+    finally:
+        cliente.cerrar()
+    callbacks = callbacks_de_intervalos(dependencias)
+    if not callbacks:
+        raise RuntimeError("El panel no tiene callbacks disparados por interval-act / interval-eta")
+    cadencias = cadencias_de_layout(layout)
+    print(f"[LOAD] {len(callbacks)} callbacks simulados; cadencias (ms): {cadencias}", file=sys.stderr)
+
+    resultados = []
+    for clientes in niveles:
+        nivel = ejecutar_nivel(url, callbacks, cadencias, clientes, duracion_s, jitter, timeout_s, semilla)
+        lat = nivel["latencia"]
+        print(
+            f"[LOAD] clientes={clientes:<4} rps={nivel['throughput_rps']:>8.2f}  p50={lat['p50_ms']} ms  "
+            f"p95={lat['p95_ms']} ms  p99={lat['p99_ms']} ms  errores={nivel['tasa_error']:.2%}  "
+            f"db_consultas/s={nivel.get('db_consultas_s')}",
+            file=sys.stderr,
+        )
+        resultados.append(nivel)
+    return {"callbacks": [c["nombre"] for c in callbacks], "cadencias_ms": cadencias, "niveles": resultados}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del panel con clientes Dash simulados")
+    parser.add_argument("--url", help="Panel ya levantado (por defecto se levanta app_demo en este proceso)")
+    parser.add_argument("--size", default="turno", help="Base sintetica para el modo en proceso (ver datasets.py)")
+    parser.add_argument("--clients", default="1,5,10,20", help="Niveles de concurrencia separados por coma")
+    parser.add_argument("--duration", type=float, default=30.0, help="Segundos por nivel")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Variacion de la cadencia (0.1 = +/-10%%)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout por peticion (s)")
+    parser.add_argument("--seed", type=int, default=1, help="Semilla del jitter")
+    parser.add_argument("--output", help="Archivo JSON de salida (por defecto stdout)")
+    args = parser.parse_args()
+
+    try:
+        niveles = [int(n) for n in args.clients.split(",") if n.strip()]
+    except ValueError:
+        parser.error("--clients debe ser una lista de enteros")
+    jitter = min(0.9, max(0.0, args.jitter))
+
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.url:
+            resultados = ejecutar(args.url, niveles, args.duration, jitter, args.timeout, args.seed)
+        else:
+            with tempfile.TemporaryDirectory(prefix="panel-load-") as directorio:
+                with servidor_local(args.size, directorio) as url:
+                    resultados = ejecutar(url, niveles, args.duration, jitter, args.timeout, args.seed)
+
+    informe = {
+        "commit": git_commit(),
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "objetivo": args.url or f"en proceso ({args.size})",
+        "jitter": jitter,
+        **resultados,
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
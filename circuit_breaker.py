@@ -0,0 +1,112 @@
+"""
+Circuit breaker para la capa de conexiones a la base de datos.
+
+Tras N fallos consecutivos el circuito se abre y las llamadas fallan de inmediato
+(sin esperar el timeout de conexion). Pasado el tiempo de reset pasa a semi-abierto
+y deja pasar una sola conexion de prueba: si funciona se cierra, si falla se vuelve
+a abrir.
+"""
+import threading
+import time
+
+
+class CircuitOpenError(ConnectionError):
+    """El circuito esta abierto: la llamada se rechaza sin intentar conectar."""
+
+
+class CircuitBreaker:
+    CERRADO = "closed"
+    ABIERTO = "open"
+    SEMI_ABIERTO = "half_open"
+
+    def __init__(self, nombre, umbral_fallos=5, reset_s=30.0):
+        self.nombre = nombre
+        self.umbral_fallos = max(1, int(umbral_fallos))
+        self.reset_s = max(0.0, float(reset_s))
+        self._lock = threading.Lock()
+        self._estado = self.CERRADO
+        self._fallos_consecutivos = 0
+        self._abierto_desde = None
+        self._cambio_estado_ts = time.time()
+        self._sonda_en_curso = False
+        self._ultimo_error = None
+        self._fallos_total = 0
+        self._rechazos_total = 0
+        self._aperturas_total = 0
+
+    def llamar(self, fn, *args, **kwargs):
+        """Ejecuta fn protegida por el circuito. Lanza CircuitOpenError si esta abierto."""
+        es_sonda = False
+        with self._lock:
+            if self._estado == self.ABIERTO:
+                if time.time() - (self._abierto_desde or 0.0) >= self.reset_s:
+                    self._cambiar_estado(self.SEMI_ABIERTO)
+                else:
+                    self._rechazos_total += 1
+                    raise CircuitOpenError(f"Circuito '{self.nombre}' abierto: {self._ultimo_error}")
+            if self._estado == self.SEMI_ABIERTO:
+                if self._sonda_en_curso:
+                    self._rechazos_total += 1
+                    raise CircuitOpenError(f"Circuito '{self.nombre}' semi-abierto: sonda en curso")
+                self._sonda_en_curso = True
+                es_sonda = True
+
+        try:
+            resultado = fn(*args, **kwargs)
+        except Exception as e:
+            self.registrar_fallo(e, es_sonda=es_sonda)
+            raise
+        self.registrar_exito(es_sonda=es_sonda)
+        return resultado
+
+    def registrar_exito(self, es_sonda=False):
+        with self._lock:
+            if es_sonda:
+                self._sonda_en_curso = False
+            self._fallos_consecutivos = 0
+            if self._estado != self.CERRADO:
+                self._cambiar_estado(self.CERRADO)
+
+    def registrar_fallo(self, error=None, es_sonda=False):
+        with self._lock:
+            if es_sonda:
+                self._sonda_en_curso = False
+            self._fallos_total += 1
+            self._fallos_consecutivos += 1
+            if error is not None:
+                self._ultimo_error = f"{type(error).__name__}: {error}"
+            if self._estado == self.SEMI_ABIERTO or self._fallos_consecutivos >= self.umbral_fallos:
+                if self._estado != self.ABIERTO:
+                    self._aperturas_total += 1
+                self._abierto_desde = time.time()
+                self._cambiar_estado(self.ABIERTO)
+
+    def _cambiar_estado(self, nuevo):
+        if nuevo != self._estado:
+            print(f"[DB] Circuito '{self.nombre}': {self._estado} -> {nuevo}")
+            self._estado = nuevo
+            self._cambio_estado_ts = time.time()
+
+    def estado(self):
+        """Estado del circuito (para endpoint de estado, header del panel y metricas)."""
+        with self._lock:
+            estado = self._estado
+            reintento_en_s = None
+            if estado == self.ABIERTO and self._abierto_desde is not None:
+                reintento_en_s = max(0.0, self.reset_s - (time.time() - self._abierto_desde))
+                if reintento_en_s == 0.0:
+                    # La proxima llamada sera la sonda
+                    estado = self.SEMI_ABIERTO
+            return {
+                "nombre": self.nombre,
+                "estado": estado,
+                "fallos_consecutivos": self._fallos_consecutivos,
+                "umbral_fallos": self.umbral_fallos,
+                "reset_s": self.reset_s,
+                "reintento_en_s": reintento_en_s,
+                "desde_ts": self._cambio_estado_ts,
+                "ultimo_error": self._ultimo_error,
+                "fallos_total": self._fallos_total,
+                "rechazos_total": self._rechazos_total,
+                "aperturas_total": self._aperturas_total,
+            }
@@ -0,0 +1,150 @@
+"""
+Reloj del panel y del simulador: real o virtual acelerado.
+
+Todo lo que depende de "la hora de planta" (turnos, avance de lotes, ETA,
+simulador) lee la hora desde aqui en lugar de datetime.now(). Con
+PANEL_CLOCK_SPEED=120 un turno de 10 horas se recorre en 5 minutos; con
+PANEL_CLOCK_START="2026-01-15T06:50" el reloj arranca en esa hora local (por
+ejemplo, para ver un cambio de turno de inmediato).
+
+La hora virtual se calcula como inicio + (ahora_real - ancla) * factor. El ancla
+(epoch real) se exporta en PANEL_CLOCK_ANCHOR para que los procesos hijos (por
+ejemplo el simulador lanzado por run_demo.py) compartan el mismo reloj.
+
+Los sellos que se comparan con el reloj del navegador (frescura) siguen usando
+time.time().
+"""
+import datetime
+import os
+import threading
+import time as _time
+
+try:
+    from zoneinfo import ZoneInfo
+except Exception:
+    ZoneInfo = None
+
+LOCAL_TZ_NAME = os.environ.get("LOCAL_TIMEZONE", "America/Santiago")
+
+
+def _zona(tz_name):
+    if ZoneInfo and tz_name:
+        try:
+            return ZoneInfo(tz_name)
+        except Exception:
+            return None
+    return None
+
+
+def _epoch_desde_local(texto, tz_name):
+    """'2026-01-15T06:50' (hora local de tz_name) -> epoch."""
+    dt = datetime.datetime.fromisoformat(str(texto).strip())
+    if dt.tzinfo is None:
+        zona = _zona(tz_name)
+        dt = dt.replace(tzinfo=zona) if zona else dt
+    return dt.timestamp()
+
+
+class Clock:
+    """Reloj con factor de aceleracion. Con factor 1 y sin inicio es el reloj real."""
+
+    def __init__(self, factor=1.0, inicio_ts=None, ancla_ts=None):
+        factor = float(factor or 1.0)
+        self.factor = factor if factor > 0 else 1.0
+        self.ancla_ts = _time.time() if ancla_ts is None else float(ancla_ts)
+        self.inicio_ts = self.ancla_ts if inicio_ts is None else float(inicio_ts)
+        self.virtual = self.factor != 1.0 or self.inicio_ts != self.ancla_ts
+
+    def time(self):
+        """Epoch (segundos) en la hora del reloj."""
+        real = _time.time()
+        if not self.virtual:
+            return real
+        return self.inicio_ts + (real - self.ancla_ts) * self.factor
+
+    def now_local(self, tz_name=None):
+        """Hora local sin zona (igual que las columnas DATETIME de la BD)."""
+        zona = _zona(tz_name or LOCAL_TZ_NAME)
+        if zona is not None:
+            try:
+                return datetime.datetime.fromtimestamp(self.time(), zona).replace(tzinfo=None)
+            except Exception:
+                pass
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def sleep(self, segundos):
+        """Duerme `segundos` de reloj (segundos / factor en tiempo real)."""
+        _time.sleep(max(0.0, float(segundos)) / self.factor)
+
+    def estado(self):
+        return {
+            "virtual": self.virtual,
+            "factor": self.factor,
+            "inicio_ts": self.inicio_ts,
+            "ancla_ts": self.ancla_ts,
+            "ahora": self.now_local().isoformat(timespec="seconds"),
+        }
+
+
+_lock = threading.Lock()
+_CLOCK = None
+
+
+def desde_entorno():
+    """Reloj segun PANEL_CLOCK_SPEED / PANEL_CLOCK_START / PANEL_CLOCK_ANCHOR."""
+    try:
+        factor = float(os.environ.get("PANEL_CLOCK_SPEED", "1") or 1)
+    except ValueError:
+        factor = 1.0
+    inicio_txt = (os.environ.get("PANEL_CLOCK_START") or "").strip()
+    if factor == 1.0 and not inicio_txt:
+        return Clock()
+
+    ancla_txt = (os.environ.get("PANEL_CLOCK_ANCHOR") or "").strip()
+    try:
+        ancla_ts = float(ancla_txt) if ancla_txt else _time.time()
+    except ValueError:
+        ancla_ts = _time.time()
+    inicio_ts = None
+    if inicio_txt:
+        try:
+            inicio_ts = _epoch_desde_local(inicio_txt, LOCAL_TZ_NAME)
+        except ValueError:
+            print(f"[WARN] PANEL_CLOCK_START invalido: {inicio_txt!r} (se usa la hora actual)")
+    # Compartir el ancla con procesos hijos para que todos vean la misma hora
+    os.environ["PANEL_CLOCK_ANCHOR"] = repr(ancla_ts)
+    reloj = Clock(factor, inicio_ts, ancla_ts)
+    print(f"[CLOCK] Reloj virtual x{reloj.factor:g} desde {reloj.now_local().isoformat(timespec='seconds')}")
+    return reloj
+
+
+def get_clock():
+    global _CLOCK
+    if _CLOCK is None:
+        with _lock:
+            if _CLOCK is None:
+                _CLOCK = desde_entorno()
+    return _CLOCK
+
+
+def set_clock(reloj):
+    """Inyecta un reloj (tests, replays). None vuelve a leer el entorno."""
+    global _CLOCK
+    with _lock:
+        _CLOCK = reloj
+
+
+def now_local(tz_name=None):
+    return get_clock().now_local(tz_name)
+
+
+def time():
+    return get_clock().time()
+
+
+def sleep(segundos):
+    get_clock().sleep(segundos)
+
+
+def factor():
+    return get_clock().factor
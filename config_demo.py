@@ -12,6 +12,14 @@ MODO_OPERACION = "DEMO"
 DEMO_SIMULACION = os.environ.get("DEMO_SIMULACION", "0")
 
 
+def env_float(nombre, defecto):
+    """Variable de entorno numerica; vacia o invalida retorna `defecto`."""
+    try:
+        return float(os.environ.get(nombre, defecto) or defecto)
+    except Exception:
+        return float(defecto)
+
+
 def get_database_config():
     """Retorna la configuracion de base de datos demo (SQLite)."""
     return {
@@ -0,0 +1,172 @@
+"""
+Frescura de datos de punta a punta (escritura en BD -> render en el navegador).
+
+Quien escribe datos de produccion sella en la misma transaccion una version
+monotona y la hora de escritura (tabla PANEL_DataVersion, una sola fila). El
+panel copia el sello en panel-snapshot junto con la hora en que armo la respuesta,
+y un callback clientside informa a /api/freshness cuando el navegador lo pinto.
+Aqui se agregan los percentiles de desfase por cliente.
+
+PANEL_TablaVersion lleva ademas una version por tabla que suben quienes borran filas
+(poda, regeneracion): junto con MAX(rowid) permite a un cache saber si una tabla que
+solo crece cambio sin contarla.
+"""
+import collections
+import sqlite3
+import threading
+import time
+
+from metrics import REGISTRY
+
+TABLA_VERSION = "PANEL_DataVersion"
+TABLA_BORRADOS = "PANEL_TablaVersion"
+
+_SQL_CREAR = f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_VERSION} (
+        Id INTEGER PRIMARY KEY CHECK (Id = 1),
+        Version INTEGER NOT NULL,
+        WriteTs REAL NOT NULL,
+        Fuente TEXT
+    )
+"""
+_SQL_SELLAR = f"""
+    INSERT INTO {TABLA_VERSION} (Id, Version, WriteTs, Fuente) VALUES (1, 1, ?, ?)
+    ON CONFLICT(Id) DO UPDATE SET Version = Version + 1, WriteTs = excluded.WriteTs, Fuente = excluded.Fuente
+"""
+
+_SQL_CREAR_BORRADOS = f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_BORRADOS} (
+        Tabla TEXT PRIMARY KEY,
+        Version INTEGER NOT NULL,
+        Ts REAL NOT NULL
+    ) WITHOUT ROWID
+"""
+_SQL_MARCAR_BORRADO = f"""
+    INSERT INTO {TABLA_BORRADOS} (Tabla, Version, Ts) VALUES (?, 1, ?)
+    ON CONFLICT(Tabla) DO UPDATE SET Version = Version + 1, Ts = excluded.Ts
+"""
+
+FRESHNESS_LAG_SECONDS = REGISTRY.histogram(
+    "panel_data_freshness_lag_seconds",
+    "Desfase entre la escritura en BD y el render en el navegador",
+    buckets=(0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 15.0, 30.0, 60.0, 120.0, 300.0, 900.0),
+)
+
+
+def crear_tabla(cur):
+    cur.execute(_SQL_CREAR)
+    cur.execute(_SQL_CREAR_BORRADOS)
+
+
+def sellar(cur, fuente):
+    """Incrementa la version de datos. Llamar antes del commit de la escritura."""
+    try:
+        cur.execute(_SQL_SELLAR, (time.time(), fuente))
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        crear_tabla(cur)
+        cur.execute(_SQL_SELLAR, (time.time(), fuente))
+
+
+def marcar_borrado(cur, tabla):
+    """Sube la version de borrados de `tabla`. Llamar en la transaccion que borra filas."""
+    try:
+        cur.execute(_SQL_MARCAR_BORRADO, (tabla, time.time()))
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        crear_tabla(cur)
+        cur.execute(_SQL_MARCAR_BORRADO, (tabla, time.time()))
+
+
+def version_borrados(conn, tabla):
+    """(version, ts) de los borrados de `tabla`; (0, None) si nunca se borro."""
+    try:
+        fila = conn.execute(f"SELECT Version, Ts FROM {TABLA_BORRADOS} WHERE Tabla = ?", (tabla,)).fetchone()
+    except sqlite3.OperationalError:
+        return 0, None
+    return (int(fila[0]), float(fila[1])) if fila else (0, None)
+
+
+def leer_version(conn):
+    """{"version", "write_ts_ms", "fuente"} del ultimo sello, o None si no hay."""
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT Version, WriteTs, Fuente FROM {TABLA_VERSION} WHERE Id = 1")
+        fila = cur.fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if not fila:
+        return None
+    return {"version": int(fila[0]), "write_ts_ms": int(float(fila[1]) * 1000.0), "fuente": fila[2]}
+
+
+def _percentiles(valores):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return {}
+
+    def p(q):
+        return round(ordenados[min(len(ordenados) - 1, int(round(q / 100.0 * (len(ordenados) - 1))))], 1)
+
+    return {"p50_ms": p(50), "p95_ms": p(95), "p99_ms": p(99), "max_ms": round(ordenados[-1], 1)}
+
+
+class FreshnessTracker:
+    """Muestras de desfase por cliente (ventana acotada y cantidad de clientes acotada)."""
+
+    def __init__(self, muestras_por_cliente=500, max_clientes=200):
+        self.muestras_por_cliente = int(muestras_por_cliente)
+        self.max_clientes = int(max_clientes)
+        self._lock = threading.Lock()
+        self._clientes = collections.OrderedDict()
+
+    def registrar(self, cliente, version, write_ts_ms, served_ms, render_ms, sent_ms, recibido_ms=None):
+        """
+        Registra un render informado por el navegador. Los tiempos del cliente se
+        llevan al reloj del servidor con offset = sent_ms - recibido_ms (la latencia
+        de red de la LAN queda incluida en el desfase).
+        """
+        recibido_ms = float(recibido_ms if recibido_ms is not None else time.time() * 1000.0)
+        offset_ms = float(sent_ms) - recibido_ms
+        render_srv_ms = float(render_ms) - offset_ms
+        desfase_ms = max(0.0, render_srv_ms - float(write_ts_ms))
+        muestra = {
+            "desfase_ms": desfase_ms,
+            "escritura_a_respuesta_ms": max(0.0, float(served_ms) - float(write_ts_ms)),
+            "respuesta_a_render_ms": max(0.0, render_srv_ms - float(served_ms)),
+        }
+        with self._lock:
+            estado = self._clientes.pop(cliente, None)
+            if estado is None:
+                estado = {"muestras": collections.deque(maxlen=self.muestras_por_cliente), "total": 0}
+            estado["muestras"].append(muestra)
+            estado["total"] += 1
+            estado["version"] = int(version)
+            estado["offset_ms"] = round(offset_ms, 1)
+            estado["visto_ts"] = recibido_ms / 1000.0
+            self._clientes[cliente] = estado
+            while len(self._clientes) > self.max_clientes:
+                self._clientes.popitem(last=False)
+        FRESHNESS_LAG_SECONDS.observe(desfase_ms / 1000.0)
+        return muestra
+
+    def resumen(self):
+        with self._lock:
+            clientes = {k: dict(v, muestras=list(v["muestras"])) for k, v in self._clientes.items()}
+        por_cliente = {}
+        todas = []
+        for cliente, estado in clientes.items():
+            desfases = [m["desfase_ms"] for m in estado["muestras"]]
+            todas.extend(desfases)
+            por_cliente[cliente] = {
+                "muestras": estado["total"],
+                "version": estado["version"],
+                "offset_reloj_ms": estado["offset_ms"],
+                "visto_ts": estado["visto_ts"],
+                "desfase": _percentiles(desfases),
+                "escritura_a_respuesta": _percentiles([m["escritura_a_respuesta_ms"] for m in estado["muestras"]]),
+                "respuesta_a_render": _percentiles([m["respuesta_a_render_ms"] for m in estado["muestras"]]),
+            }
+        return {"clientes": por_cliente, "global": _percentiles(todas)}
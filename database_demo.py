@@ -5,6 +5,12 @@ Conexión a SQLite para datos ficticios
 import sqlite3
 import os
 
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from db_instrumentation import InstrumentedConnection
+from metrics import DB_CONNECTIONS
+import regen_coordinator
+from regen_coordinator import RegenBusyError
+
 # Configuración de la base de datos demo
 demo_db_path = os.path.join(os.path.dirname(__file__), "demo_database.db")
 
@@ -12,46 +18,112 @@ demo_db_path = os.path.join(os.path.dirname(__file__), "demo_database.db")
 CONNECT_TIMEOUT_S = 5
 QUERY_TIMEOUT_S = 12
 
+# Circuit breaker: tras N fallos consecutivos se deja de intentar conectar
+# y cada RESET_S segundos se prueba una conexion (semi-abierto)
+DB_CIRCUIT_FAILURES = int(os.environ.get("DB_CIRCUIT_FAILURES", "5") or 5)
+DB_CIRCUIT_RESET_S = float(os.environ.get("DB_CIRCUIT_RESET_S", "30") or 30)
+
+db_circuit = CircuitBreaker("demo_db", umbral_fallos=DB_CIRCUIT_FAILURES, reset_s=DB_CIRCUIT_RESET_S)
+
+
 def get_connection():
-    """Obtiene una conexión a la base de datos demo (SQLite)"""
-    # Crear la base de datos si no existe
-    if not os.path.exists(demo_db_path):
-        print("[DB] Base de datos demo no encontrada. Creandola...")
-        from demo_db_generator import DemoDatabaseGenerator
-        generator = DemoDatabaseGenerator(demo_db_path)
-        generator.create_database()
-        generator.close_connection()
-        print("[OK] Base de datos demo creada")
+    """Obtiene una conexión a la base de datos demo (SQLite)
+    Falla de inmediato (CircuitOpenError) mientras el circuito está abierto, y con
+    RegenBusyError mientras la base se está creando en segundo plano"""
+    coordinador = regen_coordinator.para_base(demo_db_path)
+    if not os.path.exists(demo_db_path) or coordinador.en_curso("create_database"):
+        # La creacion no pasa por el circuito: no es una falla de la base
+        coordinador.en_segundo_plano(
+            "create_database",
+            _crear_base,
+            necesario=lambda: not os.path.exists(demo_db_path),
+        )
+        DB_CONNECTIONS.inc(result="regenerating")
+        raise RegenBusyError("Base de datos demo en creacion")
+    try:
+        conn = db_circuit.llamar(_abrir_conexion, coordinador)
+    except CircuitOpenError:
+        DB_CONNECTIONS.inc(result="rejected")
+        raise
+    except Exception:
+        DB_CONNECTIONS.inc(result="error")
+        raise
+    DB_CONNECTIONS.inc(result="ok")
+    conn.al_fallar = _reportar_fallo_consulta
+    return conn
 
-    conn = sqlite3.connect(demo_db_path)
+
+def get_circuit_status():
+    """Estado del circuit breaker de la BD"""
+    return db_circuit.estado()
+
+
+def _es_fallo_de_base(error):
+    """Errores del archivo o del motor (bloqueo, I/O, base danada), no de la sentencia."""
+    if isinstance(error, sqlite3.OperationalError):
+        return not str(error).startswith(("no such ", "near ", "syntax error"))
+    return type(error) is sqlite3.DatabaseError
+
+
+def _reportar_fallo_consulta(error):
+    """Las consultas que fallan por la base cuentan para el circuit breaker."""
+    if _es_fallo_de_base(error):
+        db_circuit.registrar_fallo(error)
+
+
+def _abrir_conexion(coordinador):
+    """Abre la conexión real (sin circuit breaker)"""
+    conn = sqlite3.connect(demo_db_path, factory=InstrumentedConnection)
     # Configurar para que retorne filas como diccionarios
     conn.row_factory = sqlite3.Row
-    # Si la base esta vacia o incompleta, regenerar datos demo
+    # Si la base esta vacia o incompleta, agregar el turno actual (sin borrar lo existente)
     try:
         cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM VW_LottiIngresso")
-        count = cur.fetchone()[0]
-        # Con datos fijos por turno, el total puede ser menor a 18 (por ejemplo, 9-10 filas).
-        # Solo regenerar si la tabla está vacía.
-        if count < 1:
+        cur.execute("SELECT 1 FROM VW_LottiIngresso LIMIT 1")
+        incompleta = cur.fetchone() is None
+    except sqlite3.OperationalError as e:
+        # Solo se completa si faltan tablas; otros errores (base bloqueada, I/O)
+        # son una falla de la conexion para el circuit breaker
+        if "no such table" not in str(e):
             conn.close()
-            print("[DB] Datos demo incompletos. Regenerando...")
-            from demo_db_generator import DemoDatabaseGenerator
-            generator = DemoDatabaseGenerator(demo_db_path)
-            generator.create_database()
-            generator.close_connection()
-            conn = sqlite3.connect(demo_db_path)
-            conn.row_factory = sqlite3.Row
-    except Exception:
-        conn.close()
-        print("[DB] Error verificando datos demo. Regenerando...")
-        from demo_db_generator import DemoDatabaseGenerator
-        generator = DemoDatabaseGenerator(demo_db_path)
+            raise
+        incompleta = True
+    if incompleta:
+        # Se completa en segundo plano; mientras tanto las consultas ven la base actual
+        coordinador.en_segundo_plano("complete_database", _completar_base, necesario=_base_incompleta)
+    return conn
+
+
+def _crear_base():
+    print("[DB] Base de datos demo no encontrada. Creandola...")
+    from demo_db_generator import DemoDatabaseGenerator
+    generator = DemoDatabaseGenerator(demo_db_path)
+    try:
         generator.create_database()
+    finally:
         generator.close_connection()
-        conn = sqlite3.connect(demo_db_path)
-        conn.row_factory = sqlite3.Row
-    return conn
+    print("[OK] Base de datos demo creada")
+
+
+def _base_incompleta():
+    conn = sqlite3.connect(demo_db_path)
+    try:
+        return conn.execute("SELECT 1 FROM VW_LottiIngresso LIMIT 1").fetchone() is None
+    except sqlite3.OperationalError:
+        return True
+    finally:
+        conn.close()
+
+
+def _completar_base():
+    print("[DB] Datos demo incompletos. Agregando turno actual...")
+    from demo_db_generator import DemoDatabaseGenerator
+    generator = DemoDatabaseGenerator(demo_db_path)
+    try:
+        generator.rollover_shift(fuente="database_demo")
+    finally:
+        generator.close_connection()
+
 
 def get_connection_unitec():
     """Obtiene una conexión a la base de datos UNITEC (simulada con SQLite)"""
@@ -0,0 +1,277 @@
+"""
+Instrumentacion de la capa SQL.
+
+Conexion y cursor SQLite que miden cada sentencia (latencia y filas) etiquetada
+con la funcion que la ejecuta. read_sql_adapted registra sus consultas completas
+(incluyendo la construccion del DataFrame) y marca el hilo para que el cursor
+interno de pandas no las cuente dos veces.
+
+Las sentencias cuya duracion completa (execute mas la lectura de sus filas) supera
+SLOW_QUERY_MS se escriben en el logger "panel.slow_sql" como JSON (una linea por
+consulta). La primera vez que se ve cada sentencia lenta se adjunta su EXPLAIN QUERY
+PLAN; si no se pudo obtener (conexion ya cerrada) se reintenta en la siguiente.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from metrics import DB_QUERY_ERRORS, DB_QUERY_ROWS, DB_QUERY_SECONDS, REGISTRY
+
+_CONTEXTO = threading.local()
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "250") or 250)
+slow_sql_logger = logging.getLogger("panel.slow_sql")
+
+DB_SLOW_QUERIES = REGISTRY.counter(
+    "panel_db_slow_queries_total", "Consultas que superaron el umbral de consulta lenta", ("fn", "via")
+)
+
+# Sentencias lentas cuyo plan ya se capturo (huella -> True)
+_PLANES_CAPTURADOS = set()
+_PLANES_MAX = 1000
+_planes_lock = threading.Lock()
+
+
+# Modulos intermedios que no cuentan como "funcion llamadora"
+_MODULOS_INTERNOS = ("pandas", "sqlite3", __name__)
+
+
+def nombre_llamador(profundidad=2):
+    """Nombre de la primera funcion fuera de pandas/sqlite3/este modulo en la pila."""
+    try:
+        frame = sys._getframe(profundidad)
+    except Exception:
+        return "desconocido"
+    while frame is not None:
+        modulo = frame.f_globals.get("__name__", "") or ""
+        if not modulo.startswith(_MODULOS_INTERNOS):
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "desconocido"
+
+
+def en_read_sql():
+    return bool(getattr(_CONTEXTO, "read_sql", False))
+
+
+class contexto_read_sql:
+    """Mientras este activo, el cursor instrumentado no registra (lo hace read_sql_adapted)."""
+
+    def __enter__(self):
+        self._previo = en_read_sql()
+        _CONTEXTO.read_sql = True
+        return self
+
+    def __exit__(self, *exc):
+        _CONTEXTO.read_sql = self._previo
+        return False
+
+
+def registrar_consulta(sql, params, duracion_s, filas, fn, via, conn=None, error=None):
+    """Punto unico donde se registran las consultas ejecutadas."""
+    if error is not None:
+        DB_QUERY_ERRORS.inc(fn=fn, via=via)
+        al_fallar = getattr(conn, "al_fallar", None)
+        if al_fallar is not None:
+            al_fallar(error)
+    DB_QUERY_SECONDS.observe(duracion_s, fn=fn, via=via)
+    if filas is not None and filas >= 0:
+        DB_QUERY_ROWS.observe(filas, fn=fn, via=via)
+    if duracion_s * 1000.0 >= SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.inc(fn=fn, via=via)
+        _registrar_consulta_lenta(sql, params, duracion_s, filas, fn, via, conn, error)
+
+
+def _huella_sql(sql):
+    normalizado = re.sub(r"\s+", " ", str(sql or "")).strip()
+    return hashlib.sha1(normalizado.encode("utf-8")).hexdigest()[:16], normalizado
+
+
+def _primera_vez(huella):
+    with _planes_lock:
+        if huella in _PLANES_CAPTURADOS or len(_PLANES_CAPTURADOS) >= _PLANES_MAX:
+            return False
+        _PLANES_CAPTURADOS.add(huella)
+        return True
+
+
+def _conexion_abierta(conn):
+    try:
+        conn.total_changes
+        return True
+    except sqlite3.ProgrammingError:
+        return False
+
+
+def _explain_query_plan(conn, sql, params):
+    """EXPLAIN QUERY PLAN con un cursor sin instrumentar (no ejecuta la sentencia)."""
+    cur = conn.cursor(sqlite3.Cursor)
+    try:
+        cur.execute("EXPLAIN QUERY PLAN " + str(sql), params if params is not None else ())
+        return [str(tuple(fila)[-1]) for fila in cur.fetchall()]
+    finally:
+        cur.close()
+
+
+def _registrar_consulta_lenta(sql, params, duracion_s, filas, fn, via, conn, error):
+    if not slow_sql_logger.isEnabledFor(logging.INFO):
+        return
+    huella, sql_normalizado = _huella_sql(sql)
+    registro = {
+        "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+        "fn": fn,
+        "via": via,
+        "duracion_ms": round(duracion_s * 1000.0, 3),
+        "filas": filas,
+        "huella": huella,
+        "sql": sql_normalizado,
+        "params": list(params) if isinstance(params, (list, tuple)) else params,
+    }
+    if error is not None:
+        registro["error"] = f"{type(error).__name__}: {error}"
+    # Una sentencia registrada al liberar el cursor puede llegar con la conexion cerrada:
+    # no se gasta su captura del plan
+    if conn is not None and _conexion_abierta(conn) and _primera_vez(huella):
+        try:
+            registro["plan"] = _explain_query_plan(conn, sql, params)
+        except Exception as e:
+            registro["plan_error"] = f"{type(e).__name__}: {e}"
+    slow_sql_logger.info(json.dumps(registro, default=str, ensure_ascii=False))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor que registra cada sentencia una sola vez.
+
+    Las sentencias que retornan filas (SELECT, PRAGMA, RETURNING) se registran al
+    terminar de leerlas: la duracion suma execute() y los fetch*, y las filas son las
+    leidas en total. Terminan al agotar el resultado, al ejecutar otra sentencia en el
+    cursor o al cerrarlo/liberarlo.
+    """
+
+    _pendiente = None  # [sql, params, fn, segundos, filas] de la sentencia en lectura
+
+    def _cerrar_pendiente(self, error=None):
+        pendiente, self._pendiente = self._pendiente, None
+        if pendiente is not None:
+            sql, params, fn, segundos, filas = pendiente
+            registrar_consulta(sql, params, segundos, filas, fn, "cursor", self.connection, error)
+
+    def _leer(self, leer, *args):
+        """Ejecuta un fetch sumando su tiempo a la sentencia pendiente."""
+        pendiente = self._pendiente
+        inicio = time.perf_counter()
+        try:
+            resultado = leer(*args)
+        except StopIteration:
+            pendiente[3] += time.perf_counter() - inicio
+            self._cerrar_pendiente()
+            raise
+        except Exception as e:
+            pendiente[3] += time.perf_counter() - inicio
+            self._cerrar_pendiente(e)
+            raise
+        pendiente[3] += time.perf_counter() - inicio
+        return resultado
+
+    def execute(self, sql, parameters=()):
+        if self._pendiente is not None:
+            self._cerrar_pendiente()
+        if en_read_sql():
+            return super().execute(sql, parameters)
+        fn = nombre_llamador()
+        inicio = time.perf_counter()
+        try:
+            resultado = super().execute(sql, parameters)
+        except Exception as e:
+            registrar_consulta(sql, parameters, time.perf_counter() - inicio, None, fn, "cursor", self.connection, e)
+            raise
+        if self.description is not None:
+            # Retorna filas: se registra al terminar de leerlas (fetch*)
+            self._pendiente = [sql, parameters, fn, time.perf_counter() - inicio, 0]
+            return resultado
+        filas = self.rowcount if self.rowcount is not None and self.rowcount >= 0 else None
+        registrar_consulta(sql, parameters, time.perf_counter() - inicio, filas, fn, "cursor", self.connection)
+        return resultado
+
+    def executemany(self, sql, seq_of_parameters):
+        if self._pendiente is not None:
+            self._cerrar_pendiente()
+        if en_read_sql():
+            return super().executemany(sql, seq_of_parameters)
+        fn = nombre_llamador()
+        inicio = time.perf_counter()
+        try:
+            resultado = super().executemany(sql, seq_of_parameters)
+        except Exception as e:
+            registrar_consulta(sql, None, time.perf_counter() - inicio, None, fn, "cursor", self.connection, e)
+            raise
+        registrar_consulta(sql, None, time.perf_counter() - inicio, self.rowcount, fn, "cursor", self.connection)
+        return resultado
+
+    def fetchall(self):
+        if self._pendiente is None:
+            return super().fetchall()
+        filas = self._leer(super().fetchall)
+        self._pendiente[4] += len(filas)
+        self._cerrar_pendiente()
+        return filas
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        if self._pendiente is None:
+            return super().fetchmany(size)
+        filas = self._leer(super().fetchmany, size)
+        self._pendiente[4] += len(filas)
+        if len(filas) < size:
+            self._cerrar_pendiente()
+        return filas
+
+    def fetchone(self):
+        if self._pendiente is None:
+            return super().fetchone()
+        fila = self._leer(super().fetchone)
+        if fila is None:
+            self._cerrar_pendiente()
+        else:
+            self._pendiente[4] += 1
+        return fila
+
+    def __next__(self):
+        if self._pendiente is None:
+            return super().__next__()
+        fila = self._leer(super().__next__)
+        self._pendiente[4] += 1
+        return fila
+
+    def close(self):
+        if self._pendiente is not None:
+            self._cerrar_pendiente()
+        super().close()
+
+    def __del__(self):
+        if self._pendiente is not None:
+            try:
+                self._cerrar_pendiente()
+            except Exception:
+                pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    al_fallar = None  # callback(error) para las sentencias que fallan (circuit breaker)
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute de sqlite3 no pasa por InstrumentedCursor.execute
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
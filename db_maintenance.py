@@ -0,0 +1,381 @@
+"""
+Mantenimiento de la base SQLite: retencion, vacuum incremental, ANALYZE y checkpoint del WAL.
+
+Un hilo (MaintenanceScheduler) revisa cada PANEL_MAINT_CHECK_S segundos de reloj si
+se esta en la ventana tranquila (por defecto 04:00-07:00, entre el fin del turno de
+noche y el inicio del de dia) y, una vez por fecha, ejecuta:
+
+1. indices: crea los indices de las consultas del panel si faltan;
+2. retencion: archiva los turnos cerrados (si pyarrow esta instalado) y poda las
+   tablas vivas fuera de PANEL_RETENTION_DAYS (ver shift_archive.podar). Sin pyarrow
+   y sin PANEL_RETENTION_REQUIRE_ARCHIVE=0 la poda queda deshabilitada y el informe
+   lo indica (resultado "omitida");
+3. vacuum: PRAGMA incremental_vacuum (la primera vez convierte la base a
+   auto_vacuum=INCREMENTAL con un VACUUM completo);
+4. analyze: ANALYZE cada PANEL_MAINT_ANALYZE_DAYS dias, PRAGMA optimize el resto;
+5. checkpoint: PRAGMA wal_checkpoint(TRUNCATE).
+
+Cada ejecucion deja un informe en PANEL_Mantenimiento (una fila por tarea mas un
+resumen con tamano en disco y latencia de consultas de referencia antes y despues).
+La ejecucion pasa por regen_coordinator: un solo proceso la hace y no se cruza con
+una regeneracion de la base.
+
+Uso:
+    python db_maintenance.py --run          # ejecutar ahora (fuera de la ventana)
+    python db_maintenance.py --report 5     # ultimos informes
+"""
+import datetime
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+
+import clock
+import regen_coordinator
+import shift_archive
+from config_demo import env_float
+from metrics import DB_FILE_BYTES, DB_MAINT_SECONDS
+
+
+def _env_ventana(nombre, defecto):
+    texto = os.environ.get(nombre, defecto) or defecto
+    try:
+        inicio, fin = (datetime.time.fromisoformat(p.strip()) for p in texto.split("-"))
+        return inicio, fin
+    except Exception:
+        inicio, fin = defecto.split("-")
+        return datetime.time.fromisoformat(inicio), datetime.time.fromisoformat(fin)
+
+
+MAINT_WINDOW = _env_ventana("PANEL_MAINT_WINDOW", "04:00-07:00")
+MAINT_CHECK_S = env_float("PANEL_MAINT_CHECK_S", 300)
+RETENTION_DAYS = shift_archive.RETENTION_DAYS
+RETENTION_REQUIRE_ARCHIVE = shift_archive.RETENTION_REQUIRE_ARCHIVE
+ANALYZE_DAYS = env_float("PANEL_MAINT_ANALYZE_DAYS", 7)
+VACUUM_PAGES = int(env_float("PANEL_MAINT_VACUUM_PAGES", 0))  # 0 = toda la lista libre
+BUSY_TIMEOUT_S = env_float("PANEL_MAINT_BUSY_TIMEOUT_S", 30)
+
+TABLA_INFORME = "PANEL_Mantenimiento"
+
+# Indices de las consultas del panel y de la poda (CREATE INDEX IF NOT EXISTS)
+INDICES = (
+    ("IX_Storico_ProcLotto", "VW_MON_Partita_Storico_Agent", "ProcessoCodice, LottoCodice, DataAcquisizione"),
+    ("IX_Storico_DataAcq", "VW_MON_Partita_Storico_Agent", "DataAcquisizione"),
+    ("IX_LottiIngresso_DataLettura", "VW_LottiIngresso", "DataLettura"),
+    ("IX_LottiIngresso_Lotto", "VW_LottiIngresso", "CodiceLotto, CodiceProcesso"),
+)
+
+# Consultas de referencia (latencia antes/despues del mantenimiento)
+_SONDAS = (
+    "SELECT * FROM VW_LottiIngresso ORDER BY DataLettura DESC LIMIT 50",
+    "SELECT COUNT(*) FROM VW_LottiIngresso WHERE DataLettura >= ?",
+    "SELECT ProcessoCodice, LottoCodice, LottoInizio, LottoFine "
+    "FROM VW_MON_Partita_Storico_Agent ORDER BY DataAcquisizione DESC LIMIT 800",
+)
+
+_SQL_INFORME = f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_INFORME} (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        Ejecucion TEXT NOT NULL,
+        Fecha TEXT NOT NULL,
+        Tarea TEXT NOT NULL,
+        Resultado TEXT NOT NULL,
+        DuracionS REAL NOT NULL,
+        Detalle TEXT
+    )
+"""
+
+
+def asegurar_indices(cur):
+    for nombre, tabla, columnas in INDICES:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} ({columnas})")
+
+
+def crear_tabla(cur):
+    cur.execute(_SQL_INFORME)
+
+
+def en_ventana(ahora):
+    inicio, fin = MAINT_WINDOW
+    t = ahora.time()
+    if inicio <= fin:
+        return inicio <= t < fin
+    return t >= inicio or t < fin
+
+
+def tamano_bytes(db_path):
+    total = 0
+    for sufijo in ("", "-wal"):
+        try:
+            total += os.path.getsize(db_path + sufijo)
+        except OSError:
+            pass
+    return total
+
+
+def sonda_latencia(conn, ahora, repeticiones=5):
+    """Mediana (ms) de la suma de las consultas de referencia."""
+    desde = (ahora - datetime.timedelta(hours=10)).isoformat(sep=" ")
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for sql in _SONDAS:
+            try:
+                conn.execute(sql, (desde,) if "?" in sql else ()).fetchall()
+            except sqlite3.OperationalError:
+                pass
+        tiempos.append((time.perf_counter() - inicio) * 1000.0)
+    return round(statistics.median(tiempos), 2)
+
+
+def _tarea_indices(conn, ahora):
+    antes = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index'").fetchone()[0]
+    asegurar_indices(conn)
+    despues = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index'").fetchone()[0]
+    return {"creados": despues - antes}
+
+
+def _tarea_retencion(conn, ahora):
+    detalle = {"retencion_dias": RETENTION_DAYS}
+    if shift_archive.disponible():
+        detalle["archivo"] = shift_archive.archivar_pendientes(conn, ahora)
+    motivo = shift_archive.poda_deshabilitada(RETENTION_REQUIRE_ARCHIVE)
+    if motivo:
+        detalle["omitida"] = motivo
+        return detalle
+    detalle["borradas"] = shift_archive.podar(
+        conn, RETENTION_DAYS, ahora, exigir_archivo=RETENTION_REQUIRE_ARCHIVE
+    )
+    return detalle
+
+
+def _tarea_vacuum(conn, ahora):
+    libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    modo = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if modo != 2:
+        # Una sola vez: el modo incremental solo se activa reescribiendo el archivo
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return {"convertida": True, "paginas_libres_antes": libres}
+    # executescript recorre el pragma completo (execute solo libera una pagina por paso)
+    paginas = f"({VACUUM_PAGES})" if VACUUM_PAGES > 0 else ""
+    conn.executescript(f"PRAGMA incremental_vacuum{paginas};")
+    return {
+        "paginas_libres_antes": libres,
+        "paginas_libres_despues": conn.execute("PRAGMA freelist_count").fetchone()[0],
+    }
+
+
+def _tarea_analyze(conn, ahora):
+    fila = conn.execute(
+        f"SELECT MAX(Ejecucion) FROM {TABLA_INFORME} WHERE Tarea = 'analyze' AND Resultado = 'ok' "
+        "AND Detalle LIKE '%\"analyze\": true%'"
+    ).fetchone()
+    ultimo = datetime.datetime.fromisoformat(fila[0]) if fila and fila[0] else None
+    if ultimo is None or (ahora - ultimo) >= datetime.timedelta(days=ANALYZE_DAYS):
+        conn.execute("ANALYZE")
+        return {"analyze": True}
+    conn.execute("PRAGMA optimize")
+    return {"analyze": False, "optimize": True}
+
+
+def _tarea_checkpoint(conn, ahora):
+    ocupado, paginas_wal, copiadas = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return {"ocupado": bool(ocupado), "paginas_wal": paginas_wal, "copiadas": copiadas}
+
+
+TAREAS = (
+    ("indices", _tarea_indices),
+    ("retencion", _tarea_retencion),
+    ("vacuum", _tarea_vacuum),
+    ("analyze", _tarea_analyze),
+    ("checkpoint", _tarea_checkpoint),
+)
+
+
+def ejecutar(db_path, ahora=None):
+    """Ejecuta todas las tareas y registra el informe. Retorna el resumen."""
+    ahora = ahora or clock.now_local()
+    ejecucion = ahora.isoformat(sep=" ", timespec="seconds")
+    fecha = ahora.date().isoformat()
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_S, isolation_level=None)
+    try:
+        crear_tabla(conn)
+        inicio_total = time.perf_counter()
+        bytes_antes = tamano_bytes(db_path)
+        sonda_antes = sonda_latencia(conn, ahora)
+        filas = []
+        errores = 0
+        for nombre, tarea in TAREAS:
+            inicio = time.perf_counter()
+            try:
+                detalle = tarea(conn, ahora)
+                resultado = "omitida" if detalle.get("omitida") else "ok"
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                detalle, resultado = {"error": str(e)}, "error"
+                errores += 1
+            duracion = time.perf_counter() - inicio
+            DB_MAINT_SECONDS.observe(duracion, tarea=nombre)
+            filas.append((ejecucion, fecha, nombre, resultado, round(duracion, 3), json.dumps(detalle, default=str)))
+
+        resumen = {
+            "bytes_antes": bytes_antes,
+            "bytes_despues": tamano_bytes(db_path),
+            "sonda_ms_antes": sonda_antes,
+            "sonda_ms_despues": sonda_latencia(conn, ahora),
+            "tareas": {f[2]: f[3] for f in filas},
+        }
+        DB_FILE_BYTES.set(resumen["bytes_despues"])
+        filas.append((
+            ejecucion, fecha, "resumen", "ok" if not errores else "parcial",
+            round(time.perf_counter() - inicio_total, 3), json.dumps(resumen),
+        ))
+        conn.executemany(
+            f"""
+            INSERT INTO {TABLA_INFORME} (Ejecucion, Fecha, Tarea, Resultado, DuracionS, Detalle)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            filas,
+        )
+        print(
+            f"[MANT] {ejecucion}: {resumen['bytes_antes'] / 1e6:.1f} -> {resumen['bytes_despues'] / 1e6:.1f} MB, "
+            f"sonda {resumen['sonda_ms_antes']} -> {resumen['sonda_ms_despues']} ms, tareas {resumen['tareas']}"
+        )
+        return resumen
+    finally:
+        conn.close()
+
+
+def ya_ejecutado(db_path, fecha):
+    try:
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_S)
+        try:
+            fila = conn.execute(
+                f"SELECT 1 FROM {TABLA_INFORME} WHERE Tarea = 'resumen' AND Fecha = ? LIMIT 1", (fecha,)
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        return False
+    return fila is not None
+
+
+def informes(db_path, limite=5):
+    """Ultimos resumenes [{ejecucion, resultado, duracion_s, ...detalle}]."""
+    try:
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_S)
+        try:
+            filas = conn.execute(
+                f"""
+                SELECT Ejecucion, Resultado, DuracionS, Detalle FROM {TABLA_INFORME}
+                WHERE Tarea = 'resumen' ORDER BY Id DESC LIMIT ?
+                """,
+                (int(limite),),
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        return []
+    return [
+        dict({"ejecucion": e, "resultado": r, "duracion_s": d}, **json.loads(det or "{}"))
+        for e, r, d, det in filas
+    ]
+
+
+class MaintenanceScheduler:
+    """Hilo que ejecuta el mantenimiento una vez por fecha dentro de la ventana tranquila."""
+
+    def __init__(self, db_path, intervalo_s=MAINT_CHECK_S):
+        self.db_path = db_path
+        self.intervalo_s = float(intervalo_s)
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def revisar(self, ahora=None, forzar=False):
+        """Ejecuta si corresponde. Retorna el resumen o None."""
+        ahora = ahora or clock.now_local()
+        if not forzar and not en_ventana(ahora):
+            return None
+        fecha = ahora.date().isoformat()
+        coordinador = regen_coordinator.para_base(self.db_path)
+        return coordinador.ejecutar(
+            "maintenance",
+            lambda: ejecutar(self.db_path, ahora),
+            clave=f"maintenance|{fecha}",
+            esperar=forzar,
+            timeout_s=BUSY_TIMEOUT_S,
+            necesario=None if forzar else (lambda: not ya_ejecutado(self.db_path, fecha)),
+        )
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                self.revisar()
+            except Exception as e:
+                print(f"[WARN] Mantenimiento fallido: {e}")
+            self._detener.wait(self.intervalo_s / clock.factor())
+
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="db-maintenance", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self):
+        self._detener.set()
+
+    def estado(self):
+        inicio, fin = MAINT_WINDOW
+        return {
+            "activo": bool(self._hilo and self._hilo.is_alive()),
+            "ventana": f"{inicio.strftime('%H:%M')}-{fin.strftime('%H:%M')}",
+            "en_ventana": en_ventana(clock.now_local()),
+            "retencion_dias": RETENTION_DAYS,
+            "exige_archivo": RETENTION_REQUIRE_ARCHIVE,
+            "archivo_disponible": shift_archive.disponible(),
+            "retencion_omitida": shift_archive.poda_deshabilitada(RETENTION_REQUIRE_ARCHIVE),
+            "ultimos": informes(self.db_path, 3),
+        }
+
+
+_PLANIFICADOR = None
+
+
+def iniciar_desde_entorno(db_path):
+    """Inicia el planificador salvo PANEL_MAINTENANCE=0 (idempotente). Retorna la instancia o None."""
+    global _PLANIFICADOR
+    if os.environ.get("PANEL_MAINTENANCE", "1") == "0" or not db_path:
+        return None
+    if _PLANIFICADOR is None:
+        _PLANIFICADOR = MaintenanceScheduler(db_path)
+        motivo = shift_archive.poda_deshabilitada(RETENTION_REQUIRE_ARCHIVE)
+        if motivo:
+            print(f"[WARN] Mantenimiento: retencion deshabilitada ({motivo})")
+    return _PLANIFICADOR.iniciar()
+
+
+def planificador():
+    return _PLANIFICADOR
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de la base SQLite")
+    parser.add_argument("--db", default="demo_database.db", help="Ruta a la base de datos")
+    parser.add_argument("--run", action="store_true", help="Ejecutar ahora (sin esperar la ventana)")
+    parser.add_argument("--report", type=int, default=None, metavar="N", help="Mostrar los ultimos N informes")
+    args = parser.parse_args()
+
+    if not (args.run or args.report):
+        parser.error("indicar --run o --report N")
+    if args.run:
+        MaintenanceScheduler(args.db).revisar(forzar=True)
+    if args.report:
+        for informe in informes(args.db, args.report):
+            print(json.dumps(informe, ensure_ascii=False))
@@ -8,10 +8,15 @@ import numpy as np
 from datetime import datetime, timedelta
 import time
 import os
-try:
-    from zoneinfo import ZoneInfo
-except Exception:
-    ZoneInfo = None
+from contextlib import contextmanager
+
+import clock
+import data_freshness
+import db_maintenance
+import production_ledger
+import lot_stats
+import production_rollups
+import regen_coordinator
 
 DEMO_FIXED_CAJAS_TOTALES = 200
 DEMO_FIXED_CAJAS_VACIADAS = 0
@@ -19,15 +24,13 @@ DEMO_FIXED_KG_TOTALES = 4000
 DEMO_FIXED_KG_POR_HORA = 12000
 DEMO_FIXED_CAJAS_STEP = 1
 LOCAL_TZ_NAME = os.environ.get("LOCAL_TIMEZONE", "America/Santiago")
+# Espera maxima por el lock de escritura (segundos)
+DB_BUSY_TIMEOUT_S = float(os.environ.get("DEMO_DB_BUSY_TIMEOUT_S", "5") or 5)
 
 
 def now_local():
-    if ZoneInfo:
-        try:
-            return datetime.now(ZoneInfo(LOCAL_TZ_NAME)).replace(tzinfo=None)
-        except Exception:
-            pass
-    return datetime.now()
+    # Hora de planta (real o virtual acelerada, ver clock.py)
+    return clock.now_local(LOCAL_TZ_NAME)
 
 class DemoDatabaseGenerator:
     def __init__(self, db_path="demo_database.db"):
@@ -69,11 +72,37 @@ class DemoDatabaseGenerator:
             {"id": 5, "nombre": "Premium Produce Export"},
         ]
 
-    def create_connection(self):
-        """Crear conexión a la base de datos"""
-        self.conn = sqlite3.connect(self.db_path)
+    def create_connection(self, wal=False):
+        """Crear conexión a la base de datos
+
+        Con wal=True la base queda en modo WAL (persistente en el archivo): los
+        lectores del dashboard no se bloquean mientras el simulador escribe.
+        """
+        self.conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT_S)
+        if wal:
+            try:
+                self.conn.execute("PRAGMA journal_mode = WAL")
+                self.conn.execute("PRAGMA synchronous = NORMAL")
+            except sqlite3.OperationalError as e:
+                # Otro proceso tiene la base abierta en modo rollback; se reintenta al reconectar
+                print(f"[WARN] No se pudo activar WAL: {e}")
         return self.conn
 
+    @contextmanager
+    def transaction(self):
+        """Transaccion de escritura unica (BEGIN IMMEDIATE ... COMMIT / ROLLBACK).
+
+        Usar con los metodos de generacion en commit=False para que todo el ciclo
+        tome el lock de escritura una sola vez.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
     def create_tables(self):
         """Crear todas las tablas necesarias"""
         queries = [
@@ -175,8 +204,16 @@ class DemoDatabaseGenerator:
         ]
 
         cursor = self.conn.cursor()
+        # Solo tiene efecto en una base nueva: permite PRAGMA incremental_vacuum (db_maintenance)
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
         for query in queries:
             cursor.execute(query)
+        # Indices de las consultas del panel (historial por lote, lecturas por fecha)
+        db_maintenance.asegurar_indices(cursor)
+        # Version de datos para medir frescura (PANEL_DataVersion)
+        data_freshness.crear_tabla(cursor)
+        # Libro de eventos de produccion y sus agregados
+        production_ledger.crear_tablas(cursor)
         self.conn.commit()
 
     def populate_master_data(self):
@@ -199,88 +236,85 @@ class DemoDatabaseGenerator:
         self.conn.commit()
 
 
-    def generate_lot_data(self, num_lotes=50):
-        """Generar datos de lotes para simulacion (determinista, sin aleatoriedad)."""
-        cursor = self.conn.cursor()
-
-        # Limpiar datos existentes
-        cursor.execute("DELETE FROM VW_LottiIngresso")
-        cursor.execute("DELETE FROM VW_MON_Partita_Corrente")
-        cursor.execute("DELETE FROM VW_MON_Partita_Storico_Agent")
-        cursor.execute("DELETE FROM PROD_Lotto")
-        cursor.execute("DELETE FROM PROD_Unita_OUT")
-
-        def _build_fixed_shift_records(shift_date, shift_type):
-            if shift_type == "day":
-                rows = [
-                    ("07:00", "CSG004", "AgroPatagonia Sur", "EMP001", "1008", 154, 9702, "Gala Premium"),
-                    ("08:00", "CSG005", "NorteFruit SpA", "EMP002", "1009", 167, 10521, "Williams"),
-                    ("09:00", "CSG001", "ValleVerde Ltda.", "CAL001", "1010", 180, 11340, "Rainier"),
-                    ("10:00", "CSG002", "Hacienda Central", "CAL002", "1011", 193, 12159, "Flame"),
-                    ("11:00", "CSG003", "Andes Produce", "CAL003", "1012", 55, 3465, "Gala Roja"),
-                    ("12:00", "CSG004", "AgroPatagonia Sur", "EMP001", "1013", 68, 4284, "Packham"),
-                    ("13:00", "CSG005", "NorteFruit SpA", "EMP002", "1014", 81, 5103, "Sweetheart"),
-                    ("14:00", "CSG001", "ValleVerde Ltda.", "CAL001", "1015", 94, 5922, "Thompson"),
-                    ("15:00", "CSG002", "Hacienda Central", "CAL002", "1016", 107, 6741, "Gala Verde"),
-                    ("16:00", "CSG003", "Andes Produce", "CAL003", "1017", 120, 7560, "Tardía"),
-                ]
-            else:
-                rows = [
-                    ("17:00", "CSG004", "AgroPatagonia Sur", "EMP001", "1008", 158, 9986, "Gala Premium"),
-                    ("18:05", "CSG005", "NorteFruit SpA", "EMP002", "1009", 163, 10236, "Williams"),
-                    ("19:10", "CSG001", "ValleVerde Ltda.", "CAL001", "1010", 176, 11176, "Rainier"),
-                    ("20:15", "CSG002", "Hacienda Central", "CAL002", "1011", 189, 11888, "Flame"),
-                    ("21:10", "CSG003", "Andes Produce", "CAL003", "1012", 58, 3619, "Gala Roja"),
-                    ("22:05", "CSG004", "AgroPatagonia Sur", "EMP001", "1013", 71, 4480, "Packham"),
-                    ("23:00", "CSG005", "NorteFruit SpA", "EMP002", "1014", 79, 4945, "Sweetheart"),
-                    ("00:20", "CSG001", "ValleVerde Ltda.", "CAL001", "1015", 97, 6111, "Thompson"),
-                    ("01:55", "CSG002", "Hacienda Central", "CAL002", "1016", 104, 6594, "Gala Verde"),
-                    ("03:25", "CSG003", "Andes Produce", "CAL003", "1017", 116, 7274, "Tardía"),
-                ]
-
-            records = []
-            for row in rows:
-                time_str, codigo_proveedor, proveedor_nombre, codigo_proceso, codigo_lote, cajas, kg, variedad = row
-                base_date = shift_date
-                hora = datetime.strptime(time_str, "%H:%M").time()
-                if shift_type == "night" and hora < datetime.strptime("07:00", "%H:%M").time():
-                    base_date = shift_date + timedelta(days=1)
-                fecha_lectura = datetime.combine(base_date, hora)
-                peso_netto = float(kg) * 1000
-                unidades_planificadas = int(cajas)
-                unidades_vaciadas = int(cajas)
-                unidades_restantes = 0
-                exportador_nombre = self.exportadores[(int(codigo_lote) - 1000) % len(self.exportadores)]["nombre"]
-                records.append({
-                    "codigo_proveedor": codigo_proveedor,
-                    "proveedor_nombre": proveedor_nombre,
-                    "codigo_proceso": codigo_proceso,
-                    "codigo_lote": codigo_lote,
-                    "unidades_planificadas": unidades_planificadas,
-                    "unidades_vaciadas": unidades_vaciadas,
-                    "unidades_restantes": unidades_restantes,
-                    "variedad": variedad,
-                    "peso_netto": peso_netto,
-                    "fecha_lectura": fecha_lectura,
-                    "producto_codigo": None,
-                    "exportador_nombre": exportador_nombre,
-                })
-            return records
-
-        now = now_local()
+    @staticmethod
+    def _shift_window(now):
+        """(tipo, fecha, inicio, fin) del turno de `now`: dia 07:00-17:00, noche 17:00-04:00"""
         t = now.time()
         day_start_time = datetime.strptime("07:00", "%H:%M").time()
         night_start_time = datetime.strptime("17:00", "%H:%M").time()
+        night_end_time = datetime.strptime("04:00", "%H:%M").time()
 
         if t >= day_start_time and t < night_start_time:
-            shift_type = "day"
             shift_date = now.date()
+            return ("day", shift_date, datetime.combine(shift_date, day_start_time),
+                    datetime.combine(shift_date, night_start_time))
+        shift_date = now.date() if t >= night_start_time else (now - timedelta(days=1)).date()
+        return ("night", shift_date, datetime.combine(shift_date, night_start_time),
+                datetime.combine(shift_date + timedelta(days=1), night_end_time))
+
+    def _fixed_shift_records(self, shift_date, shift_type, codigo_inicial=None):
+        """Lotes fijos del turno. Con `codigo_inicial` los codigos se renumeran
+        correlativos desde ese valor (para agregar un turno sin repetir codigos)."""
+        if shift_type == "day":
+            rows = [
+                ("07:00", "CSG004", "AgroPatagonia Sur", "EMP001", "1008", 154, 9702, "Gala Premium"),
+                ("08:00", "CSG005", "NorteFruit SpA", "EMP002", "1009", 167, 10521, "Williams"),
+                ("09:00", "CSG001", "ValleVerde Ltda.", "CAL001", "1010", 180, 11340, "Rainier"),
+                ("10:00", "CSG002", "Hacienda Central", "CAL002", "1011", 193, 12159, "Flame"),
+                ("11:00", "CSG003", "Andes Produce", "CAL003", "1012", 55, 3465, "Gala Roja"),
+                ("12:00", "CSG004", "AgroPatagonia Sur", "EMP001", "1013", 68, 4284, "Packham"),
+                ("13:00", "CSG005", "NorteFruit SpA", "EMP002", "1014", 81, 5103, "Sweetheart"),
+                ("14:00", "CSG001", "ValleVerde Ltda.", "CAL001", "1015", 94, 5922, "Thompson"),
+                ("15:00", "CSG002", "Hacienda Central", "CAL002", "1016", 107, 6741, "Gala Verde"),
+                ("16:00", "CSG003", "Andes Produce", "CAL003", "1017", 120, 7560, "Tardía"),
+            ]
         else:
-            shift_type = "night"
-            shift_date = now.date() if t >= night_start_time else (now - timedelta(days=1)).date()
-
-        lotes_data = _build_fixed_shift_records(shift_date, shift_type)
+            rows = [
+                ("17:00", "CSG004", "AgroPatagonia Sur", "EMP001", "1008", 158, 9986, "Gala Premium"),
+                ("18:05", "CSG005", "NorteFruit SpA", "EMP002", "1009", 163, 10236, "Williams"),
+                ("19:10", "CSG001", "ValleVerde Ltda.", "CAL001", "1010", 176, 11176, "Rainier"),
+                ("20:15", "CSG002", "Hacienda Central", "CAL002", "1011", 189, 11888, "Flame"),
+                ("21:10", "CSG003", "Andes Produce", "CAL003", "1012", 58, 3619, "Gala Roja"),
+                ("22:05", "CSG004", "AgroPatagonia Sur", "EMP001", "1013", 71, 4480, "Packham"),
+                ("23:00", "CSG005", "NorteFruit SpA", "EMP002", "1014", 79, 4945, "Sweetheart"),
+                ("00:20", "CSG001", "ValleVerde Ltda.", "CAL001", "1015", 97, 6111, "Thompson"),
+                ("01:55", "CSG002", "Hacienda Central", "CAL002", "1016", 104, 6594, "Gala Verde"),
+                ("03:25", "CSG003", "Andes Produce", "CAL003", "1017", 116, 7274, "Tardía"),
+            ]
 
+        records = []
+        for i, row in enumerate(rows):
+            time_str, codigo_proveedor, proveedor_nombre, codigo_proceso, codigo_lote, cajas, kg, variedad = row
+            if codigo_inicial is not None:
+                codigo_lote = f"{int(codigo_inicial) + i:04d}"
+            base_date = shift_date
+            hora = datetime.strptime(time_str, "%H:%M").time()
+            if shift_type == "night" and hora < datetime.strptime("07:00", "%H:%M").time():
+                base_date = shift_date + timedelta(days=1)
+            fecha_lectura = datetime.combine(base_date, hora)
+            peso_netto = float(kg) * 1000
+            unidades_planificadas = int(cajas)
+            unidades_vaciadas = int(cajas)
+            unidades_restantes = 0
+            exportador_nombre = self.exportadores[(int(codigo_lote) - 1000) % len(self.exportadores)]["nombre"]
+            records.append({
+                "codigo_proveedor": codigo_proveedor,
+                "proveedor_nombre": proveedor_nombre,
+                "codigo_proceso": codigo_proceso,
+                "codigo_lote": codigo_lote,
+                "unidades_planificadas": unidades_planificadas,
+                "unidades_vaciadas": unidades_vaciadas,
+                "unidades_restantes": unidades_restantes,
+                "variedad": variedad,
+                "peso_netto": peso_netto,
+                "fecha_lectura": fecha_lectura,
+                "producto_codigo": None,
+                "exportador_nombre": exportador_nombre,
+            })
+        return records
+
+    def _insert_lotes(self, cursor, lotes_data):
+        """Insertar lotes en VW_LottiIngresso, PROD_Lotto y PROD_Unita_OUT"""
         for lote_data in lotes_data:
             cursor.execute("""
                 INSERT INTO VW_LottiIngresso
@@ -313,27 +347,163 @@ class DemoDatabaseGenerator:
                 VALUES (?, ?, ?)
             """, (lote_id, exportador["id"], lote_data["fecha_lectura"]))
 
+    def generate_lot_data(self, num_lotes=50):
+        """Generar datos de lotes para simulacion (determinista, sin aleatoriedad)."""
+        cursor = self.conn.cursor()
+
+        # Limpiar datos existentes
+        cursor.execute("DELETE FROM VW_LottiIngresso")
+        cursor.execute("DELETE FROM VW_MON_Partita_Corrente")
+        cursor.execute("DELETE FROM VW_MON_Partita_Storico_Agent")
+        data_freshness.marcar_borrado(cursor, "VW_MON_Partita_Storico_Agent")
+        cursor.execute("DELETE FROM PROD_Lotto")
+        cursor.execute("DELETE FROM PROD_Unita_OUT")
+        production_ledger.reiniciar(cursor)
+
+        shift_type, shift_date, _, _ = self._shift_window(now_local())
+        lotes_data = self._fixed_shift_records(shift_date, shift_type)
+
+        self._insert_lotes(cursor, lotes_data)
+
         self.conn.commit()
         return lotes_data
 
-    def generate_current_production_data(self, lote_actual=None):
-        """Generar datos de producción actual (simula VW_MON_Partita_Corrente)"""
+    def append_shift_data(self, now=None, commit=True):
+        """Agregar los lotes del turno de `now` sin tocar los datos anteriores.
+
+        A diferencia de create_database no borra nada: cierra los lotes pendientes de
+        turnos anteriores, registra su historial en VW_MON_Partita_Storico_Agent y
+        agrega los lotes fijos del turno con codigos correlativos (MAX+1). Si el turno
+        ya tiene lotes no hace nada. Retorna la cantidad de lotes agregados.
+        """
         cursor = self.conn.cursor()
+        now = now or now_local()
+        shift_type, shift_date, inicio, fin = self._shift_window(now)
+
+        cursor.execute(
+            "SELECT COUNT(*) FROM VW_LottiIngresso WHERE DataLettura >= ? AND DataLettura <= ?",
+            (inicio, fin),
+        )
+        if cursor.fetchone()[0] > 0:
+            return 0
+
+        # Historial de los lotes anteriores que aun no lo tienen
+        cursor.execute("SELECT MAX(LottoInizio) FROM VW_MON_Partita_Storico_Agent")
+        ultimo_historial = cursor.fetchone()[0]
+        cursor.execute(
+            """
+            SELECT CodiceProcesso, CodiceLotto, DataLettura
+            FROM VW_LottiIngresso
+            WHERE DataLettura < ? AND DataLettura > ?
+            ORDER BY DataLettura ASC
+            """,
+            (inicio, ultimo_historial or ""),
+        )
+        anteriores = cursor.fetchall()
+        historial = []
+        for i, (proceso, codigo_lote, lectura) in enumerate(anteriores):
+            lote_inicio = datetime.fromisoformat(str(lectura))
+            lote_fin = self._shift_window(lote_inicio)[3]
+            if i + 1 < len(anteriores):
+                lote_fin = min(lote_fin, datetime.fromisoformat(str(anteriores[i + 1][2])))
+            historial.append((proceso, codigo_lote, lote_inicio, lote_fin, lote_fin))
+        cursor.executemany(
+            """
+            INSERT INTO VW_MON_Partita_Storico_Agent
+            (ProcessoCodice, LottoCodice, LottoInizio, LottoFine, DataAcquisizione)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            historial,
+        )
+
+        # Cerrar lotes pendientes de turnos anteriores (en el libro, completos como en las vistas)
+        for proceso, codigo_lote in production_ledger.lotes_abiertos(cursor):
+            fila = cursor.execute(
+                """
+                SELECT UnitaPianificate, PesoNetto FROM VW_LottiIngresso
+                WHERE CodiceProcesso = ? AND CodiceLotto = ? AND DataLettura < ?
+                """,
+                (proceso, codigo_lote, inicio),
+            ).fetchone()
+            if fila:
+                planificadas = int(fila[0] or 0)
+                kg_por_caja = (float(fila[1] or 0) / 1000) / planificadas if planificadas else 0.0
+                # Un segundo antes del turno nuevo: el cierre cuenta en el turno del lote
+                production_ledger.cerrar_lote(cursor, proceso, codigo_lote, inicio - timedelta(seconds=1),
+                                              planificadas, kg_por_caja, fuente="shift_rollover")
+        cursor.execute(
+            """
+            UPDATE VW_LottiIngresso
+            SET UnitaIn = UnitaPianificate, UnitaRestanti = 0
+            WHERE DataLettura < ? AND UnitaRestanti > 0
+            """,
+            (inicio,),
+        )
+
+        cursor.execute("SELECT COALESCE(MAX(CAST(CodiceLotto AS INTEGER)), 999) FROM VW_LottiIngresso")
+        codigo_inicial = int(cursor.fetchone()[0]) + 1
+        lotes_data = self._fixed_shift_records(shift_date, shift_type, codigo_inicial=codigo_inicial)
+        self._insert_lotes(cursor, lotes_data)
+
+        # El avance del demo actualiza estas filas; deben existir
+        cursor.execute("SELECT COUNT(*) FROM VW_MON_Partita_Corrente")
+        if cursor.fetchone()[0] == 0:
+            self.generate_current_production_data(commit=False)
+        cursor.execute("SELECT COUNT(*) FROM VW_MON_Produttivita_Turno_Corrente")
+        if cursor.fetchone()[0] == 0:
+            self.generate_turno_data(commit=False)
+
+        if commit:
+            self.conn.commit()
+        return len(lotes_data)
+
+    def rollover_shift(self, now=None, fuente="shift_rollover"):
+        """Cambio de turno incremental en una sola transaccion (tablas y maestros si faltan).
+        Retorna la cantidad de lotes agregados."""
+        if self.conn is None:
+            self.create_connection(wal=True)
+        self.create_tables()
+        self.populate_master_data()
+        with self.transaction():
+            agregados = self.append_shift_data(now, commit=False)
+            if agregados:
+                self.stamp_data_version(fuente, commit=False)
+        return agregados
 
-        # Limpiar datos actuales
-        cursor.execute("DELETE FROM VW_MON_Partita_Corrente")
+    def generate_current_production_data(self, lote_actual=None, commit=True, proceso=None):
+        """Generar datos de producción actual (simula VW_MON_Partita_Corrente)
+
+        Con `proceso` solo se reemplaza la fila de esa linea (simulacion multi-linea).
+        """
+        cursor = self.conn.cursor()
+        ahora = now_local()
+
+        # Limpiar datos actuales (los lotes terminados que dejan de estar en curso se cierran
+        # en el libro; uno sin terminar queda abierto: lo retoma el panel o lo cierra el
+        # cambio de turno)
+        columnas = "ProcessoCodice, LottoCodice, UnitaSvuotate, UnitaPianificate"
+        if proceso:
+            anteriores = cursor.execute(
+                f"SELECT {columnas} FROM VW_MON_Partita_Corrente WHERE ProcessoCodice = ?", (proceso,)
+            ).fetchall()
+            cursor.execute("DELETE FROM VW_MON_Partita_Corrente WHERE ProcessoCodice = ?", (proceso,))
+        else:
+            anteriores = cursor.execute(f"SELECT {columnas} FROM VW_MON_Partita_Corrente").fetchall()
+            cursor.execute("DELETE FROM VW_MON_Partita_Corrente")
 
         if lote_actual:
             # Usar lote específico
             lote = lote_actual
         else:
             # Obtener el lote MÁS RECIENTE (no aleatorio) para mostrar datos actuales
-            cursor.execute("""
+            filtro = "WHERE CodiceProcesso = ?" if proceso else ""
+            cursor.execute(f"""
                 SELECT CodiceProduttore, CodiceProcesso, CodiceLotto, UnitaPianificate,
                        UnitaIn, Varieta, PesoNetto, ProductorNombre, EsportatoreDescrizione
                 FROM VW_LottiIngresso
+                {filtro}
                 ORDER BY DataLettura DESC LIMIT 1
-            """)
+            """, (proceso,) if proceso else ())
             row = cursor.fetchone()
             if row:
                 lote = {
@@ -351,7 +521,7 @@ class DemoDatabaseGenerator:
                 # Datos por defecto si no hay lotes (cantidades reducidas)
                 lote = {
                     "codigo_proveedor": "CSG001",
-                    "codigo_proceso": "CAL001",
+                    "codigo_proceso": proceso or "CAL001",
                     "codigo_lote": "0001",
                     "unidades_planificadas": DEMO_FIXED_CAJAS_TOTALES,
                     "unidades_vaciadas": DEMO_FIXED_CAJAS_VACIADAS,
@@ -377,14 +547,27 @@ class DemoDatabaseGenerator:
             lote["unidades_planificadas"],
             lote["unidades_vaciadas"],
             lote["peso_netto"],
-            now_local(),
+            ahora,
             exportador_nombre
         ))
 
-        self.conn.commit()
+        for proceso_anterior, lote_anterior, vaciadas_anterior, plan_anterior in anteriores:
+            terminado = (vaciadas_anterior or 0) >= (plan_anterior or 0)
+            if terminado and (proceso_anterior, lote_anterior) != (lote["codigo_proceso"], lote["codigo_lote"]):
+                production_ledger.cerrar_lote(cursor, proceso_anterior, lote_anterior, ahora, fuente="simulador")
+        planificadas = lote["unidades_planificadas"] or 0
+        production_ledger.asegurar_lote(
+            cursor, lote["codigo_proceso"], lote["codigo_lote"], ahora,
+            cajas_iniciales=lote["unidades_vaciadas"],
+            kg_iniciales=(lote["peso_netto"] or 0) / 1000 * lote["unidades_vaciadas"] / planificadas if planificadas else 0,
+            fuente="simulador",
+        )
+
+        if commit:
+            self.conn.commit()
         return lote
 
-    def generate_turno_data(self, turno_actual=1):
+    def generate_turno_data(self, turno_actual=1, commit=True):
         """Generar datos de productividad por turno"""
         cursor = self.conn.cursor()
 
@@ -433,14 +616,15 @@ class DemoDatabaseGenerator:
             now
         ))
 
-        self.conn.commit()
+        if commit:
+            self.conn.commit()
 
-    def generate_historic_data(self, num_records=100):
-        """Generar datos históricos para análisis de tendencias (determinista)."""
-        cursor = self.conn.cursor()
+    def generate_historic_data(self, num_records=100, commit=True):
+        """Generar datos históricos para análisis de tendencias (determinista).
 
-        # Limpiar datos históricos
-        cursor.execute("DELETE FROM VW_MON_Partita_Storico_Agent")
+        Solo agrega filas: la base nueva ya viene sin historial (generate_lot_data).
+        """
+        cursor = self.conn.cursor()
 
         now = now_local()
 
@@ -461,7 +645,8 @@ class DemoDatabaseGenerator:
                 VALUES (?, ?, ?, ?, ?)
             """, (proceso, lote_num, inicio, fin, fecha_base))
 
-        self.conn.commit()
+        if commit:
+            self.conn.commit()
 
     def create_database(self):
         """Crear la base de datos completa con datos iniciales"""
@@ -486,26 +671,218 @@ class DemoDatabaseGenerator:
         self.generate_historic_data()
         print("[OK] Datos historicos generados")
 
+        production_rollups.backfill(self.conn, ahora=clock.now_local())
+        print("[OK] Rollups por hora y turno calculados")
+
+        lot_stats.backfill(self.conn)
+        print("[OK] Estadisticas de duracion de lotes calculadas")
+
         print("[SUCCESS] Base de datos demo creada exitosamente!")
         print(f"[PATH] Ubicacion: {self.db_path}")
 
-    def update_production_data(self, lote_actual=None, incrementar_progreso=True):
-        """Actualizar datos de producción para simular cambios en tiempo real"""
+    def generate_bulk_data(self, days=30, lineas=None, lotes_por_turno=10, seed=42,
+                           pesos_productores=None, pesos_variedades=None, lote_inicial=1000):
+        """
+        Generacion masiva (NumPy + executemany) para benchmarks a escala de produccion.
+
+        Escribe `days` dias hacia atras (turno dia 07:00-17:00 y noche 17:00-04:00,
+        sin turnos que aun no comienzan) con `lotes_por_turno` lotes por linea y turno.
+        Cada lote va a VW_LottiIngresso, PROD_Lotto y PROD_Unita_OUT; los lotes ya
+        iniciados tambien al historico. Productor y variedad se sortean con los pesos
+        dados (uniforme por defecto) y la semilla `seed`. El libro de produccion y sus
+        tablas derivadas (agregados, rollups, estadisticas de lotes) quedan vacios;
+        create_bulk_database los recalcula. Retorna filas por tabla.
+        """
+        lineas = list(lineas or [p["codigo"] for p in self.empresa_config["procesos"]])
+        lotes_por_turno = max(1, int(lotes_por_turno))
+        rng = np.random.default_rng(seed)
+        variedades = [v for p in self.empresa_config["productos"] for v in p["variedades"]]
+
+        def _probabilidades(pesos, n):
+            if not pesos:
+                return None
+            pesos = np.asarray(list(pesos)[:n] + [0.0] * max(0, n - len(pesos)), dtype=float)
+            return pesos / pesos.sum() if pesos.sum() > 0 else None
+
+        # Inicio y duracion de cada turno (hora local sin zona, igual que el resto del demo)
+        now = np.datetime64(now_local().replace(microsecond=0), "s")
+        hoy = now.astype("datetime64[D]")
+        fechas = hoy - np.arange(int(days))[::-1].astype("timedelta64[D]")
+        inicio_turnos = np.concatenate([
+            fechas.astype("datetime64[s]") + np.timedelta64(7, "h"),
+            fechas.astype("datetime64[s]") + np.timedelta64(17, "h"),
+        ])
+        duracion_turnos = np.concatenate([
+            np.full(len(fechas), 10 * 3600), np.full(len(fechas), 11 * 3600),
+        ])
+        orden = np.argsort(inicio_turnos, kind="stable")
+        inicio_turnos, duracion_turnos = inicio_turnos[orden], duracion_turnos[orden]
+        vigentes = inicio_turnos <= now
+        inicio_turnos, duracion_turnos = inicio_turnos[vigentes], duracion_turnos[vigentes]
+
+        # Una fila por (turno, lote, linea), en orden cronologico
+        n_turnos, n_lineas = len(inicio_turnos), len(lineas)
+        turno_idx = np.repeat(np.arange(n_turnos), lotes_por_turno * n_lineas)
+        lote_idx = np.tile(np.repeat(np.arange(lotes_por_turno), n_lineas), n_turnos)
+        linea_idx = np.tile(np.arange(n_lineas), n_turnos * lotes_por_turno)
+        n = len(turno_idx)
+
+        slot_s = duracion_turnos[turno_idx] // lotes_por_turno
+        desfase_linea_s = (linea_idx * 97) % np.maximum(slot_s // 4, 1)
+        inicio = inicio_turnos[turno_idx] + (lote_idx * slot_s + desfase_linea_s).astype("timedelta64[s]")
+        duracion_lote_s = (slot_s * rng.uniform(0.75, 0.98, n)).astype(np.int64)
+        fin = inicio + duracion_lote_s.astype("timedelta64[s]")
+
+        productor = rng.choice(len(self.proveedores), n, p=_probabilidades(pesos_productores, len(self.proveedores)))
+        variedad = rng.choice(len(variedades), n, p=_probabilidades(pesos_variedades, len(variedades)))
+        exportador = rng.integers(0, len(self.exportadores), n)
+        cajas = rng.integers(50, 200, n)
+        peso_g = np.round(cajas * rng.normal(63.0, 4.0, n) * 1000.0, 1)
+        iniciado = inicio <= now
+        unidades_in = np.where(iniciado, cajas, 0)
+
+        def _texto_fecha(valores):
+            return np.char.replace(np.datetime_as_string(valores, unit="s"), "T", " ").tolist()
+
+        lectura = _texto_fecha(inicio)
+        codigos = (np.arange(n) + int(lote_inicial)).astype(str).tolist()
+        cod_productor = [self.proveedores[i]["codigo"] for i in range(len(self.proveedores))]
+        nom_productor = [self.proveedores[i]["nombre"] for i in range(len(self.proveedores))]
+        nom_exportador = [e["nombre"] for e in self.exportadores]
+        id_exportador = [e["id"] for e in self.exportadores]
+        productor_l, variedad_l, exportador_l = productor.tolist(), variedad.tolist(), exportador.tolist()
+        linea_l = linea_idx.tolist()
+        cajas_l, unidades_in_l, peso_l = cajas.tolist(), unidades_in.tolist(), peso_g.tolist()
+
+        cursor = self.conn.cursor()
+        # Carga masiva: sin fsync y con journal en memoria; al terminar se restaura lo
+        # que tenia la conexion (WAL + NORMAL si se abrio con wal=True)
+        previos = {
+            pragma: cursor.execute(f"PRAGMA {pragma}").fetchone()[0]
+            for pragma in ("journal_mode", "synchronous", "temp_store", "cache_size")
+        }
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA journal_mode = MEMORY")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        cursor.execute("PRAGMA cache_size = -200000")
+        try:
+            cursor.execute("BEGIN")
+            for tabla in ("VW_LottiIngresso", "VW_MON_Partita_Corrente", "VW_MON_Partita_Storico_Agent",
+                          "PROD_Lotto", "PROD_Unita_OUT"):
+                cursor.execute(f"DELETE FROM {tabla}")
+            data_freshness.marcar_borrado(cursor, "VW_MON_Partita_Storico_Agent")
+            # Libro, agregados, rollups y estadisticas describian los datos anteriores
+            production_ledger.reiniciar(cursor)
+            # Los indices se arman una vez al final: mas rapido que mantenerlos fila a fila
+            for nombre, _, _ in db_maintenance.INDICES:
+                cursor.execute(f"DROP INDEX IF EXISTS {nombre}")
+
+            cursor.executemany(
+                """
+                INSERT INTO VW_LottiIngresso
+                (CodiceProduttore, CodiceProcesso, CodiceLotto, UnitaPianificate,
+                 UnitaIn, UnitaRestanti, Varieta, PesoNetto, DataLettura, ProductorNombre, EsportatoreDescrizione)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    (cod_productor[productor_l[i]], lineas[linea_l[i]], codigos[i], cajas_l[i],
+                     unidades_in_l[i], cajas_l[i] - unidades_in_l[i], variedades[variedad_l[i]], peso_l[i],
+                     lectura[i], nom_productor[productor_l[i]], nom_exportador[exportador_l[i]])
+                    for i in range(n)
+                ),
+            )
+            cursor.executemany(
+                "INSERT INTO PROD_Lotto (LOT_ID, LOT_Codice_Lotto, LOT_Data_Inizio) VALUES (?, ?, ?)",
+                ((i + 1, codigos[i], lectura[i]) for i in range(n)),
+            )
+            cursor.executemany(
+                """
+                INSERT INTO PROD_Unita_OUT (UOUT_ID, UOUT_Lotto_FK, UOUT_Esportatore_FK, UOUT_Data_Lettura)
+                VALUES (?, ?, ?, ?)
+                """,
+                ((i + 1, i + 1, id_exportador[exportador_l[i]], lectura[i]) for i in range(n)),
+            )
+            iniciados = np.flatnonzero(iniciado).tolist()
+            fin_txt = _texto_fecha(fin)
+            cursor.executemany(
+                """
+                INSERT INTO VW_MON_Partita_Storico_Agent
+                (ProcessoCodice, LottoCodice, LottoInizio, LottoFine, DataAcquisizione)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                ((lineas[linea_l[i]], codigos[i], lectura[i], fin_txt[i], fin_txt[i]) for i in iniciados),
+            )
+            db_maintenance.asegurar_indices(cursor)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            for pragma, valor in previos.items():
+                cursor.execute(f"PRAGMA {pragma} = {valor}")
+
+        return {
+            "VW_LottiIngresso": n,
+            "PROD_Lotto": n,
+            "PROD_Unita_OUT": n,
+            "VW_MON_Partita_Storico_Agent": len(iniciados),
+        }
+
+    def create_bulk_database(self, derivadas=True, **parametros):
+        """Crear la base demo con generacion masiva (ver generate_bulk_data)
+
+        Con `derivadas=False` no se reconstruyen rollups ni estadisticas de lotes (a escala
+        de produccion tardan mas que la carga); quedan vacias hasta correr sus --backfill.
+        """
+        print("[DB] Creando base de datos demo (masiva)...")
+        inicio = time.perf_counter()
+
+        self.create_connection()
+        self.create_tables()
+        self.populate_master_data()
+
+        filas = self.generate_bulk_data(**parametros)
+        print(f"[OK] Datos masivos generados: {filas}")
+
+        self.generate_current_production_data()
+        self.generate_turno_data()
+        if derivadas:
+            print(f"[OK] Rollups: {production_rollups.backfill(self.conn, ahora=clock.now_local())}")
+            print(f"[OK] Estadisticas de lotes: {lot_stats.backfill(self.conn)}")
+        else:
+            print("[INFO] Rollups y estadisticas sin calcular: production_rollups.py --backfill, lot_stats.py --backfill")
+
+        print(f"[SUCCESS] Base de datos demo creada en {time.perf_counter() - inicio:.1f}s")
+        print(f"[PATH] Ubicacion: {self.db_path}")
+        return filas
+
+    def update_production_data(self, lote_actual=None, incrementar_progreso=True, commit=True,
+                               proceso=None, cajas=None):
+        """Actualizar datos de producción para simular cambios en tiempo real
+
+        Con `proceso` avanza solo el lote en curso de esa linea; `cajas` reemplaza
+        el incremento fijo por ciclo. Retorna (unidades_vaciadas, unidades_planificadas)
+        del lote en curso, o None si la linea no tiene lote.
+        """
         cursor = self.conn.cursor()
 
         # Obtener lote actual
-        cursor.execute("""
+        filtro = "WHERE ProcessoCodice = ?" if proceso else ""
+        cursor.execute(f"""
             SELECT ProduttoreDescrizione, VarietaDescrizione, ProcessoCodice, LottoCodice,
                    UnitaPianificate, UnitaSvuotate, PesoNetto
             FROM VW_MON_Partita_Corrente
+            {filtro}
             ORDER BY DataAcquisizione DESC LIMIT 1
-        """)
+        """, (proceso,) if proceso else ())
         row = cursor.fetchone()
+        progreso = None
 
         if row:
             unidades_planificadas = row[4]
             unidades_actuales = row[5]
             peso_actual = row[6]
+            progreso = (unidades_actuales, unidades_planificadas)
             # Obtener peso total del lote desde VW_LottiIngresso para mantener rango realista
             try:
                 cursor.execute(
@@ -524,8 +901,9 @@ class DemoDatabaseGenerator:
 
             if incrementar_progreso and unidades_actuales < unidades_planificadas:
                 # Incrementar progreso (simular producción) - incremento mayor para pruebas más rápidas
-                incremento_cajas = DEMO_FIXED_CAJAS_STEP
+                incremento_cajas = cajas or DEMO_FIXED_CAJAS_STEP
                 nuevas_unidades = min(unidades_actuales + incremento_cajas, unidades_planificadas)
+                progreso = (nuevas_unidades, unidades_planificadas)
 
                 # Calcular peso por caja basado en el peso total del lote
                 if peso_total_lote and unidades_planificadas > 0:
@@ -534,48 +912,39 @@ class DemoDatabaseGenerator:
                     kg_por_caja = (peso_actual / 1000) / unidades_actuales  # kg por caja
                 else:
                     kg_por_caja = 1.2  # kg por caja promedio
-                
-                nuevo_peso = nuevas_unidades * kg_por_caja * 1000  # en gramos
-
-                # Actualizar datos actuales
-                cursor.execute("""
-                    UPDATE VW_MON_Partita_Corrente
-                    SET UnitaSvuotate = ?, PesoNetto = ?, DataAcquisizione = ?
-                    WHERE LottoCodice = ?
-                """, (nuevas_unidades, nuevo_peso, now_local(), row[3]))
-
-                # Tambien actualizar en VW_LottiIngresso (mantener exportador existente)
-                # Mantener el peso total del lote en el rango definido
-                if peso_total_lote is None and unidades_planificadas > 0:
-                    peso_total_lote = unidades_planificadas * kg_por_caja * 1000  # en gramos
-                cursor.execute("""
-                    UPDATE VW_LottiIngresso
-                    SET UnitaIn = ?, UnitaRestanti = ?, PesoNetto = ?
-                    WHERE CodiceLotto = ? AND CodiceProcesso = ?
-                """, (
-                    nuevas_unidades,
-                    unidades_planificadas - nuevas_unidades,
-                    peso_total_lote,
-                    row[3],
-                    row[2]
-                ))
+
+                # El avance queda en el libro de eventos; las vistas se proyectan del agregado
+                ahora = now_local()
+                production_ledger.asegurar_lote(
+                    cursor, row[2], row[3], ahora,
+                    cajas_iniciales=unidades_actuales, kg_iniciales=(peso_actual or 0) / 1000, fuente="simulador",
+                )
+                production_ledger.avanzar_lote(cursor, row[2], row[3], ahora, nuevas_unidades, kg_por_caja,
+                                               fuente="simulador")
+                production_ledger.proyectar_lote(cursor, row[2], row[3], ahora)
             else:
                 pass
 
-        self.conn.commit()
+        if commit:
+            self.conn.commit()
+        return progreso
 
-    def change_to_next_lote(self):
-        """Cambiar al siguiente lote para simular rotación de producción"""
+    def change_to_next_lote(self, commit=True, proceso=None):
+        """Cambiar al siguiente lote para simular rotación de producción
+
+        Con `proceso` solo se buscan lotes de esa linea y solo se reemplaza su fila actual.
+        """
         # Obtener un lote diferente al actual
         cursor = self.conn.cursor()
 
-        cursor.execute("""
+        filtro = "AND CodiceProcesso = ?" if proceso else ""
+        cursor.execute(f"""
             SELECT CodiceProduttore, CodiceProcesso, CodiceLotto, UnitaPianificate,
                    UnitaIn, Varieta, PesoNetto, ProductorNombre
             FROM VW_LottiIngresso
-            WHERE UnitaRestanti > 0
+            WHERE UnitaRestanti > 0 {filtro}
             ORDER BY DataLettura DESC LIMIT 1
-        """)
+        """, (proceso,) if proceso else ())
         row = cursor.fetchone()
 
         if row:
@@ -590,23 +959,119 @@ class DemoDatabaseGenerator:
                 "proveedor_nombre": row[7]
             }
 
-            self.generate_current_production_data(lote_nuevo)
+            self.generate_current_production_data(lote_nuevo, commit=commit, proceso=proceso)
             print(f"[CHANGE] Cambiado a lote: {lote_nuevo['codigo_lote']} - {lote_nuevo['proveedor_nombre']}")
             return lote_nuevo
 
         return None
 
+    def append_next_lote(self, proceso, commit=True):
+        """Ingresar un lote nuevo (codigo MAX+1) en la linea `proceso`, sin vaciar.
+
+        Productor, variedad y cajas se copian del ultimo lote de la linea. Retorna
+        el lote con el mismo formato que change_to_next_lote.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(CAST(CodiceLotto AS INTEGER)), 999) FROM VW_LottiIngresso")
+        codigo_lote = f"{int(cursor.fetchone()[0]) + 1:04d}"
+
+        cursor.execute("""
+            SELECT CodiceProduttore, UnitaPianificate, Varieta, PesoNetto, ProductorNombre
+            FROM VW_LottiIngresso
+            WHERE CodiceProcesso = ?
+            ORDER BY DataLettura DESC LIMIT 1
+        """, (proceso,))
+        row = cursor.fetchone() or (
+            "CSG001", DEMO_FIXED_CAJAS_TOTALES, "Gala Roja", DEMO_FIXED_KG_TOTALES * 1000, "Campo Verde Ltda."
+        )
+        exportador = self.exportadores[(int(codigo_lote) - 1000) % len(self.exportadores)]
+        fecha_lectura = now_local()
+
+        cursor.execute("""
+            INSERT INTO VW_LottiIngresso
+            (CodiceProduttore, CodiceProcesso, CodiceLotto, UnitaPianificate,
+             UnitaIn, UnitaRestanti, Varieta, PesoNetto, DataLettura, ProductorNombre, EsportatoreDescrizione)
+            VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?)
+        """, (row[0], proceso, codigo_lote, row[1], row[1], row[2], row[3], fecha_lectura, row[4], exportador["nombre"]))
+        cursor.execute("""
+            INSERT INTO PROD_Lotto (LOT_Codice_Lotto, LOT_Data_Inizio)
+            VALUES (?, ?)
+        """, (codigo_lote, fecha_lectura))
+        cursor.execute("""
+            INSERT INTO PROD_Unita_OUT (UOUT_Lotto_FK, UOUT_Esportatore_FK, UOUT_Data_Lettura)
+            VALUES (?, ?, ?)
+        """, (cursor.lastrowid, exportador["id"], fecha_lectura))
+
+        if commit:
+            self.conn.commit()
+        return {
+            "codigo_proveedor": row[0],
+            "codigo_proceso": proceso,
+            "codigo_lote": codigo_lote,
+            "unidades_planificadas": row[1],
+            "unidades_vaciadas": 0,
+            "variedad": row[2],
+            "peso_netto": row[3],
+            "proveedor_nombre": row[4],
+            "exportador_nombre": exportador["nombre"],
+        }
+
+    def stamp_data_version(self, fuente, commit=True):
+        """Sellar version y hora de escritura de los datos de produccion"""
+        data_freshness.sellar(self.conn.cursor(), fuente)
+        if commit:
+            self.conn.commit()
+
     def close_connection(self):
         """Cerrar conexión a la base de datos"""
         if self.conn:
             self.conn.close()
+            self.conn = None
 
 
 if __name__ == "__main__":
-    # Crear base de datos demo
-    generator = DemoDatabaseGenerator()
-    generator.create_database()
-    generator.close_connection()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generador de base de datos demo")
+    parser.add_argument("--db", default="demo_database.db", help="Ruta a la base de datos")
+    parser.add_argument("--bulk", action="store_true", help="Generacion masiva (NumPy + executemany)")
+    parser.add_argument("--days", type=int, default=30, help="Dias hacia atras (modo masivo)")
+    parser.add_argument("--lines", default="", help="Lineas separadas por coma (por defecto CAL001..EMP002)")
+    parser.add_argument("--lots-per-shift", type=int, default=10, help="Lotes por linea y turno (modo masivo)")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla (modo masivo)")
+    parser.add_argument("--producer-weights", default="", help="Pesos por productor, ej: 5,3,1,1,1")
+    parser.add_argument("--variety-weights", default="", help="Pesos por variedad (12 valores)")
+    parser.add_argument("--no-derived", action="store_true",
+                        help="Modo masivo: no reconstruir rollups ni estadisticas de lotes")
+    args = parser.parse_args()
+
+    def _pesos(texto):
+        return [float(x) for x in texto.split(",") if x.strip()] or None
+
+    generator = DemoDatabaseGenerator(args.db)
+
+    def _generar():
+        if args.bulk:
+            if os.path.exists(args.db):
+                os.remove(args.db)
+            generator.create_bulk_database(
+                derivadas=not args.no_derived,
+                days=args.days,
+                lineas=[l.strip() for l in args.lines.split(",") if l.strip()] or None,
+                lotes_por_turno=args.lots_per_shift,
+                seed=args.seed,
+                pesos_productores=_pesos(args.producer_weights),
+                pesos_variedades=_pesos(args.variety_weights),
+            )
+        else:
+            # Crear base de datos demo
+            generator.create_database()
+
+    # Mismo lock que el dashboard: no regenerar mientras otro proceso lo hace
+    try:
+        regen_coordinator.para_base(args.db).ejecutar("bulk_database" if args.bulk else "create_database", _generar)
+    finally:
+        generator.close_connection()
 
     print("\n[INFO] Para usar la base de datos demo:")
     print("   2. Actualiza las consultas SQL si es necesario")
@@ -4,8 +4,60 @@ Ejecuta cambios automáticos en la base de datos para simular producción
 """
 import time
 import random
+import sqlite3
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from demo_db_generator import DemoDatabaseGenerator
+from metrics import SIMULATOR_TICK_SECONDS
+import clock
+
+LINEAS_DEMO = ["CAL001", "CAL002", "CAL003", "EMP001", "EMP002"]
+
+
+def _resumen_ms(valores):
+    """p50/p95/p99/max (ms) de una lista de latencias en segundos"""
+    ordenados = sorted(valores)
+    if not ordenados:
+        return {}
+
+    def p(q):
+        return round(ordenados[min(len(ordenados) - 1, int(round(q / 100.0 * (len(ordenados) - 1))))] * 1000.0, 2)
+
+    return {"p50_ms": p(50), "p95_ms": p(95), "p99_ms": p(99), "max_ms": round(ordenados[-1] * 1000.0, 2)}
+
+
+def _simular_linea(db_path, proceso, intervalo_s, cajas_por_ciclo, detener):
+    """Worker de una linea (proceso aparte): avanza su lote en curso cada `intervalo_s`
+    segundos de reloj, en una transaccion corta por ciclo. Retorna estadisticas de escritura."""
+    generator = DemoDatabaseGenerator(db_path)
+    generator.create_connection(wal=True)
+    ciclos = errores = bloqueos = 0
+    latencias = []
+    try:
+        while not detener.is_set():
+            inicio = time.perf_counter()
+            try:
+                with generator.transaction():
+                    generator.update_production_data(commit=False, proceso=proceso, cajas=cajas_por_ciclo)
+                    generator.stamp_data_version(f"linea_{proceso}", commit=False)
+                ciclos += 1
+            except sqlite3.OperationalError as e:
+                errores += 1
+                if "locked" in str(e):
+                    bloqueos += 1
+            except Exception:
+                errores += 1
+            latencias.append(time.perf_counter() - inicio)
+            SIMULATOR_TICK_SECONDS.observe(latencias[-1], source=f"linea_{proceso}")
+            detener.wait(max(0.0, intervalo_s / clock.factor() - (time.perf_counter() - inicio)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        generator.close_connection()
+    return {"proceso": proceso, "ciclos": ciclos, "errores": errores, "bloqueos": bloqueos,
+            "escritura": _resumen_ms(latencias)}
+
 
 class ProductionSimulator:
     def __init__(self, db_path="demo_database.db", update_interval=30):
@@ -32,7 +84,8 @@ class ProductionSimulator:
         try:
             while self.is_running:
                 self._update_cycle()
-                time.sleep(self.update_interval)
+                # Segundos de reloj: con reloj acelerado el ciclo real es mas corto
+                clock.sleep(self.update_interval)
 
         except KeyboardInterrupt:
             print("\n[STOP] Simulacion detenida por usuario")
@@ -41,6 +94,12 @@ class ProductionSimulator:
         finally:
             self.generator.close_connection()
 
+    def _conexion(self):
+        """Conexion persistente (WAL) reutilizada entre ciclos"""
+        if self.generator.conn is None:
+            self.generator.create_connection(wal=True)
+        return self.generator.conn
+
     def stop_simulation(self):
         """Detener simulación"""
         self.is_running = False
@@ -48,42 +107,46 @@ class ProductionSimulator:
 
     def _update_cycle(self):
         """Ciclo de actualización de datos"""
+        inicio = time.perf_counter()
         try:
-            # Conectar a la base de datos
-            self.generator.create_connection()
-
-            # Actualizar datos de producción actual
-            self.generator.update_production_data()
-
-            # Actualizar datos del turno
+            self._conexion()
             turno_actual = self._get_current_turn()
-            self.generator.generate_turno_data(turno_actual)
 
-            # Verificar si es momento de cambiar de lote
+            # Decisiones aleatorias fuera de la transaccion: el lock de escritura
+            # solo se toma para aplicar los cambios
             self.cambio_lote_timer += self.update_interval
+            cambiar_lote = False
             if self.cambio_lote_timer >= self.max_cambio_lote_interval:
                 # Probabilidad de cambiar lote (30%)
                 if random.random() < 0.3:
-                    self.generator.change_to_next_lote()
+                    cambiar_lote = True
                     self.cambio_lote_timer = 0
                 else:
                     # Reset timer con variación
                     self.cambio_lote_timer = random.randint(60, self.max_cambio_lote_interval)
+            # El historial no se toca: lo agrega el cambio de turno (append_shift_data)
 
-            # Actualizar datos históricos (menos frecuente)
-            if random.random() < 0.1:  # 10% de probabilidad
-                self.generator.generate_historic_data(10)
+            # Una sola transacción por ciclo
+            with self.generator.transaction():
+                self.generator.update_production_data(commit=False)
+                self.generator.generate_turno_data(turno_actual, commit=False)
+                if cambiar_lote:
+                    self.generator.change_to_next_lote(commit=False)
+                self.generator.stamp_data_version("production_simulator", commit=False)
 
-            print(f"[OK] Datos actualizados - Turno {turno_actual} - {datetime.now().strftime('%H:%M:%S')}")
+            print(f"[OK] Datos actualizados - Turno {turno_actual} - {clock.now_local().strftime('%H:%M:%S')}")
 
         except Exception as e:
             print(f"❌ Error en ciclo de actualización: {e}")
+            if not (isinstance(e, sqlite3.OperationalError) and "locked" in str(e)):
+                # Conexion posiblemente invalida (base recreada, archivo movido): reabrir en el proximo ciclo
+                self.generator.close_connection()
         finally:
-            self.generator.close_connection()
+            SIMULATOR_TICK_SECONDS.observe(time.perf_counter() - inicio, source="production_simulator")
 
     def _get_current_turn(self):
         """Determinar el turno actual basado en la hora"""
-        now = datetime.now()
+        now = clock.now_local()
         current_time = now.time()
 
         # Turno 1: 08:00 - 20:00
@@ -100,10 +163,12 @@ class ProductionSimulator:
         """Ejecutar una sola actualización para testing"""
         print("[UPDATE] Ejecutando actualizacion unica...")
         try:
-            self.generator.create_connection()
-            self.generator.update_production_data()
+            self._conexion()
             turno = self._get_current_turn()
-            self.generator.generate_turno_data(turno)
+            with self.generator.transaction():
+                self.generator.update_production_data(commit=False)
+                self.generator.generate_turno_data(turno, commit=False)
+                self.generator.stamp_data_version("production_simulator", commit=False)
             print("[OK] Actualizacion completada")
         except Exception as e:
             print(f"❌ Error: {e}")
@@ -116,32 +181,135 @@ class ProductionSimulator:
 
         for i in range(num_updates):
             try:
-                self.generator.create_connection()
-                # Actualización más agresiva para simular producción intensa
-                self.generator.update_production_data(incrementar_progreso=True)
-
-                # Aumentar datos del turno significativamente
+                self._conexion()
                 turno = self._get_current_turn()
-                self.generator.generate_turno_data(turno)
+                with self.generator.transaction():
+                    # Actualización más agresiva para simular producción intensa
+                    self.generator.update_production_data(incrementar_progreso=True, commit=False)
+
+                    # Aumentar datos del turno significativamente
+                    self.generator.generate_turno_data(turno, commit=False)
+                    self.generator.stamp_data_version("production_simulator", commit=False)
 
-                print(f"[BURST] Burst {i+1}/{num_updates} - {datetime.now().strftime('%H:%M:%S')}")
+                print(f"[BURST] Burst {i+1}/{num_updates} - {clock.now_local().strftime('%H:%M:%S')}")
 
             except Exception as e:
                 print(f"❌ Error en burst {i+1}: {e}")
-            finally:
                 self.generator.close_connection()
 
             if i < num_updates - 1:  # No esperar en la última iteración
-                time.sleep(interval)
+                clock.sleep(interval)
+
+        self.generator.close_connection()
 
         print("[SUCCESS] Burst de produccion completado")
 
+    def simulate_multiline(self, lineas=None, intervalo_linea=2.0, cajas_por_ciclo=1, duracion_s=0):
+        """Simular varias lineas a la vez: un worker por linea en un ProcessPoolExecutor.
+
+        Cada worker escribe el avance de su lote cada `intervalo_linea` segundos. Este
+        proceso coordina la rotacion: cuando el lote de una linea termina la cambia al
+        siguiente pendiente (change_to_next_lote) o ingresa uno nuevo. Ademas mide la
+        latencia de una lectura tipo dashboard para ver la contencion.
+        `duracion_s=0` corre hasta Ctrl+C.
+        """
+        lineas = list(lineas or LINEAS_DEMO)
+        clock.get_clock()  # fijar el ancla del reloj antes de crear los workers
+        print(f"[MULTI] Simulando {len(lineas)} lineas ({', '.join(lineas)}) cada {intervalo_linea}s")
+
+        self._conexion()
+        rotaciones = 0
+        with self.generator.transaction():
+            for proceso in lineas:
+                rotaciones += self._rotar_linea(proceso, forzar=False)
+
+        lecturas = []
+        resultados = []
+        manager = multiprocessing.Manager()
+        detener = manager.Event()
+        fin = time.monotonic() + duracion_s if duracion_s else None
+        try:
+            with ProcessPoolExecutor(max_workers=len(lineas)) as pool:
+                futuros = [
+                    pool.submit(_simular_linea, self.db_path, proceso, intervalo_linea, cajas_por_ciclo, detener)
+                    for proceso in lineas
+                ]
+                try:
+                    while fin is None or time.monotonic() < fin:
+                        clock.sleep(intervalo_linea)
+                        lecturas.append(self._medir_lectura())
+                        try:
+                            with self.generator.transaction():
+                                for proceso in lineas:
+                                    rotaciones += self._rotar_linea(proceso)
+                        except sqlite3.OperationalError as e:
+                            print(f"[WARN] Rotacion pospuesta: {e}")
+                except KeyboardInterrupt:
+                    print("\n[STOP] Deteniendo lineas...")
+                finally:
+                    detener.set()
+                    resultados = [f.result() for f in futuros]
+        finally:
+            manager.shutdown()
+            self.generator.close_connection()
+
+        resumen = {
+            "lineas": resultados,
+            "rotaciones": rotaciones,
+            "lectura_dashboard": _resumen_ms([l for l in lecturas if l is not None]),
+            "lecturas_fallidas": sum(1 for l in lecturas if l is None),
+        }
+        for r in resultados:
+            print(f"[MULTI] {r['proceso']}: {r['ciclos']} ciclos, {r['errores']} errores "
+                  f"({r['bloqueos']} bloqueos), escritura {r['escritura']}")
+        print(f"[MULTI] Rotaciones: {rotaciones} - Lectura dashboard: {resumen['lectura_dashboard']} "
+              f"({resumen['lecturas_fallidas']} fallidas)")
+        return resumen
+
+    def _rotar_linea(self, proceso, forzar=False):
+        """Cambiar de lote la linea si el actual termino (o no tiene). Retorna 1 si roto."""
+        cursor = self.generator.conn.cursor()
+        cursor.execute(
+            "SELECT UnitaSvuotate, UnitaPianificate FROM VW_MON_Partita_Corrente WHERE ProcessoCodice = ?",
+            (proceso,),
+        )
+        row = cursor.fetchone()
+        if row and not forzar and row[0] < row[1]:
+            return 0
+        lote = self.generator.change_to_next_lote(commit=False, proceso=proceso)
+        if lote is None:
+            lote = self.generator.append_next_lote(proceso, commit=False)
+            self.generator.generate_current_production_data(lote, commit=False, proceso=proceso)
+        return 1
+
+    def _medir_lectura(self):
+        """Latencia (s) de la lectura del lote en curso que hace el dashboard; None si falla"""
+        inicio = time.perf_counter()
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            try:
+                conn.execute("""
+                    SELECT c.ProcessoCodice, c.LottoCodice, c.UnitaSvuotate, l.PesoNetto
+                    FROM VW_MON_Partita_Corrente c
+                    LEFT JOIN VW_LottiIngresso l
+                      ON l.CodiceLotto = c.LottoCodice AND l.CodiceProcesso = c.ProcessoCodice
+                    ORDER BY c.DataAcquisizione DESC
+                """).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+        return time.perf_counter() - inicio
+
     def force_lote_change(self):
         """Forzar cambio inmediato de lote"""
         print("[CHANGE] Forzando cambio de lote...")
         try:
-            self.generator.create_connection()
-            lote_nuevo = self.generator.change_to_next_lote()
+            self._conexion()
+            with self.generator.transaction():
+                lote_nuevo = self.generator.change_to_next_lote(commit=False)
+                if lote_nuevo:
+                    self.generator.stamp_data_version("production_simulator", commit=False)
             if lote_nuevo:
                 print(f"[OK] Lote cambiado a: {lote_nuevo['codigo_lote']}")
             else:
@@ -158,8 +326,16 @@ def main():
     parser = argparse.ArgumentParser(description="Simulador de Producción Demo")
     parser.add_argument("--db", default="demo_database.db", help="Ruta a la base de datos")
     parser.add_argument("--interval", type=int, default=30, help="Intervalo de actualización (segundos)")
-    parser.add_argument("--mode", choices=["continuous", "single", "burst", "change"], default="continuous",
-                       help="Modo de ejecución")
+    parser.add_argument("--mode", choices=["continuous", "single", "burst", "change", "multiline"],
+                       default="continuous", help="Modo de ejecución")
+    parser.add_argument("--lines", default=",".join(LINEAS_DEMO),
+                       help="Lineas para --mode multiline (separadas por coma)")
+    parser.add_argument("--line-interval", type=float, default=2.0,
+                       help="Segundos entre escrituras de cada linea (--mode multiline)")
+    parser.add_argument("--boxes-per-cycle", type=int, default=1,
+                       help="Cajas que avanza cada linea por ciclo (--mode multiline)")
+    parser.add_argument("--duration", type=float, default=0,
+                       help="Duracion en segundos de --mode multiline (0 = hasta Ctrl+C)")
 
     args = parser.parse_args()
 
@@ -173,6 +349,9 @@ def main():
         simulator.simulate_production_burst()
     elif args.mode == "change":
         simulator.force_lote_change()
+    elif args.mode == "multiline":
+        lineas = [l.strip() for l in args.lines.split(",") if l.strip()]
+        simulator.simulate_multiline(lineas, args.line_interval, args.boxes_per_cycle, args.duration)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
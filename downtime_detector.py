@@ -0,0 +1,215 @@
+"""
+Detector de detenciones en linea a partir de los contadores del turno.
+
+Cada tick del panel entrega (ts, FermoMacchinaMinuti, UnitaSvuotate) del turno en
+curso. Entre dos ticks:
+- si el contador de detencion subio, la linea estuvo detenida (origen "contador");
+- si no subio pero tampoco entran cajas durante PANEL_DOWNTIME_MIN_S, se considera
+  detenida desde la ultima caja (origen "cajas"; sirve cuando el contador no se usa).
+La detencion termina cuando vuelven a entrar cajas sin que suba el contador.
+
+observar() retorna los eventos discretos ("stop" al detectar la parada, "start" al
+reanudar, con la duracion) para que el caller los guarde (PROD_Fermate y evento
+"downtime" del libro). La linea de tiempo del turno queda en memoria; si el proceso
+se reinicia a mitad de turno se recarga una vez desde PROD_Fermate (cargar_turno).
+"""
+import datetime
+import sqlite3
+import threading
+
+import production_ledger
+from config_demo import env_float
+
+
+DOWNTIME_MIN_S = env_float("PANEL_DOWNTIME_MIN_S", 180)      # segundos sin cajas para declarar parada
+DOWNTIME_MAX_GAP_S = env_float("PANEL_DOWNTIME_MAX_GAP_S", 600)  # hueco entre ticks que se ignora (sin vista)
+
+TABLA = "PROD_Fermate"
+_SQL_CREAR = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLA} (
+        Proceso TEXT NOT NULL,
+        Inicio TEXT NOT NULL,
+        Fin TEXT,
+        Minutos REAL,
+        Origen TEXT NOT NULL,
+        Turno TEXT NOT NULL,
+        Lotto TEXT,
+        PRIMARY KEY (Proceso, Inicio)
+    ) WITHOUT ROWID
+    """,
+    f"CREATE INDEX IF NOT EXISTS IX_Fermate_Turno ON {TABLA} (Turno, Inicio)",
+]
+
+
+def crear_tablas(cur):
+    for sql in _SQL_CREAR:
+        cur.execute(sql)
+
+
+def _minutos(parada, fin):
+    """Minutos de la detencion: los del contador si lo hay, si no el tiempo sin cajas."""
+    if parada["origen"] == "contador":
+        return round(parada["fermo_min"], 2)
+    return round(max(0.0, (fin - parada["inicio"]).total_seconds()) / 60.0, 2)
+
+
+class DowntimeDetector:
+    def __init__(self, umbral_s=DOWNTIME_MIN_S, max_hueco_s=DOWNTIME_MAX_GAP_S):
+        self.umbral_s = float(umbral_s)
+        self.max_hueco_s = float(max_hueco_s)
+        self._lock = threading.Lock()
+        self.turno = None
+        self._ultimo = None          # (ts, fermo_min, cajas)
+        self._ultima_caja = None     # ts de la ultima caja vista
+        self._parada = None          # {"inicio", "origen", "fermo_min", "turno", "proceso", "lote"}
+        self._timeline = []          # detenciones cerradas del turno
+        self._cargado = False
+
+    def _cerrar(self, fin):
+        parada, self._parada = self._parada, None
+        if parada is None:
+            return []
+        cerrada = {
+            "inicio": parada["inicio"], "fin": fin, "minutos": _minutos(parada, fin), "origen": parada["origen"],
+            "turno": parada["turno"], "proceso": parada["proceso"], "lote": parada["lote"],
+        }
+        self._timeline.append(cerrada)
+        return [("start", cerrada)]
+
+    def _base(self, ts, fermo, cajas):
+        self._ultimo = (ts, fermo, cajas)
+        self._ultima_caja = ts
+
+    def observar(self, ts, fermo_min, cajas, turno, activo=True, proceso=None, lote=None):
+        """Procesa una muestra; retorna [(tipo, detencion)] con tipo "stop" o "start".
+
+        `proceso` y `lote` (lo que corre en la linea) quedan en la detencion al abrirla.
+        """
+        fermo = float(fermo_min or 0.0)
+        cajas = int(cajas or 0)
+        with self._lock:
+            if turno != self.turno:
+                eventos = self._cerrar(self._ultimo[0]) if self._ultimo else []
+                self.turno = turno
+                self._timeline = []
+                self._cargado = False
+                self._base(ts, fermo, cajas)
+                return eventos
+            if self._ultimo is None:
+                self._base(ts, fermo, cajas)
+                return []
+
+            ts_prev, fermo_prev, cajas_prev = self._ultimo
+            hueco = (ts - ts_prev).total_seconds()
+            if hueco <= 0:
+                return []
+            d_fermo = fermo - fermo_prev
+            d_cajas = cajas - cajas_prev
+            if hueco > self.max_hueco_s or d_fermo < 0 or d_cajas < 0 or not activo:
+                # Sin vista continua, contador reiniciado o fuera de turno: no se infiere nada del intervalo
+                eventos = self._cerrar(ts_prev)
+                self._base(ts, fermo, cajas)
+                return eventos
+
+            eventos = []
+            if self._parada is None:
+                if d_fermo > 0:
+                    inicio = max(ts_prev, ts - datetime.timedelta(minutes=d_fermo))
+                    self._parada = {"inicio": inicio, "origen": "contador", "fermo_min": d_fermo}
+                elif d_cajas == 0 and (ts - self._ultima_caja).total_seconds() >= self.umbral_s:
+                    self._parada = {"inicio": self._ultima_caja, "origen": "cajas", "fermo_min": 0.0}
+                if self._parada is not None:
+                    self._parada.update(turno=turno, proceso=proceso, lote=lote)
+                    eventos.append(("stop", dict(self._parada)))
+            elif d_fermo > 0:
+                self._parada["fermo_min"] += d_fermo
+            elif d_cajas > 0:
+                # Reanudo en algun momento del intervalo: la ultima vista detenida es ts_prev
+                eventos.extend(self._cerrar(ts_prev))
+
+            if d_cajas > 0:
+                self._ultima_caja = ts
+            self._ultimo = (ts, fermo, cajas)
+            return eventos
+
+    @property
+    def necesita_carga(self):
+        return self.turno is not None and not self._cargado
+
+    def cargar_turno(self, conn):
+        """Recupera una sola vez las detenciones ya guardadas del turno (reinicio a mitad de turno)."""
+        with self._lock:
+            if self._cargado or self.turno is None:
+                return
+            self._cargado = True
+            turno = self.turno
+        try:
+            filas = conn.execute(
+                f"SELECT Inicio, Fin, Minutos, Origen, Proceso, Lotto FROM {TABLA} "
+                "WHERE Turno = ? AND Fin IS NOT NULL ORDER BY Inicio",
+                (turno,),
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return
+        previas = [
+            {
+                "inicio": datetime.datetime.fromisoformat(f[0]), "fin": datetime.datetime.fromisoformat(f[1]),
+                "minutos": float(f[2] or 0.0), "origen": f[3], "turno": turno, "proceso": f[4], "lote": f[5],
+            }
+            for f in filas
+        ]
+        with self._lock:
+            if self.turno == turno:
+                conocidas = {d["inicio"] for d in self._timeline}
+                self._timeline = [d for d in previas if d["inicio"] not in conocidas] + self._timeline
+
+    def estado(self, ahora):
+        """{"turno", "parada_actual", "timeline", "total_min"} con la parada en curso hasta `ahora`."""
+        with self._lock:
+            timeline = list(self._timeline)
+            parada = dict(self._parada) if self._parada else None
+            turno = self.turno
+        actual = None
+        total = sum(d["minutos"] for d in timeline)
+        if parada:
+            minutos = max(parada.get("fermo_min") or 0.0, (ahora - parada["inicio"]).total_seconds() / 60.0)
+            actual = {"inicio": parada["inicio"], "minutos": round(minutos, 2), "origen": parada["origen"]}
+            total += minutos
+        return {"turno": turno, "parada_actual": actual, "timeline": timeline, "total_min": round(total, 2)}
+
+
+def guardar_eventos(cur, eventos):
+    """Guarda los eventos de observar(): "stop" abre la fila, "start" la cierra y va al libro.
+
+    Las detenciones sin proceso (no habia lote en la linea) solo quedan en la linea de
+    tiempo en memoria: PROD_Fermate y el libro se agregan por proceso.
+    """
+    eventos = [(tipo, d) for tipo, d in eventos if d.get("proceso") is not None]
+    if eventos:
+        crear_tablas(cur)
+    for tipo, detencion in eventos:
+        proceso = str(detencion["proceso"])
+        inicio = detencion["inicio"].isoformat(sep=" ")
+        if tipo == "stop":
+            cur.execute(
+                f"INSERT OR IGNORE INTO {TABLA} (Proceso, Inicio, Origen, Turno, Lotto) VALUES (?, ?, ?, ?, ?)",
+                (proceso, inicio, detencion["origen"], detencion["turno"], detencion["lote"]),
+            )
+            continue
+        cur.execute(
+            f"""
+            INSERT INTO {TABLA} (Proceso, Inicio, Fin, Minutos, Origen, Turno, Lotto)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(Proceso, Inicio) DO UPDATE SET Fin = excluded.Fin, Minutos = excluded.Minutos
+            """,
+            (proceso, inicio, detencion["fin"].isoformat(sep=" "), detencion["minutos"],
+             detencion["origen"], detencion["turno"], detencion["lote"]),
+        )
+        production_ledger.registrar(
+            cur, "downtime", proceso, lote=detencion["lote"], ts=detencion["fin"],
+            minutos=detencion["minutos"], fuente=f"detector_{detencion['origen']}",
+        )
+
+
+DETECTOR = DowntimeDetector()
@@ -0,0 +1,139 @@
+"""
+ETA de fin de lote por ritmo real de vaciado (con respaldo en el horario del turno).
+
+Por lote se guarda una ventana movil de muestras (ts, UnitaSvuotate). Cada muestra
+nueva es O(1): se agrega al final, se descartan las viejas por el inicio y la tasa
+de la ventana es (u_ultima - u_primera) / (t_ultima - t_primera). Esa tasa alimenta
+una EWMA con constante de tiempo PANEL_ETA_TAU_S (alpha = 1 - exp(-dt / tau)) y una
+varianza exponencial del mismo alpha para la banda de confianza.
+
+La prediccion es ahora + UnitaRestanti / tasa; la banda usa tasa +/- Z * desviacion.
+Sin muestras suficientes (pocas, ventana corta o tasa nula) predecir() retorna None
+y el panel usa el horario (_get_current_lot_schedule).
+"""
+import collections
+import datetime
+import math
+import threading
+
+from config_demo import env_float
+
+
+ETA_WINDOW_S = env_float("PANEL_ETA_WINDOW_S", 900)    # ventana movil de muestras
+ETA_TAU_S = env_float("PANEL_ETA_TAU_S", 300)          # constante de tiempo de la EWMA
+ETA_MIN_SAMPLES = int(env_float("PANEL_ETA_MIN_SAMPLES", 3))
+ETA_MIN_SPAN_S = env_float("PANEL_ETA_MIN_SPAN_S", 60)
+ETA_Z = env_float("PANEL_ETA_Z", 1.64)                 # ~90% si el ritmo fuera normal
+_MAX_MUESTRAS = 720
+_MAX_LOTES = 32
+
+
+class LotRateEstimator:
+    """Tasa de vaciado (cajas/s) de un lote sobre una ventana movil de muestras."""
+
+    __slots__ = ("ventana_s", "tau_s", "muestras", "ewma", "varianza", "_ultimo_ts")
+
+    def __init__(self, ventana_s=ETA_WINDOW_S, tau_s=ETA_TAU_S):
+        self.ventana_s = float(ventana_s)
+        self.tau_s = float(tau_s)
+        self.muestras = collections.deque(maxlen=_MAX_MUESTRAS)
+        self.ewma = None
+        self.varianza = 0.0
+        self._ultimo_ts = None
+
+    def agregar(self, ts, unidades):
+        """Agrega (ts en segundos, cajas vaciadas acumuladas)."""
+        ts = float(ts)
+        unidades = float(unidades)
+        if self.muestras and (unidades < self.muestras[-1][1] or ts < self.muestras[-1][0]):
+            # El contador retrocedio (lote reiniciado o reloj ajustado): empezar de nuevo
+            self.muestras.clear()
+            self.ewma = None
+            self.varianza = 0.0
+            self._ultimo_ts = None
+        if self.muestras and ts == self.muestras[-1][0]:
+            self.muestras[-1] = (ts, unidades)
+        else:
+            self.muestras.append((ts, unidades))
+        while len(self.muestras) > 2 and ts - self.muestras[1][0] >= self.ventana_s:
+            self.muestras.popleft()
+
+        t0, u0 = self.muestras[0]
+        if ts - t0 <= 0:
+            return
+        tasa = (unidades - u0) / (ts - t0)
+        if self.ewma is None:
+            self.ewma = tasa
+        else:
+            alpha = 1.0 - math.exp(-max(0.0, ts - self._ultimo_ts) / self.tau_s)
+            desvio = tasa - self.ewma
+            self.ewma += alpha * desvio
+            self.varianza = (1.0 - alpha) * (self.varianza + alpha * desvio * desvio)
+        self._ultimo_ts = ts
+
+    def listo(self):
+        return (
+            self.ewma is not None
+            and self.ewma > 0
+            and len(self.muestras) >= ETA_MIN_SAMPLES
+            and self.muestras[-1][0] - self.muestras[0][0] >= ETA_MIN_SPAN_S
+        )
+
+    def predecir(self, restantes, ahora):
+        """{"fin", "fin_min", "fin_max", "tasa_cpm", ...} o None si no hay datos suficientes."""
+        if not self.listo():
+            return None
+        restantes = max(0.0, float(restantes))
+        desviacion = math.sqrt(max(0.0, self.varianza))
+        rapida = self.ewma + ETA_Z * desviacion
+        lenta = self.ewma - ETA_Z * desviacion
+        fin = ahora + datetime.timedelta(seconds=restantes / self.ewma)
+        return {
+            "fin": fin,
+            "fin_min": ahora + datetime.timedelta(seconds=restantes / rapida),
+            # Con una banda que llega a tasa <= 0 no hay cota superior
+            "fin_max": ahora + datetime.timedelta(seconds=restantes / lenta) if lenta > 0 else None,
+            "tasa_cpm": round(self.ewma * 60.0, 2),
+            "desviacion_cpm": round(desviacion * 60.0, 2),
+            "muestras": len(self.muestras),
+        }
+
+
+class EtaPredictor:
+    """Estimadores por (proceso, lote), los _MAX_LOTES mas recientes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lotes = collections.OrderedDict()
+
+    def observar(self, proceso, lote, ts, unidades):
+        clave = (str(proceso), str(lote))
+        with self._lock:
+            estimador = self._lotes.get(clave)
+            if estimador is None:
+                estimador = self._lotes[clave] = LotRateEstimator()
+                while len(self._lotes) > _MAX_LOTES:
+                    self._lotes.popitem(last=False)
+            else:
+                self._lotes.move_to_end(clave)
+            estimador.agregar(ts, unidades)
+            return estimador
+
+    def predecir(self, proceso, lote, restantes, ahora):
+        with self._lock:
+            estimador = self._lotes.get((str(proceso), str(lote)))
+            return estimador.predecir(restantes, ahora) if estimador else None
+
+    def estado(self):
+        with self._lock:
+            return {
+                f"{p}|{l}": {
+                    "muestras": len(e.muestras),
+                    "tasa_cpm": round(e.ewma * 60.0, 2) if e.ewma is not None else None,
+                    "listo": e.listo(),
+                }
+                for (p, l), e in self._lotes.items()
+            }
+
+
+PREDICTOR = EtaPredictor()
@@ -6,11 +6,18 @@ import logging
 import importlib
 import datetime
 import os
+import threading
+import time
 from zoneinfo import ZoneInfo
 
 logger = logging.getLogger(__name__)
 import plotly.graph_objects as go
 
+import data_freshness
+from db_instrumentation import contexto_read_sql, nombre_llamador, registrar_consulta
+from profiler import perfilar
+import clock
+
 # Importar configuración para determinar qué módulo de BD usar
 from config_demo import get_database_config
 config_db = get_database_config()
@@ -88,12 +95,8 @@ def _to_local_naive_series(series):
 
 
 def get_local_now():
-    try:
-        if _LOCAL_TZ is not None:
-            return datetime.datetime.now(_LOCAL_TZ).replace(tzinfo=None)
-    except Exception:
-        pass
-    return datetime.datetime.now()
+    # Hora de planta (real o virtual acelerada, ver clock.py)
+    return clock.now_local(_LOCAL_TZ_NAME)
 
 def adapt_sql_query(query):
     """
@@ -133,7 +136,17 @@ def read_sql_adapted(query, conn, **kwargs):
     Wrapper para pd.read_sql que adapta consultas a SQLite (demo)
     """
     adapted_query = adapt_sql_query(query)
-    return pd.read_sql(adapted_query, conn, **kwargs)
+    fn = nombre_llamador()
+    params = kwargs.get("params")
+    inicio = time.perf_counter()
+    try:
+        with contexto_read_sql():
+            df = pd.read_sql(adapted_query, conn, **kwargs)
+    except Exception as e:
+        registrar_consulta(adapted_query, params, time.perf_counter() - inicio, None, fn, "read_sql", conn, e)
+        raise
+    registrar_consulta(adapted_query, params, time.perf_counter() - inicio, len(df), fn, "read_sql", conn)
+    return df
 
 def get_data():
     """Obtiene los últimos 50 registros de VW_MON_Partita_Corrente"""
@@ -147,6 +160,7 @@ def get_data():
         logger.exception("Error en get_data: %s", e)
         return None
 
+@perfilar()
 def get_produttore_dict():
     """
     Obtiene un diccionario que relaciona el código del productor con su nombre real desde ANA_Produttore.
@@ -214,6 +228,7 @@ def get_produttore_dict():
         # st.error(f"Error al obtener ANA_Produttore: {e}")
         return {}
 
+@perfilar()
 def get_detalle_lotti_ingresso():
     """Obtiene los datos de VW_LottiIngresso para la tabla de detalle por proceso y lote
     La tabla se reinicia al cambiar de turno y puede mostrar uno o más lotes"""
@@ -381,6 +396,7 @@ def get_detalle_lotti_ingresso():
         logger.exception("Error al obtener datos de VW_LottiIngresso: %s", e)
         return None
 
+@perfilar()
 def get_current_record():
     """Obtiene el registro más reciente para los filtros y datos del lote"""
     try:
@@ -430,6 +446,7 @@ def get_current_record():
     except Exception as e:
         return None
 
+@perfilar()
 def get_current_lote_from_detalle():
     """Obtiene los datos del lote actual desde VW_LottiIngresso (el más reciente)
     Retorna un diccionario con los datos más precisos para el análisis gráfico"""
@@ -606,6 +623,7 @@ def get_cajas_por_turno():
         return 0
 
 
+@perfilar()
 def get_cajas_por_hora_turno():
     """Obtiene las cajas por hora del turno desde VW_MON_Produttivita_Turno_Corrente."""
     try:
@@ -645,55 +663,129 @@ def get_fermo_macchina_minuti():
         return 0.0
 
 
+def _firma_storico(conn):
+    """(ultimo rowid, version de borrados, hora del ultimo borrado) del historial.
+
+    El historial solo crece: MAX(rowid) cambia con cada registro nuevo y es una busqueda
+    al final del arbol. Quien borra registros (poda, regeneracion) sube la version en
+    data_freshness. Ninguna de las dos recorre la tabla.
+    """
+    df = read_sql_adapted("SELECT MAX(rowid) AS Ultima FROM VW_MON_Partita_Storico_Agent", conn)
+    if df.empty:
+        return None
+    ultima = df.iloc[0]["Ultima"]
+    return (int(ultima) if pd.notna(ultima) else 0,) + data_freshness.version_borrados(
+        conn, "VW_MON_Partita_Storico_Agent"
+    )
+
+
+def _mapa_inizio_fine(df):
+    """DataFrame del historial (mas reciente primero) -> {(proceso, lote): {"start", "end"}}."""
+    df = df.dropna(subset=["ProcessoCodice", "LottoCodice"])
+    if df.empty:
+        return {}
+    df = df.assign(
+        ProcessoCodice=df["ProcessoCodice"].astype(str),
+        LottoCodice=df["LottoCodice"].astype(str),
+    ).drop_duplicates(subset=["ProcessoCodice", "LottoCodice"], keep="first")
+
+    def _fechas(serie):
+        s = _to_local_naive_series(serie)
+        return s.astype(object).where(s.notna(), None).tolist()
+
+    return {
+        (p, l): {"start": i, "end": f}
+        for p, l, i, f in zip(
+            df["ProcessoCodice"].tolist(), df["LottoCodice"].tolist(),
+            _fechas(df["LottoInizio"]), _fechas(df["LottoFine"]),
+        )
+    }
+
+
+# Mapa de inicio/fin por max_rows, reutilizado mientras el historial no cambie
+_LOTTI_MAP_CACHE = {}
+_LOTTI_MAP_LOCK = threading.Lock()
+
+
+@perfilar()
 def get_lotti_inizio_fine_map(max_rows: int = 800):
     """
     Obtiene inicio/fin de lote desde VW_MON_Partita_Storico_Agent.
 
     Retorna dict con llave (ProcesoCodice, LottoCodice) -> {"start": datetime|None, "end": datetime|None}
+    (el registro mas reciente de cada lote). max_rows=None lee el historial completo.
+    El mapa se guarda en cache y solo se recalcula cuando el historial tiene registros
+    nuevos o borrados (_firma_storico); tratarlo como solo lectura.
     """
     try:
         conn = get_connection()
-        query = f"""
-        SELECT TOP {int(max_rows)}
-            ProcessoCodice,
-            LottoCodice,
-            LottoInizio,
-            LottoFine
-        FROM VW_MON_Partita_Storico_Agent
-        ORDER BY DataAcquisizione DESC
-        """
-        df = read_sql_adapted(query, conn)
-        conn.close()
-        if df.empty:
-            return {}
+        try:
+            firma = _firma_storico(conn)
+            with _LOTTI_MAP_LOCK:
+                cacheado = _LOTTI_MAP_CACHE.get(max_rows)
+            if cacheado is not None and firma is not None and cacheado[0] == firma:
+                return cacheado[1]
 
-        out = {}
-        for _, r in df.iterrows():
-            proc = r.get("ProcessoCodice")
-            lotto = r.get("LottoCodice")
-            if proc is None or lotto is None:
-                continue
-            key = (str(proc), str(lotto))
-            if key in out:
-                continue
-            start = r.get("LottoInizio")
-            end = r.get("LottoFine")
-            try:
-                start_dt = start.to_pydatetime() if hasattr(start, "to_pydatetime") else start
-            except Exception:
-                start_dt = None
-            try:
-                end_dt = end.to_pydatetime() if hasattr(end, "to_pydatetime") else end
-            except Exception:
-                end_dt = None
-            start_dt = _to_local_naive(start_dt)
-            end_dt = _to_local_naive(end_dt)
-            out[key] = {"start": start_dt, "end": end_dt}
+            top = f"TOP {int(max_rows)} " if max_rows else ""
+            query = f"""
+            SELECT {top}
+                ProcessoCodice,
+                LottoCodice,
+                LottoInizio,
+                LottoFine
+            FROM VW_MON_Partita_Storico_Agent
+            ORDER BY DataAcquisizione DESC
+            """
+            df = read_sql_adapted(query, conn)
+        finally:
+            conn.close()
+        out = _mapa_inizio_fine(df) if not df.empty else {}
+        with _LOTTI_MAP_LOCK:
+            _LOTTI_MAP_CACHE[max_rows] = (firma, out)
         return out
     except Exception:
         return {}
 
 
+def get_lotto_inizio_fine(processo_codice, lotto_codice):
+    """
+    Inicio/fin de un solo lote ({"start", "end"} o None si no esta en el historial).
+
+    Usa un mapa en cache si lo contiene y su firma coincide con la del historial
+    actual; si no, una busqueda por (ProcessoCodice, LottoCodice) que resuelve el
+    indice IX_Storico_ProcLotto.
+    """
+    clave = (str(processo_codice), str(lotto_codice))
+    try:
+        conn = get_connection()
+        try:
+            firma = _firma_storico(conn)
+            if firma is not None:
+                with _LOTTI_MAP_LOCK:
+                    mapas = [m for f, m in _LOTTI_MAP_CACHE.values() if f == firma]
+                for mapa in mapas:
+                    if clave in mapa:
+                        return mapa[clave]
+            df = read_sql_adapted(
+                """
+                SELECT TOP 1 ProcessoCodice, LottoCodice, LottoInizio, LottoFine
+                FROM VW_MON_Partita_Storico_Agent
+                WHERE ProcessoCodice = ? AND LottoCodice = ?
+                ORDER BY DataAcquisizione DESC
+                """,
+                conn,
+                params=[clave[0], clave[1]],
+            )
+        finally:
+            conn.close()
+        if df.empty:
+            return None
+        return _mapa_inizio_fine(df).get(clave)
+    except Exception:
+        return None
+
+
+@perfilar()
 def get_kg_por_hora_turno():
     """Obtiene los kg por hora del turno desde VW_MON_Produttivita_Turno_Corrente."""
     try:
@@ -753,6 +845,7 @@ def get_kg_lote_vw_partita(lotto_codice, processo_codice):
     except Exception as e:
         return 0
 
+@perfilar()
 def get_kg_total_lote(lotto_codice):
     """Obtiene los kg totales del lote sumando todos los PesoNetto desde VW_LottiIngresso
     Equivalente a KgTotalDelLote en Power BI: suma de Medidas[KgNetto] donde CodiceLotto = lote actual
@@ -796,6 +889,7 @@ def get_kg_total_lote(lotto_codice):
     except Exception as e:
         return 0
 
+@perfilar()
 def get_kg_por_caja_lote(lotto_codice=None):
     """Calcula los kg por caja del lote
     Equivalente a KGporCAJAdeLOTE en Power BI:
@@ -959,6 +1053,7 @@ def create_gauge(value, max_value, title, color='green'):
     
     return fig
 
+@perfilar()
 def get_exportador_nombre(lotto_codice):
     """Obtiene el nombre del exportador vinculando dos tablas usando el código de lote
     ANA_Esportatore tiene ESP_ID y ESP_Esportatore pero NO tiene la columna del lote
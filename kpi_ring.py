@@ -0,0 +1,153 @@
+"""
+Historial en memoria de los KPIs de cada tick, para sparklines sin leer la BD.
+
+Los KPIs de las tarjetas son del turno de la planta (contadores de
+VW_MON_Produttivita_Turno_Corrente), no de una linea: se guardan en la serie PLANTA.
+Cada serie tiene un buffer circular de tamano fijo (arreglo estructurado de NumPy):
+ts, cajas y kg acumulados del turno, cajas/h, kg/h y avance del lote en curso. Agregar una
+muestra es O(1) y la memoria queda acotada a PANEL_KPI_RING_HOURS horas de ticks
+(PANEL_KPI_RING_MIN_S entre muestras; con varios clientes los ticks extra se ignoran).
+
+serie() reduce la ventana pedida a N puntos (media por intervalo para tasas y avance,
+ultimo valor para acumulados); sparkline_svg() la dibuja para las tarjetas.
+"""
+import threading
+
+import numpy as np
+
+from config_demo import env_float
+
+
+KPI_RING_HOURS = env_float("PANEL_KPI_RING_HOURS", 8)
+KPI_RING_MIN_S = env_float("PANEL_KPI_RING_MIN_S", 5)
+PLANTA = "planta"
+
+MUESTRA = np.dtype([
+    ("ts", "f8"),
+    ("cajas", "i4"),
+    ("kg", "f4"),
+    ("cajas_h", "f4"),
+    ("kg_h", "f4"),
+    ("progreso", "f4"),
+])
+CAMPOS = MUESTRA.names[1:]
+_ACUMULADOS = ("cajas", "kg")  # al reducir se toma el ultimo valor del intervalo
+
+
+class KpiRingBuffer:
+    def __init__(self, capacidad, min_intervalo_s=KPI_RING_MIN_S):
+        self.capacidad = int(capacidad)
+        self.min_intervalo_s = float(min_intervalo_s)
+        self._datos = np.zeros(self.capacidad, dtype=MUESTRA)
+        self._siguiente = 0
+        self._cantidad = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._cantidad
+
+    def agregar(self, ts, cajas=0, kg=0.0, cajas_h=0.0, kg_h=0.0, progreso=0.0):
+        """Agrega una muestra; retorna False si llega antes de min_intervalo_s desde la anterior."""
+        with self._lock:
+            if self._cantidad:
+                ultimo = self._datos[(self._siguiente - 1) % self.capacidad]["ts"]
+                if ts - ultimo < self.min_intervalo_s:
+                    return False
+            self._datos[self._siguiente] = (ts, cajas, kg, cajas_h, kg_h, progreso)
+            self._siguiente = (self._siguiente + 1) % self.capacidad
+            self._cantidad = min(self._cantidad + 1, self.capacidad)
+            return True
+
+    def ordenado(self, desde_ts=None):
+        """Copia de las muestras en orden cronologico (opcionalmente desde `desde_ts`)."""
+        with self._lock:
+            if self._cantidad < self.capacidad:
+                datos = self._datos[:self._cantidad].copy()
+            else:
+                datos = np.concatenate((self._datos[self._siguiente:], self._datos[:self._siguiente]))
+        if desde_ts is not None and len(datos):
+            datos = datos[np.searchsorted(datos["ts"], desde_ts):]
+        return datos
+
+
+def reducir(datos, puntos, desde_ts, hasta_ts):
+    """Reduce `datos` a lo mas `puntos` intervalos iguales entre desde_ts y hasta_ts."""
+    if not len(datos) or puntos <= 0:
+        return {"ts": []} | {c: [] for c in CAMPOS}
+    if len(datos) <= puntos:
+        return {"ts": datos["ts"].tolist()} | {c: datos[c].tolist() for c in CAMPOS}
+    ancho = max(1e-9, (hasta_ts - desde_ts) / puntos)
+    cubetas = np.clip(((datos["ts"] - desde_ts) / ancho).astype(np.int64), 0, puntos - 1)
+    usadas, primero, conteo = np.unique(cubetas, return_index=True, return_counts=True)
+    ultimo = primero + conteo - 1
+    resultado = {"ts": datos["ts"][ultimo].tolist()}
+    for campo in CAMPOS:
+        if campo in _ACUMULADOS:
+            resultado[campo] = datos[campo][ultimo].tolist()
+        else:
+            sumas = np.add.reduceat(datos[campo].astype("f8"), primero)
+            resultado[campo] = np.round(sumas / conteo, 2).tolist()
+    return resultado
+
+
+class KpiHistory:
+    """Un KpiRingBuffer por serie (PLANTA para los KPIs del turno)."""
+
+    def __init__(self, horas=KPI_RING_HOURS, min_intervalo_s=KPI_RING_MIN_S):
+        self.horas = float(horas)
+        self.min_intervalo_s = max(1.0, float(min_intervalo_s))
+        self._capacidad = max(16, int(self.horas * 3600.0 / self.min_intervalo_s) + 1)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def buffer(self, clave=PLANTA):
+        clave = str(clave)
+        with self._lock:
+            buf = self._series.get(clave)
+            if buf is None:
+                buf = self._series[clave] = KpiRingBuffer(self._capacidad, self.min_intervalo_s)
+            return buf
+
+    def registrar(self, clave, ts, **kpis):
+        return self.buffer(clave).agregar(ts, **kpis)
+
+    def series(self):
+        with self._lock:
+            return sorted(self._series)
+
+    def serie(self, clave, ahora_ts, horas=None, puntos=60):
+        horas = min(self.horas, float(horas or self.horas))
+        desde = ahora_ts - horas * 3600.0
+        with self._lock:
+            buf = self._series.get(str(clave))
+        datos = buf.ordenado(desde) if buf else np.zeros(0, dtype=MUESTRA)
+        return reducir(datos, int(puntos), desde, ahora_ts)
+
+    def estado(self):
+        with self._lock:
+            series = dict(self._series)
+        return {
+            "capacidad": self._capacidad,
+            "bytes_por_serie": self._capacidad * MUESTRA.itemsize,
+            "series": {c: len(b) for c, b in series.items()},
+        }
+
+
+def sparkline_svg(valores, color="#2563eb", ancho=120, alto=28):
+    """SVG de una polilinea con los valores (vacio si hay menos de dos)."""
+    puntos = ""
+    if len(valores) >= 2:
+        v = np.asarray(valores, dtype="f8")
+        rango = float(v.max() - v.min()) or 1.0
+        x = np.linspace(1, ancho - 1, len(v))
+        y = (alto - 2) - (v - v.min()) / rango * (alto - 4)
+        puntos = " ".join(f"{a:.1f},{b:.1f}" for a, b in zip(x, y))
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{ancho}" height="{alto}" viewBox="0 0 {ancho} {alto}" '
+        'preserveAspectRatio="none">'
+        f'<polyline points="{puntos}" fill="none" stroke="{color}" stroke-width="1.6" '
+        'stroke-linejoin="round" stroke-linecap="round"/></svg>'
+    )
+
+
+HISTORIAL = KpiHistory()
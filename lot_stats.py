@@ -0,0 +1,391 @@
+"""
+Estadisticas de duracion de lotes por (proceso, variedad, productor) para planificacion.
+
+PROD_Stats_Lote guarda una fila por lote cerrado (duracion, cajas y kg segun
+VW_LottiIngresso) y PROD_Stats_Duracion el resumen por clave: lotes, media, p50, p90,
+maximo y kg por caja. Ademas de la clave completa se mantienen las filas
+(proceso, variedad, '*') y (proceso, '*', '*') para claves con pocos lotes.
+
+registrar_cierre() se llama desde production_ledger en la misma transaccion del
+cierre y actualiza las tres claves del lote sin leer sus muestras: lotes, media,
+maximo, cajas y kg se acumulan, y p50/p90 salen de PROD_Stats_Histograma (lotes por
+cubeta de RESOLUCION_MIN minutos, interpolado dentro de la cubeta), que tiene a lo mas
+unas decenas de filas por clave. consultar() resuelve en memoria (dict cargado una
+vez y recargado cuando cambia la tabla), sin leer el historial.
+backfill() reconstruye todo desde VW_MON_Partita_Storico_Agent + VW_LottiIngresso.
+
+Uso:
+    python lot_stats.py --backfill
+    python lot_stats.py --show CAL001
+"""
+import math
+import sqlite3
+import threading
+import time
+
+import clock
+
+TODOS = "*"
+MIN_LOTES = 3              # lotes minimos para usar una clave antes de pasar a la mas general
+RESOLUCION_MIN = 5.0       # ancho de las cubetas del histograma de duraciones (minutos)
+_RECARGA_S = 30.0          # cada cuanto se revisa si otro proceso cambio las estadisticas
+
+_SQL_CREAR = [
+    """
+    CREATE TABLE IF NOT EXISTS PROD_Stats_Lote (
+        Proceso TEXT NOT NULL,
+        Lotto TEXT NOT NULL,
+        Inicio TEXT NOT NULL,
+        Fin TEXT NOT NULL,
+        Variedad TEXT NOT NULL,
+        Productor TEXT NOT NULL,
+        DuracionMin REAL NOT NULL,
+        Cajas INTEGER NOT NULL DEFAULT 0,
+        Kg REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (Proceso, Lotto, Inicio)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS IX_StatsLote_Clave ON PROD_Stats_Lote (Proceso, Variedad, Productor, DuracionMin)",
+    """
+    CREATE TABLE IF NOT EXISTS PROD_Stats_Duracion (
+        Proceso TEXT NOT NULL,
+        Variedad TEXT NOT NULL,
+        Productor TEXT NOT NULL,
+        Lotes INTEGER NOT NULL,
+        MediaMin REAL,
+        P50Min REAL,
+        P90Min REAL,
+        MaxMin REAL,
+        Cajas INTEGER NOT NULL DEFAULT 0,
+        Kg REAL NOT NULL DEFAULT 0,
+        Actualizado TEXT NOT NULL,
+        PRIMARY KEY (Proceso, Variedad, Productor)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS PROD_Stats_Histograma (
+        Proceso TEXT NOT NULL,
+        Variedad TEXT NOT NULL,
+        Productor TEXT NOT NULL,
+        Cubeta INTEGER NOT NULL,
+        Lotes INTEGER NOT NULL,
+        PRIMARY KEY (Proceso, Variedad, Productor, Cubeta)
+    ) WITHOUT ROWID
+    """,
+]
+
+_SQL_MUESTRA = """
+    INSERT OR REPLACE INTO PROD_Stats_Lote
+    (Proceso, Lotto, Inicio, Fin, Variedad, Productor, DuracionMin, Cajas, Kg)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_SQL_RESUMEN = """
+    INSERT OR REPLACE INTO PROD_Stats_Duracion
+    (Proceso, Variedad, Productor, Lotes, MediaMin, P50Min, P90Min, MaxMin, Cajas, Kg, Actualizado)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SQL_CUBETA = """
+    INSERT INTO PROD_Stats_Histograma (Proceso, Variedad, Productor, Cubeta, Lotes) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(Proceso, Variedad, Productor, Cubeta) DO UPDATE SET Lotes = Lotes + excluded.Lotes
+"""
+_CLAVE = "Proceso = ? AND Variedad = ? AND Productor = ?"
+
+_TABLAS = ("PROD_Stats_Lote", "PROD_Stats_Duracion", "PROD_Stats_Histograma")
+_FORMATO = "%Y-%m-%d %H:%M:%S"  # igual que datetime() de SQLite en backfill
+
+_CACHE_LOCK = threading.Lock()
+_CACHE = {"firma": None, "revisado": 0.0, "stats": {}}
+
+
+def crear_tablas(cur):
+    for sql in _SQL_CREAR:
+        cur.execute(sql)
+
+
+def reiniciar(cur):
+    for tabla in _TABLAS:
+        cur.execute(f"DROP TABLE IF EXISTS {tabla}")
+    crear_tablas(cur)
+    invalidar()
+
+
+def invalidar():
+    with _CACHE_LOCK:
+        _CACHE["firma"] = None
+        _CACHE["revisado"] = 0.0
+
+
+def _texto(valor):
+    valor = "" if valor is None else str(valor).strip()
+    return valor or "N/A"
+
+
+def clave_lote(cur, proceso, lote):
+    """(variedad, productor, cajas planificadas, kg) del lote segun VW_LottiIngresso."""
+    fila = cur.execute(
+        """
+        SELECT Varieta, CodiceProduttore, UnitaPianificate, PesoNetto FROM VW_LottiIngresso
+        WHERE CodiceLotto = ? AND CodiceProcesso = ?
+        ORDER BY DataLettura DESC LIMIT 1
+        """,
+        (str(lote), str(proceso)),
+    ).fetchone()
+    if not fila:
+        return "N/A", "N/A", 0, 0.0
+    return _texto(fila[0]), _texto(fila[1]), int(fila[2] or 0), float(fila[3] or 0) / 1000.0
+
+
+def _cubeta(duracion):
+    return max(0, int(duracion // RESOLUCION_MIN))
+
+
+def _percentil(cubetas, p, maximo):
+    """Percentil de un histograma [(cubeta, lotes)] ordenado, interpolado dentro de la cubeta."""
+    n = sum(lotes for _, lotes in cubetas)
+    if not n:
+        return None
+    rango = max(1, math.ceil(p * n))
+    acumulado = 0
+    for cubeta, lotes in cubetas:
+        if acumulado + lotes >= rango:
+            return round(min(maximo, (cubeta + (rango - acumulado) / lotes) * RESOLUCION_MIN), 2)
+        acumulado += lotes
+    return round(maximo, 2)
+
+
+def _acumular(cur, clave, duracion, cajas, kg, signo, actualizado):
+    """Suma (signo 1) o quita (signo -1) una muestra del resumen y el histograma de `clave`."""
+    cubeta = clave + (_cubeta(duracion), signo)
+    try:
+        cur.execute(_SQL_CUBETA, cubeta)
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        crear_tablas(cur)
+        cur.execute(_SQL_CUBETA, cubeta)
+    fila = cur.execute(
+        f"SELECT Lotes, MediaMin, MaxMin, Cajas, Kg FROM PROD_Stats_Duracion WHERE {_CLAVE}", clave
+    ).fetchone()
+    lotes, media, maximo, cajas_total, kg_total = fila or (0, 0.0, None, 0, 0.0)
+    n = lotes + signo
+    if n <= 0:
+        cur.execute(f"DELETE FROM PROD_Stats_Duracion WHERE {_CLAVE}", clave)
+        cur.execute(f"DELETE FROM PROD_Stats_Histograma WHERE {_CLAVE}", clave)
+        return
+    media = ((media or 0.0) * lotes + signo * duracion) / n
+    if signo > 0:
+        maximo = duracion if maximo is None else max(maximo, duracion)
+    # Al quitar una muestra el maximo queda como cota (solo cambia con backfill)
+    cubetas = cur.execute(
+        f"SELECT Cubeta, Lotes FROM PROD_Stats_Histograma WHERE {_CLAVE} AND Lotes > 0 ORDER BY Cubeta", clave
+    ).fetchall()
+    cur.execute(_SQL_RESUMEN, clave + (
+        n, media, _percentil(cubetas, 0.5, maximo), _percentil(cubetas, 0.9, maximo), round(maximo, 2),
+        int(cajas_total + signo * cajas), float(kg_total + signo * kg), actualizado,
+    ))
+
+
+def registrar_cierre(cur, proceso, lote, inicio, fin, cajas=0, kg=0.0):
+    """Agrega el lote cerrado a sus claves. Llamar dentro de la transaccion del cierre."""
+    if not (inicio and fin) or fin < inicio:
+        return
+    variedad, productor, cajas_plan, kg_plan = clave_lote(cur, proceso, lote)
+    muestra = (
+        str(proceso), str(lote), inicio.strftime(_FORMATO), fin.strftime(_FORMATO), variedad, productor,
+        (fin - inicio).total_seconds() / 60.0,
+        # Pesos de VW_LottiIngresso (kg por caja = PesoNetto / UnitaPianificate); sin fila, los del libro
+        cajas_plan if kg_plan else int(cajas or 0),
+        kg_plan if kg_plan else float(kg or 0.0),
+    )
+    try:
+        # Un lote cerrado de nuevo reemplaza su muestra: se quita la anterior de sus claves
+        previa = cur.execute(
+            "SELECT Variedad, Productor, DuracionMin, Cajas, Kg FROM PROD_Stats_Lote "
+            "WHERE Proceso = ? AND Lotto = ? AND Inicio = ?",
+            muestra[:3],
+        ).fetchone()
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        crear_tablas(cur)
+        previa = None
+    cur.execute(_SQL_MUESTRA, muestra)
+    actualizado = clock.now_local().isoformat(sep=" ")
+    if previa:
+        for clave in ((previa[0], previa[1]), (previa[0], TODOS), (TODOS, TODOS)):
+            _acumular(cur, (muestra[0],) + clave, previa[2], previa[3], previa[4], -1, actualizado)
+    for clave in ((variedad, productor), (variedad, TODOS), (TODOS, TODOS)):
+        _acumular(cur, (muestra[0],) + clave, muestra[6], muestra[7], muestra[8], 1, actualizado)
+    invalidar()
+
+
+def backfill(conn):
+    """Reconstruye muestras y resumenes desde el historial (y lotes del libro aun sin historial)."""
+    cur = conn.cursor()
+    reiniciar(cur)
+    tiene_libro = True
+    try:
+        cur.execute("SELECT 1 FROM PROD_Agg_Lotto LIMIT 1")
+    except sqlite3.OperationalError:
+        tiene_libro = False
+    fuente_libro = """
+        UNION ALL
+        SELECT a.Proceso, a.Lotto, a.Inicio, a.Fin, a.Cajas, a.Kg * 1000.0
+        FROM PROD_Agg_Lotto a
+        WHERE a.Fin IS NOT NULL AND a.Inicio IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM VW_MON_Partita_Storico_Agent s
+            WHERE s.ProcessoCodice = a.Proceso AND s.LottoCodice = a.Lotto AND s.LottoFine >= a.Inicio
+        )
+    """ if tiene_libro else ""
+    cur.execute(f"""
+        INSERT OR REPLACE INTO PROD_Stats_Lote
+        (Proceso, Lotto, Inicio, Fin, Variedad, Productor, DuracionMin, Cajas, Kg)
+        SELECT l.Proceso, l.Lotto, datetime(l.Inicio), datetime(l.Fin),
+               COALESCE(NULLIF(TRIM(v.Varieta), ''), 'N/A'),
+               COALESCE(NULLIF(TRIM(v.CodiceProduttore), ''), 'N/A'),
+               (julianday(l.Fin) - julianday(l.Inicio)) * 1440.0,
+               COALESCE(v.UnitaPianificate, l.Cajas, 0),
+               COALESCE(v.PesoNetto, l.Peso, 0) / 1000.0
+        FROM (
+            SELECT DISTINCT ProcessoCodice AS Proceso, LottoCodice AS Lotto, LottoInizio AS Inicio,
+                   LottoFine AS Fin, NULL AS Cajas, NULL AS Peso
+            FROM VW_MON_Partita_Storico_Agent
+            WHERE LottoInizio IS NOT NULL AND LottoFine IS NOT NULL
+            {fuente_libro}
+        ) l
+        LEFT JOIN VW_LottiIngresso v
+          ON v.CodiceLotto = l.Lotto AND v.CodiceProcesso = l.Proceso
+        WHERE l.Fin >= l.Inicio
+    """)
+
+    # Histograma y resumenes por clave en SQL; p50/p90 en una pasada por el histograma
+    actualizado = clock.now_local().isoformat(sep=" ")
+    for variedad, productor, grupo in (
+        ("Variedad", "Productor", "Proceso, Variedad, Productor"),
+        ("Variedad", f"'{TODOS}'", "Proceso, Variedad"),
+        (f"'{TODOS}'", f"'{TODOS}'", "Proceso"),
+    ):
+        cur.execute(f"""
+            INSERT INTO PROD_Stats_Histograma (Proceso, Variedad, Productor, Cubeta, Lotes)
+            SELECT Proceso, {variedad}, {productor}, CAST(DuracionMin / ? AS INTEGER) AS Cubeta, COUNT(*)
+            FROM PROD_Stats_Lote GROUP BY {grupo}, Cubeta
+        """, (RESOLUCION_MIN,))
+        cur.execute(f"""
+            INSERT INTO PROD_Stats_Duracion
+            (Proceso, Variedad, Productor, Lotes, MediaMin, P50Min, P90Min, MaxMin, Cajas, Kg, Actualizado)
+            SELECT Proceso, {variedad}, {productor}, COUNT(*), AVG(DuracionMin), NULL, NULL,
+                   ROUND(MAX(DuracionMin), 2), SUM(Cajas), SUM(Kg), ?
+            FROM PROD_Stats_Lote GROUP BY {grupo}
+        """, (actualizado,))
+    maximos = {
+        (f[0], f[1], f[2]): f[3]
+        for f in cur.execute("SELECT Proceso, Variedad, Productor, MaxMin FROM PROD_Stats_Duracion").fetchall()
+    }
+    histogramas = {}
+    for proceso, variedad, productor, cubeta, lotes in cur.execute(
+        "SELECT Proceso, Variedad, Productor, Cubeta, Lotes FROM PROD_Stats_Histograma "
+        "ORDER BY Proceso, Variedad, Productor, Cubeta"
+    ).fetchall():
+        histogramas.setdefault((proceso, variedad, productor), []).append((cubeta, lotes))
+    cur.executemany(
+        f"UPDATE PROD_Stats_Duracion SET P50Min = ?, P90Min = ? WHERE {_CLAVE}",
+        [
+            (_percentil(cubetas, 0.5, maximos[clave]), _percentil(cubetas, 0.9, maximos[clave])) + clave
+            for clave, cubetas in histogramas.items()
+        ],
+    )
+    conn.commit()
+    invalidar()
+    return {
+        "PROD_Stats_Lote": cur.execute("SELECT COUNT(*) FROM PROD_Stats_Lote").fetchone()[0],
+        "PROD_Stats_Duracion": len(maximos),
+    }
+
+
+def _cargar(conn):
+    """Dict {(proceso, variedad, productor): stats}, recargado solo si cambio la tabla."""
+    ahora = time.monotonic()
+    with _CACHE_LOCK:
+        if _CACHE["firma"] is not None and ahora - _CACHE["revisado"] < _RECARGA_S:
+            return _CACHE["stats"]
+    try:
+        firma = conn.execute("SELECT COUNT(*), MAX(Actualizado) FROM PROD_Stats_Duracion").fetchone()
+    except sqlite3.OperationalError:
+        return {}
+    firma = tuple(firma)
+    with _CACHE_LOCK:
+        if firma == _CACHE["firma"]:
+            _CACHE["revisado"] = ahora
+            return _CACHE["stats"]
+    stats = {}
+    for f in conn.execute(
+        """
+        SELECT Proceso, Variedad, Productor, Lotes, MediaMin, P50Min, P90Min, MaxMin, Cajas, Kg
+        FROM PROD_Stats_Duracion
+        """
+    ):
+        stats[(f[0], f[1], f[2])] = {
+            "proceso": f[0], "variedad": f[1], "productor": f[2], "lotes": int(f[3]),
+            "media_min": round(f[4], 2) if f[4] is not None else None,
+            "p50_min": f[5], "p90_min": f[6], "max_min": f[7],
+            "kg_por_caja": round(float(f[9]) / f[8], 3) if f[8] else None,
+        }
+    with _CACHE_LOCK:
+        _CACHE.update(firma=firma, revisado=ahora, stats=stats)
+    return stats
+
+
+def consultar(conn, proceso, variedad=None, productor=None, min_lotes=MIN_LOTES):
+    """Stats de la clave mas especifica con al menos `min_lotes` lotes, o None."""
+    stats = _cargar(conn)
+    variedad = _texto(variedad) if variedad not in (None, TODOS) else TODOS
+    productor = _texto(productor) if productor not in (None, TODOS) else TODOS
+    proceso = str(proceso)
+    for clave in ((proceso, variedad, productor), (proceso, variedad, TODOS), (proceso, TODOS, TODOS)):
+        fila = stats.get(clave)
+        if fila and fila["lotes"] >= min_lotes:
+            return fila
+    return None
+
+
+def evaluar_duracion(stats, minutos):
+    """Compara la duracion en curso con el p90 de la clave: {"p90_min", "ratio", "excedido"}."""
+    if not stats or not stats.get("p90_min"):
+        return None
+    p90 = float(stats["p90_min"])
+    return {"p90_min": p90, "ratio": round(minutos / p90, 2), "excedido": minutos > p90}
+
+
+def listar(conn, proceso=None):
+    """Todas las claves (de un proceso o todos), ordenadas."""
+    stats = _cargar(conn)
+    return [v for k, v in sorted(stats.items()) if proceso is None or k[0] == proceso]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Estadisticas de duracion de lotes")
+    parser.add_argument("--db", default="demo_database.db", help="Ruta a la base de datos")
+    parser.add_argument("--backfill", action="store_true", help="Reconstruir desde el historial")
+    parser.add_argument("--show", metavar="PROCESO", nargs="?", const="", help="Listar estadisticas")
+    args = parser.parse_args()
+
+    if not args.backfill and args.show is None:
+        parser.error("indicar --backfill o --show")
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.backfill:
+            inicio = time.perf_counter()
+            filas = backfill(conn)
+            print(f"[STATS] Backfill listo en {time.perf_counter() - inicio:.2f}s: {filas}")
+        if args.show is not None:
+            for fila in listar(conn, args.show or None):
+                print(
+                    f"{fila['proceso']:8} {fila['variedad'][:16]:16} {fila['productor'][:10]:10} "
+                    f"n={fila['lotes']:<5} media={fila['media_min']:.1f} p50={fila['p50_min']:.1f} "
+                    f"p90={fila['p90_min']:.1f} kg/caja={fila['kg_por_caja']}"
+                )
+    finally:
+        conn.close()
@@ -0,0 +1,214 @@
+"""
+Telemetria de memoria opcional para procesos de larga duracion.
+
+Con PANEL_MEMTRACE=1 se inicia tracemalloc y un hilo toma una foto cada
+PANEL_MEMTRACE_INTERVAL_S segundos: registra RSS y memoria trazada, y compara los
+sitios de asignacion (archivo:linea) contra la foto anterior y contra la primera.
+Si el RSS crece mas de PANEL_MEM_DUMP_MB sobre la linea base, se vuelca el top de
+crecimiento al logger "panel.memory".
+"""
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from config_demo import env_float
+
+logger = logging.getLogger("panel.memory")
+
+_FILTROS_RUIDO = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def rss_bytes():
+    """RSS del proceso actual (psutil si esta instalado; /proc en Linux; API Win32 en Windows)."""
+    try:
+        import psutil
+
+        return int(psutil.Process().memory_info().rss)
+    except Exception:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            paginas = int(f.read().split()[1])
+        return paginas * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        pass
+    if sys.platform == "win32":
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class _PMC(ctypes.Structure):
+                _fields_ = [
+                    ("cb", wintypes.DWORD),
+                    ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t),
+                ]
+
+            pmc = _PMC()
+            pmc.cb = ctypes.sizeof(_PMC)
+            proceso = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(proceso, ctypes.byref(pmc), pmc.cb):
+                return int(pmc.WorkingSetSize)
+        except Exception:
+            pass
+    try:
+        import resource
+
+        # ru_maxrss es el pico (KB en Linux), mejor que nada
+        return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) * 1024
+    except Exception:
+        return None
+
+
+def _top_diferencias(actual, anterior, top):
+    salida = []
+    for stat in actual.compare_to(anterior, "lineno")[:top]:
+        frame = stat.traceback[0]
+        salida.append(
+            {
+                "sitio": f"{frame.filename}:{frame.lineno}",
+                "diff_kb": round(stat.size_diff / 1024.0, 1),
+                "total_kb": round(stat.size / 1024.0, 1),
+                "diff_bloques": stat.count_diff,
+            }
+        )
+    return salida
+
+
+class MemoryTelemetry:
+    def __init__(self, intervalo_s=300.0, top=15, frames=1, umbral_dump_mb=0.0, historial=288):
+        self.intervalo_s = max(1.0, float(intervalo_s))
+        self.top = int(top)
+        self.frames = int(frames)
+        self.umbral_dump_mb = float(umbral_dump_mb or 0.0)
+        self._lock = threading.Lock()
+        self._historial = collections.deque(maxlen=int(historial))
+        self._foto_base = None
+        self._foto_anterior = None
+        self._ultimo_diff = []
+        self._diff_base = []
+        self._rss_base = None
+        self._proximo_dump_bytes = None
+        self._dumps_total = 0
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._detener.clear()
+        self.tomar_muestra()
+        self._hilo = threading.Thread(target=self._bucle, name="panel-memtrace", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo_s):
+            try:
+                self.tomar_muestra()
+            except Exception as e:
+                logger.warning("Error tomando muestra de memoria: %s", e)
+
+    def tomar_muestra(self):
+        foto = tracemalloc.take_snapshot().filter_traces(_FILTROS_RUIDO)
+        actual, pico = tracemalloc.get_traced_memory()
+        rss = rss_bytes()
+        muestra = {"ts": time.time(), "rss_bytes": rss, "traced_bytes": actual, "traced_pico_bytes": pico}
+
+        with self._lock:
+            if self._foto_base is None:
+                self._foto_base = foto
+                self._rss_base = rss
+                if rss is not None and self.umbral_dump_mb > 0:
+                    self._proximo_dump_bytes = rss + self.umbral_dump_mb * 1024 * 1024
+            else:
+                self._ultimo_diff = _top_diferencias(foto, self._foto_anterior, self.top)
+                self._diff_base = _top_diferencias(foto, self._foto_base, self.top)
+            self._foto_anterior = foto
+            self._historial.append(muestra)
+            dump = self._proximo_dump_bytes is not None and rss is not None and rss >= self._proximo_dump_bytes
+            if dump:
+                self._dumps_total += 1
+                # Rearmar en el siguiente multiplo del umbral para no repetir el volcado en cada muestra
+                paso = self.umbral_dump_mb * 1024 * 1024
+                while self._proximo_dump_bytes <= rss:
+                    self._proximo_dump_bytes += paso
+                diff_base = list(self._diff_base)
+
+        if dump:
+            logger.warning(
+                json.dumps(
+                    {
+                        "evento": "memoria_sobre_umbral",
+                        "rss_mb": round(rss / 1024.0 / 1024.0, 1),
+                        "rss_base_mb": round((self._rss_base or 0) / 1024.0 / 1024.0, 1),
+                        "umbral_mb": self.umbral_dump_mb,
+                        "top_crecimiento": diff_base,
+                    },
+                    ensure_ascii=False,
+                )
+            )
+        return muestra
+
+    def estado(self):
+        with self._lock:
+            historial = list(self._historial)
+            return {
+                "activo": self._hilo is not None and self._hilo.is_alive(),
+                "intervalo_s": self.intervalo_s,
+                "rss_bytes": historial[-1]["rss_bytes"] if historial else rss_bytes(),
+                "rss_base_bytes": self._rss_base,
+                "umbral_dump_mb": self.umbral_dump_mb,
+                "dumps_total": self._dumps_total,
+                "historial": historial,
+                "top_ultimo_intervalo": list(self._ultimo_diff),
+                "top_desde_inicio": list(self._diff_base),
+            }
+
+
+_TELEMETRIA = None
+
+
+def habilitada():
+    return str(os.environ.get("PANEL_MEMTRACE", "0")).strip() in {"1", "true", "TRUE", "True"}
+
+
+def iniciar_desde_entorno():
+    """Inicia la telemetria si PANEL_MEMTRACE=1 (idempotente). Retorna la instancia o None."""
+    global _TELEMETRIA
+    if not habilitada():
+        return None
+    if _TELEMETRIA is None:
+        _TELEMETRIA = MemoryTelemetry(
+            intervalo_s=env_float("PANEL_MEMTRACE_INTERVAL_S", 300),
+            top=int(env_float("PANEL_MEMTRACE_TOP", 15)),
+            frames=int(env_float("PANEL_MEMTRACE_FRAMES", 1)),
+            umbral_dump_mb=env_float("PANEL_MEM_DUMP_MB", 0),
+        )
+    _TELEMETRIA.iniciar()
+    return _TELEMETRIA
+
+
+def telemetria():
+    return _TELEMETRIA
@@ -0,0 +1,268 @@
+"""
+Metricas estilo Prometheus (solo libreria estandar).
+
+Contadores, gauges e histogramas con etiquetas, y un registro que los exporta
+en formato de texto (exposition format 0.0.4) para el endpoint /metrics.
+"""
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Buckets por defecto en segundos (latencias de callbacks y consultas)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets para cantidad de filas por consulta
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+
+def _escapar_label(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatear_labels(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores))
+    if extra:
+        pares.extend(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar_label(v)}"' for k, v in pares) + "}"
+
+
+def _formatear_valor(valor):
+    valor = float(valor)
+    if math.isinf(valor):
+        return "+Inf" if valor > 0 else "-Inf"
+    if math.isnan(valor):
+        return "NaN"
+    if valor.is_integer() and abs(valor) < 1e15:
+        return str(int(valor))
+    return repr(valor)
+
+
+class _Metrica:
+    tipo = "untyped"
+
+    def __init__(self, nombre, ayuda, labels=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def _clave(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.nombre}: se esperaban labels {self.labels}, se recibio {tuple(labels)}")
+        return tuple(str(labels[k]) for k in self.labels)
+
+    def _lineas_muestras(self):
+        raise NotImplementedError
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        lineas.extend(self._lineas_muestras())
+        return lineas
+
+
+class Counter(_Metrica):
+    tipo = "counter"
+
+    def inc(self, cantidad=1.0, **labels):
+        clave = self._clave(labels)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0.0) + float(cantidad)
+
+    def valor(self, **labels):
+        with self._lock:
+            return self._valores.get(self._clave(labels), 0.0)
+
+    def _lineas_muestras(self):
+        with self._lock:
+            items = sorted(self._valores.items())
+        return [f"{self.nombre}{_formatear_labels(self.labels, k)} {_formatear_valor(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    tipo = "gauge"
+
+    def set(self, valor, **labels):
+        clave = self._clave(labels)
+        with self._lock:
+            self._valores[clave] = float(valor)
+
+
+class Histogram(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(nombre, ayuda, labels)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, valor, **labels):
+        clave = self._clave(labels)
+        valor = float(valor)
+        with self._lock:
+            estado = self._valores.get(clave)
+            if estado is None:
+                estado = {"buckets": [0] * len(self.buckets), "suma": 0.0, "conteo": 0}
+                self._valores[clave] = estado
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    estado["buckets"][i] += 1
+                    break
+            estado["suma"] += valor
+            estado["conteo"] += 1
+
+    @contextmanager
+    def medir(self, **labels):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **labels)
+
+    def _lineas_muestras(self):
+        with self._lock:
+            items = sorted((k, dict(v, buckets=list(v["buckets"]))) for k, v in self._valores.items())
+        lineas = []
+        for clave, estado in items:
+            acumulado = 0
+            for limite, n in zip(self.buckets, estado["buckets"]):
+                acumulado += n
+                le = _formatear_labels(self.labels, clave, [("le", _formatear_valor(limite))])
+                lineas.append(f"{self.nombre}_bucket{le} {acumulado}")
+            le_inf = _formatear_labels(self.labels, clave, [("le", "+Inf")])
+            lineas.append(f"{self.nombre}_bucket{le_inf} {estado['conteo']}")
+            base = _formatear_labels(self.labels, clave)
+            lineas.append(f"{self.nombre}_sum{base} {_formatear_valor(estado['suma'])}")
+            lineas.append(f"{self.nombre}_count{base} {estado['conteo']}")
+        return lineas
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas = {}
+        self._colectores = []
+
+    def _registrar(self, clase, nombre, ayuda, labels, **kwargs):
+        with self._lock:
+            existente = self._metricas.get(nombre)
+            if existente is not None:
+                if not isinstance(existente, clase) or existente.labels != tuple(labels):
+                    raise ValueError(f"Metrica '{nombre}' ya registrada con otro tipo o labels")
+                return existente
+            metrica = clase(nombre, ayuda, labels, **kwargs)
+            self._metricas[nombre] = metrica
+            return metrica
+
+    def counter(self, nombre, ayuda, labels=()):
+        return self._registrar(Counter, nombre, ayuda, labels)
+
+    def gauge(self, nombre, ayuda, labels=()):
+        return self._registrar(Gauge, nombre, ayuda, labels)
+
+    def histogram(self, nombre, ayuda, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._registrar(Histogram, nombre, ayuda, labels, buckets=buckets)
+
+    def registrar_colector(self, colector):
+        """
+        Registra una funcion que se evalua al exponer. Debe retornar una lista de
+        (nombre, tipo, ayuda, [(labels_dict, valor), ...]).
+        """
+        with self._lock:
+            self._colectores.append(colector)
+
+    def exponer(self):
+        """Texto en formato de exposicion Prometheus."""
+        with self._lock:
+            metricas = list(self._metricas.values())
+            colectores = list(self._colectores)
+        lineas = []
+        for metrica in metricas:
+            lineas.extend(metrica.exponer())
+        for colector in colectores:
+            try:
+                familias = colector() or []
+            except Exception:
+                continue
+            for nombre, tipo, ayuda, muestras in familias:
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+                for labels, valor in muestras:
+                    if valor is None:
+                        continue
+                    etiquetas = _formatear_labels(list(labels.keys()), list(labels.values()))
+                    lineas.append(f"{nombre}{etiquetas} {_formatear_valor(valor)}")
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metricas del camino caliente (compartidas entre modulos)
+CALLBACK_SECONDS = REGISTRY.histogram(
+    "panel_callback_duration_seconds", "Duracion de callbacks Dash", ("callback",)
+)
+CALLBACK_ERRORS = REGISTRY.counter(
+    "panel_callback_errors_total", "Excepciones no controladas en callbacks Dash", ("callback",)
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "panel_db_query_duration_seconds", "Duracion de consultas SQL por funcion llamadora", ("fn", "via")
+)
+DB_QUERY_ROWS = REGISTRY.histogram(
+    "panel_db_query_rows", "Filas leidas o afectadas por consulta", ("fn", "via"), buckets=ROW_BUCKETS
+)
+DB_QUERY_ERRORS = REGISTRY.counter(
+    "panel_db_query_errors_total", "Consultas SQL que lanzaron excepcion", ("fn", "via")
+)
+DB_CONNECTIONS = REGISTRY.counter(
+    "panel_db_connections_total", "Conexiones a la BD solicitadas (checkouts)", ("result",)
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "panel_cache_requests_total", "Consultas a caches internos por resultado (hit/miss)", ("cache", "result")
+)
+SIMULATOR_TICK_SECONDS = REGISTRY.histogram(
+    "panel_simulator_tick_duration_seconds", "Duracion de cada tick de simulacion", ("source",)
+)
+DB_REGEN_SECONDS = REGISTRY.histogram(
+    "panel_db_regeneration_duration_seconds", "Duracion de regeneraciones de la base demo", ("tipo",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+DB_REGEN_TOTAL = REGISTRY.counter(
+    "panel_db_regeneration_total",
+    "Regeneraciones de la base demo por resultado (ok/error/skipped/busy/in_flight)",
+    ("tipo", "result"),
+)
+DB_MAINT_SECONDS = REGISTRY.histogram(
+    "panel_db_maintenance_duration_seconds", "Duracion de las tareas de mantenimiento de la base", ("tarea",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+DB_FILE_BYTES = REGISTRY.gauge(
+    "panel_db_file_bytes", "Tamano de la base en disco tras el ultimo mantenimiento (archivo + WAL)"
+)
+
+
+def medir_callback(nombre):
+    """Decorador: histograma de latencia y contador de errores para un callback."""
+
+    def decorador(fn):
+        @functools.wraps(fn)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                CALLBACK_ERRORS.inc(callback=nombre)
+                raise
+            finally:
+                CALLBACK_SECONDS.observe(time.perf_counter() - inicio, callback=nombre)
+
+        return envoltura
+
+    return decorador
+
+
+def registrar_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
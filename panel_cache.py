@@ -0,0 +1,130 @@
+"""
+Cache stale-while-revalidate para el estado del panel.
+
+Mientras la base de datos responde, cada tick construye el panel de forma normal
+y se guarda como ultima foto valida. Si la construccion falla, se sigue sirviendo
+la ultima foto (marcada como desactualizada) y un hilo en segundo plano reintenta
+con backoff exponencial hasta recuperar datos frescos.
+"""
+import random
+import threading
+import time
+
+
+class PanelSnapshotCache:
+    def __init__(self, backoff_inicial_s=2.0, backoff_max_s=60.0):
+        self.backoff_inicial_s = float(backoff_inicial_s)
+        self.backoff_max_s = float(backoff_max_s)
+        self._lock = threading.Lock()
+        self._valor = None
+        self._ultimo_ok_ts = None
+        self._stale_desde_ts = None
+        self._ultimo_error = None
+        self._fallos_consecutivos = 0
+        self._fallos_refresco_total = 0
+        self._servidos_stale_total = 0
+        self._servidos_frescos_total = 0
+        self._backoff_actual_s = 0.0
+        self._refresco_thread = None
+        self._build = None
+        self._build_args = ()
+
+    def obtener(self, build, *args):
+        """
+        Retorna (valor, es_stale).
+
+        - Si hay un refresco en segundo plano en curso, sirve la ultima foto sin tocar la BD.
+        - Si la construccion falla y existe una foto previa, la sirve y lanza el refresco.
+        - Si falla y no hay foto previa, propaga la excepcion (el caller decide el fallback).
+        """
+        with self._lock:
+            self._build = build
+            self._build_args = args
+            if self._refresco_activo() and self._valor is not None:
+                self._servidos_stale_total += 1
+                return self._valor, True
+
+        try:
+            valor = build(*args)
+        except Exception as e:
+            with self._lock:
+                self._registrar_fallo(e)
+                if self._valor is None:
+                    raise
+                self._servidos_stale_total += 1
+                self._iniciar_refresco()
+                return self._valor, True
+
+        with self._lock:
+            self._registrar_exito(valor)
+            self._servidos_frescos_total += 1
+        return valor, False
+
+    def _refresco_activo(self):
+        return self._refresco_thread is not None and self._refresco_thread.is_alive()
+
+    def _registrar_exito(self, valor):
+        self._valor = valor
+        self._ultimo_ok_ts = time.time()
+        self._stale_desde_ts = None
+        self._ultimo_error = None
+        self._fallos_consecutivos = 0
+        self._backoff_actual_s = 0.0
+
+    def _registrar_fallo(self, error):
+        if self._stale_desde_ts is None:
+            self._stale_desde_ts = time.time()
+        self._ultimo_error = f"{type(error).__name__}: {error}"
+        self._fallos_consecutivos += 1
+        self._fallos_refresco_total += 1
+
+    def _iniciar_refresco(self):
+        if self._refresco_activo():
+            return
+        self._backoff_actual_s = self.backoff_inicial_s
+        self._refresco_thread = threading.Thread(
+            target=self._bucle_refresco, name="panel-swr-refresh", daemon=True
+        )
+        self._refresco_thread.start()
+
+    def _bucle_refresco(self):
+        while True:
+            with self._lock:
+                espera = self._backoff_actual_s
+                build = self._build
+                args = self._build_args
+            # Jitter para que varios procesos no reintenten en el mismo instante
+            time.sleep(espera * random.uniform(0.8, 1.2))
+            try:
+                valor = build(*args)
+            except Exception as e:
+                with self._lock:
+                    self._registrar_fallo(e)
+                    self._backoff_actual_s = min(self.backoff_max_s, max(self.backoff_inicial_s, espera * 2.0))
+                continue
+            with self._lock:
+                self._registrar_exito(valor)
+            return
+
+    def stale_segundos(self):
+        with self._lock:
+            if self._stale_desde_ts is None:
+                return 0.0
+            return max(0.0, time.time() - self._stale_desde_ts)
+
+    def estado(self):
+        """Metricas del cache (para endpoints de estado y badge del panel)."""
+        with self._lock:
+            ahora = time.time()
+            return {
+                "stale": self._stale_desde_ts is not None,
+                "stale_segundos": (ahora - self._stale_desde_ts) if self._stale_desde_ts is not None else 0.0,
+                "ultimo_ok_ts": self._ultimo_ok_ts,
+                "ultimo_error": self._ultimo_error,
+                "fallos_consecutivos": self._fallos_consecutivos,
+                "fallos_refresco_total": self._fallos_refresco_total,
+                "servidos_stale_total": self._servidos_stale_total,
+                "servidos_frescos_total": self._servidos_frescos_total,
+                "refresco_en_curso": self._refresco_activo(),
+                "backoff_s": self._backoff_actual_s,
+            }
@@ -0,0 +1,422 @@
+"""
+Libro de eventos de produccion (solo se agregan filas) con agregados incrementales.
+
+Cada cambio de produccion se registra como evento en PROD_Eventi:
+
+- lot_started: una linea empieza un lote (Cajas/Kg > 0 solo si el libro se une a un
+  lote ya empezado: lo vaciado hasta ese momento);
+- box_emptied: cajas (y kg) vaciadas desde el evento anterior;
+- lot_closed: el lote termino en esa linea;
+- downtime: minutos de detencion de la linea.
+
+En la misma transaccion se actualizan los agregados por lote, turno y linea
+(PROD_Agg_Lotto, PROD_Agg_Turno, PROD_Agg_Linea), de modo que leerlos es una busqueda
+por clave. Las columnas de avance de VW_LottiIngresso y VW_MON_Partita_Corrente se
+proyectan desde PROD_Agg_Lotto (proyectar_lote) en lugar de calcularse aparte.
+Un lote se inicia y se cierra una sola vez: asegurar_lote no reabre un lote cerrado y
+avanzar_lote no le suma cajas. Quien cambia el lote en curso solo cierra el anterior si
+quedo atras (el avance del panel sigue el horario de VW_LottiIngresso; el simulador cierra
+lotes terminados) y el cambio de turno cierra los que quedaron abiertos.
+La historia de cada lote queda en el libro (eventos_lote). Los cierres y detenciones
+tambien se suman a los rollups por hora y turno (production_rollups), y cada cierre
+alimenta las estadisticas de duracion por proceso/variedad/productor (lot_stats).
+"""
+import datetime
+import sqlite3
+
+import clock
+import lot_stats
+import production_rollups
+
+TABLA_EVENTOS = "PROD_Eventi"
+TIPOS = ("lot_started", "box_emptied", "lot_closed", "downtime")
+
+_SQL_CREAR = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_EVENTOS} (
+        EventoId INTEGER PRIMARY KEY AUTOINCREMENT,
+        Ts TEXT NOT NULL,
+        Tipo TEXT NOT NULL,
+        Proceso TEXT NOT NULL,
+        Lotto TEXT,
+        Turno TEXT,
+        Cajas INTEGER NOT NULL DEFAULT 0,
+        Kg REAL NOT NULL DEFAULT 0,
+        Minutos REAL NOT NULL DEFAULT 0,
+        Fuente TEXT
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS IX_{TABLA_EVENTOS}_Lotto ON {TABLA_EVENTOS} (Proceso, Lotto, EventoId)",
+    f"CREATE INDEX IF NOT EXISTS IX_{TABLA_EVENTOS}_Ts ON {TABLA_EVENTOS} (Ts)",
+    # Solo se agregan filas: UPDATE/DELETE se rechazan (reiniciar() borra las tablas completas)
+    f"""
+    CREATE TRIGGER IF NOT EXISTS TR_{TABLA_EVENTOS}_NoUpdate BEFORE UPDATE ON {TABLA_EVENTOS}
+    BEGIN SELECT RAISE(ABORT, '{TABLA_EVENTOS} es solo de insercion'); END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS TR_{TABLA_EVENTOS}_NoDelete BEFORE DELETE ON {TABLA_EVENTOS}
+    BEGIN SELECT RAISE(ABORT, '{TABLA_EVENTOS} es solo de insercion'); END
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS PROD_Agg_Lotto (
+        Proceso TEXT NOT NULL,
+        Lotto TEXT NOT NULL,
+        Turno TEXT,
+        Inicio TEXT,
+        Fin TEXT,
+        Cajas INTEGER NOT NULL DEFAULT 0,
+        Kg REAL NOT NULL DEFAULT 0,
+        FermoMinuti REAL NOT NULL DEFAULT 0,
+        Eventos INTEGER NOT NULL DEFAULT 0,
+        UltimoTs TEXT,
+        PRIMARY KEY (Proceso, Lotto)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS PROD_Agg_Turno (
+        Turno TEXT PRIMARY KEY,
+        Cajas INTEGER NOT NULL DEFAULT 0,
+        Kg REAL NOT NULL DEFAULT 0,
+        FermoMinuti REAL NOT NULL DEFAULT 0,
+        LottiIniciati INTEGER NOT NULL DEFAULT 0,
+        LottiChiusi INTEGER NOT NULL DEFAULT 0,
+        UltimoTs TEXT
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS PROD_Agg_Linea (
+        Proceso TEXT PRIMARY KEY,
+        LottoCorrente TEXT,
+        Cajas INTEGER NOT NULL DEFAULT 0,
+        Kg REAL NOT NULL DEFAULT 0,
+        FermoMinuti REAL NOT NULL DEFAULT 0,
+        UltimoTs TEXT
+    ) WITHOUT ROWID
+    """,
+]
+
+_TABLAS = (TABLA_EVENTOS, "PROD_Agg_Lotto", "PROD_Agg_Turno", "PROD_Agg_Linea")
+
+_SQL_EVENTO = f"""
+    INSERT INTO {TABLA_EVENTOS} (Ts, Tipo, Proceso, Lotto, Turno, Cajas, Kg, Minutos, Fuente)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_SQL_AGG_LOTTO = """
+    INSERT INTO PROD_Agg_Lotto (Proceso, Lotto, Turno, Inicio, Fin, Cajas, Kg, FermoMinuti, Eventos, UltimoTs)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+    ON CONFLICT(Proceso, Lotto) DO UPDATE SET
+        Inicio = COALESCE(Inicio, excluded.Inicio),
+        Fin = CASE WHEN excluded.Inicio IS NOT NULL THEN NULL ELSE COALESCE(excluded.Fin, Fin) END,
+        Cajas = Cajas + excluded.Cajas,
+        Kg = Kg + excluded.Kg,
+        FermoMinuti = FermoMinuti + excluded.FermoMinuti,
+        Eventos = Eventos + 1,
+        UltimoTs = excluded.UltimoTs
+"""
+_SQL_AGG_TURNO = """
+    INSERT INTO PROD_Agg_Turno (Turno, Cajas, Kg, FermoMinuti, LottiIniciati, LottiChiusi, UltimoTs)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(Turno) DO UPDATE SET
+        Cajas = Cajas + excluded.Cajas,
+        Kg = Kg + excluded.Kg,
+        FermoMinuti = FermoMinuti + excluded.FermoMinuti,
+        LottiIniciati = LottiIniciati + excluded.LottiIniciati,
+        LottiChiusi = LottiChiusi + excluded.LottiChiusi,
+        UltimoTs = excluded.UltimoTs
+"""
+_SQL_AGG_LINEA = """
+    INSERT INTO PROD_Agg_Linea (Proceso, LottoCorrente, Cajas, Kg, FermoMinuti, UltimoTs)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(Proceso) DO UPDATE SET
+        LottoCorrente = CASE
+            WHEN excluded.LottoCorrente IS NOT NULL THEN excluded.LottoCorrente
+            WHEN ? AND LottoCorrente = ? THEN NULL
+            ELSE LottoCorrente END,
+        Cajas = Cajas + excluded.Cajas,
+        Kg = Kg + excluded.Kg,
+        FermoMinuti = FermoMinuti + excluded.FermoMinuti,
+        UltimoTs = excluded.UltimoTs
+"""
+
+
+def crear_tablas(cur):
+    for sql in _SQL_CREAR:
+        cur.execute(sql)
+    production_rollups.crear_tablas(cur)
+    lot_stats.crear_tablas(cur)
+
+
+def reiniciar(cur):
+    """Borra libro, agregados, rollups y estadisticas (regeneracion completa de la base demo)."""
+    for tabla in _TABLAS:
+        cur.execute(f"DROP TABLE IF EXISTS {tabla}")
+    production_rollups.reiniciar(cur)
+    lot_stats.reiniciar(cur)
+    crear_tablas(cur)
+
+
+def clave_turno(ts):
+    """'day|AAAA-MM-DD' o 'night|AAAA-MM-DD' (dia 07:00-17:00, noche 17:00-07:00 del dia del inicio)."""
+    hora = ts.time()
+    if datetime.time(7, 0) <= hora < datetime.time(17, 0):
+        return f"day|{ts.date().isoformat()}"
+    fecha = ts.date() if hora >= datetime.time(17, 0) else ts.date() - datetime.timedelta(days=1)
+    return f"night|{fecha.isoformat()}"
+
+
+def _texto_ts(ts):
+    return ts.isoformat(sep=" ", timespec="seconds")
+
+
+def registrar(cur, tipo, proceso, lote=None, ts=None, cajas=0, kg=0.0, minutos=0.0, fuente=None):
+    """Agrega un evento y actualiza los agregados. Llamar dentro de la transaccion de escritura."""
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo de evento desconocido: {tipo}")
+    ts = ts or clock.now_local()
+    ts_txt = _texto_ts(ts)
+    turno = clave_turno(ts)
+    cajas = int(cajas or 0)
+    kg = float(kg or 0.0)
+    minutos = float(minutos or 0.0)
+
+    evento = (ts_txt, tipo, proceso, lote, turno, cajas, kg, minutos, fuente)
+    try:
+        cur.execute(_SQL_EVENTO, evento)
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        crear_tablas(cur)
+        cur.execute(_SQL_EVENTO, evento)
+    iniciado = tipo == "lot_started"
+    cerrado = tipo == "lot_closed"
+    if lote is not None:
+        cur.execute(
+            _SQL_AGG_LOTTO,
+            (proceso, lote, turno, ts_txt if iniciado else None, ts_txt if cerrado else None,
+             cajas, kg, minutos, ts_txt),
+        )
+    cur.execute(_SQL_AGG_TURNO, (turno, cajas, kg, minutos, int(iniciado), int(cerrado), ts_txt))
+    cur.execute(
+        _SQL_AGG_LINEA,
+        (proceso, lote if iniciado else None, cajas, kg, minutos, ts_txt, int(cerrado), lote),
+    )
+
+    if cerrado and lote is not None:
+        fila = cur.execute(
+            "SELECT Inicio, Cajas, Kg FROM PROD_Agg_Lotto WHERE Proceso = ? AND Lotto = ?",
+            (proceso, lote),
+        ).fetchone()
+        inicio = datetime.datetime.fromisoformat(fila[0]) if fila and fila[0] else None
+        cajas_lote, kg_lote = (fila[1], fila[2]) if fila else (0, 0.0)
+        production_rollups.acumular_lote(cur, proceso, lote, inicio, ts, cajas_lote, kg_lote)
+        lot_stats.registrar_cierre(cur, proceso, lote, inicio, ts, cajas_lote, kg_lote)
+    elif tipo == "downtime" and minutos:
+        production_rollups.acumular_fermo(cur, proceso, ts, minutos)
+
+
+def lote(conn, proceso, codigo_lote):
+    """Agregado del lote ({cajas, kg, inicio, fin, ...}) o None si el libro no lo tiene."""
+    fila = conn.execute(
+        """
+        SELECT Turno, Inicio, Fin, Cajas, Kg, FermoMinuti, Eventos, UltimoTs
+        FROM PROD_Agg_Lotto WHERE Proceso = ? AND Lotto = ?
+        """,
+        (proceso, codigo_lote),
+    ).fetchone()
+    if not fila:
+        return None
+    return {
+        "proceso": proceso, "lote": codigo_lote, "turno": fila[0], "inicio": fila[1], "fin": fila[2],
+        "cajas": int(fila[3]), "kg": float(fila[4]), "fermo_minutos": float(fila[5]),
+        "eventos": int(fila[6]), "ultimo_ts": fila[7],
+    }
+
+
+def turno(conn, clave):
+    fila = conn.execute(
+        """
+        SELECT Cajas, Kg, FermoMinuti, LottiIniciati, LottiChiusi, UltimoTs
+        FROM PROD_Agg_Turno WHERE Turno = ?
+        """,
+        (clave,),
+    ).fetchone()
+    if not fila:
+        return None
+    return {
+        "turno": clave, "cajas": int(fila[0]), "kg": float(fila[1]), "fermo_minutos": float(fila[2]),
+        "lotes_iniciados": int(fila[3]), "lotes_cerrados": int(fila[4]), "ultimo_ts": fila[5],
+    }
+
+
+def linea(conn, proceso):
+    fila = conn.execute(
+        "SELECT LottoCorrente, Cajas, Kg, FermoMinuti, UltimoTs FROM PROD_Agg_Linea WHERE Proceso = ?",
+        (proceso,),
+    ).fetchone()
+    if not fila:
+        return None
+    return {
+        "proceso": proceso, "lote_en_curso": fila[0], "cajas": int(fila[1]), "kg": float(fila[2]),
+        "fermo_minutos": float(fila[3]), "ultimo_ts": fila[4],
+    }
+
+
+def eventos_lote(conn, proceso, codigo_lote, limite=1000):
+    """Historia del lote en orden de llegada."""
+    filas = conn.execute(
+        f"""
+        SELECT Ts, Tipo, Cajas, Kg, Minutos, Fuente FROM {TABLA_EVENTOS}
+        WHERE Proceso = ? AND Lotto = ?
+        ORDER BY EventoId ASC LIMIT ?
+        """,
+        (proceso, codigo_lote, int(limite)),
+    ).fetchall()
+    return [
+        {"ts": f[0], "tipo": f[1], "cajas": int(f[2]), "kg": float(f[3]), "minutos": float(f[4]), "fuente": f[5]}
+        for f in filas
+    ]
+
+
+def _estado_lote(cur, proceso, codigo_lote):
+    """(cajas, fin) del agregado del lote, o None. Crea las tablas si la base es anterior al libro."""
+    try:
+        return cur.execute(
+            "SELECT Cajas, Fin FROM PROD_Agg_Lotto WHERE Proceso = ? AND Lotto = ?", (proceso, codigo_lote)
+        ).fetchone()
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        crear_tablas(cur)
+        return None
+
+
+def asegurar_lote(cur, proceso, codigo_lote, ts, cajas_iniciales=0, kg_iniciales=0.0, fuente=None):
+    """Registra lot_started si el libro no tiene el lote (un lote cerrado no se reabre).
+
+    `cajas_iniciales`/`kg_iniciales` es lo ya vaciado cuando el libro se une a un lote
+    empezado antes de existir. Retorna las cajas acumuladas del lote.
+    """
+    fila = _estado_lote(cur, proceso, codigo_lote)
+    if fila:
+        return int(fila[0])
+    registrar(cur, "lot_started", proceso, codigo_lote, ts, cajas=cajas_iniciales, kg=kg_iniciales, fuente=fuente)
+    return int(cajas_iniciales or 0)
+
+
+def avanzar_lote(cur, proceso, codigo_lote, ts, unidades, kg_por_caja, fuente=None):
+    """Lleva el lote a `unidades` cajas vaciadas registrando box_emptied por la diferencia
+    (si `unidades` es menor a lo acumulado o el lote esta cerrado no registra nada).
+    Retorna las cajas acumuladas."""
+    fila = _estado_lote(cur, proceso, codigo_lote)
+    if fila and fila[1]:
+        return int(fila[0])
+    actuales = asegurar_lote(cur, proceso, codigo_lote, ts, fuente=fuente)
+    delta = int(unidades) - actuales
+    if delta > 0:
+        registrar(cur, "box_emptied", proceso, codigo_lote, ts, cajas=delta, kg=delta * kg_por_caja, fuente=fuente)
+        actuales += delta
+    return actuales
+
+
+def cerrar_lote(cur, proceso, codigo_lote, ts, unidades_planificadas=None, kg_por_caja=0.0, fuente=None):
+    """Registra lot_closed si el lote esta en curso. Con `unidades_planificadas` antes
+    registra como vaciado lo que falte (el lote termino completo)."""
+    fila = _estado_lote(cur, proceso, codigo_lote)
+    if not fila or fila[1]:
+        return
+    if unidades_planificadas is not None:
+        avanzar_lote(cur, proceso, codigo_lote, ts, unidades_planificadas, kg_por_caja, fuente=fuente)
+    registrar(cur, "lot_closed", proceso, codigo_lote, ts, fuente=fuente)
+
+
+def lotes_abiertos(cur):
+    """[(proceso, lote)] en curso segun el libro."""
+    try:
+        return cur.execute("SELECT Proceso, Lotto FROM PROD_Agg_Lotto WHERE Fin IS NULL").fetchall()
+    except sqlite3.OperationalError:
+        return []
+
+
+def proyectar_lote(cur, proceso, codigo_lote, ts=None):
+    """Escribe en las vistas VW_ el avance del lote segun PROD_Agg_Lotto.
+
+    VW_LottiIngresso.UnitaIn/UnitaRestanti y, si es el lote en curso de la linea,
+    VW_MON_Partita_Corrente.UnitaSvuotate/PesoNetto. Retorna las cajas proyectadas.
+    """
+    fila = cur.execute(
+        "SELECT Cajas, Kg FROM PROD_Agg_Lotto WHERE Proceso = ? AND Lotto = ?", (proceso, codigo_lote)
+    ).fetchone()
+    if not fila:
+        return None
+    cajas, kg = int(fila[0]), float(fila[1])
+    cur.execute(
+        """
+        UPDATE VW_LottiIngresso
+        SET UnitaIn = MIN(?, UnitaPianificate), UnitaRestanti = MAX(0, UnitaPianificate - ?)
+        WHERE CodiceLotto = ? AND CodiceProcesso = ?
+        """,
+        (cajas, cajas, codigo_lote, proceso),
+    )
+    if ts is not None:
+        cur.execute(
+            """
+            UPDATE VW_MON_Partita_Corrente
+            SET UnitaSvuotate = ?, PesoNetto = ?, DataAcquisizione = ?
+            WHERE LottoCodice = ? AND ProcessoCodice = ?
+            """,
+            (cajas, kg * 1000.0, ts, codigo_lote, proceso),
+        )
+    return cajas
+
+
+def reconstruir(cur):
+    """Recalcula los agregados desde el libro (verificacion o reparacion)."""
+    cur.execute("DELETE FROM PROD_Agg_Lotto")
+    cur.execute("DELETE FROM PROD_Agg_Turno")
+    cur.execute("DELETE FROM PROD_Agg_Linea")
+    cur.execute(
+        f"""
+        INSERT INTO PROD_Agg_Lotto (Proceso, Lotto, Turno, Inicio, Fin, Cajas, Kg, FermoMinuti, Eventos, UltimoTs)
+        SELECT Proceso, Lotto,
+               (SELECT e2.Turno FROM {TABLA_EVENTOS} e2
+                WHERE e2.Proceso = e.Proceso AND e2.Lotto = e.Lotto ORDER BY e2.EventoId LIMIT 1),
+               MIN(CASE WHEN Tipo = 'lot_started' THEN Ts END),
+               -- Igual que _SQL_AGG_LOTTO: un lot_started posterior al ultimo cierre reabre el lote
+               (SELECT CASE WHEN u.Tipo = 'lot_closed' THEN u.Ts END FROM {TABLA_EVENTOS} u
+                WHERE u.Proceso = e.Proceso AND u.Lotto = e.Lotto AND u.Tipo IN ('lot_started', 'lot_closed')
+                ORDER BY u.EventoId DESC LIMIT 1),
+               SUM(Cajas), SUM(Kg), SUM(Minutos), COUNT(*), MAX(Ts)
+        FROM {TABLA_EVENTOS} e
+        WHERE Lotto IS NOT NULL
+        GROUP BY Proceso, Lotto
+        """
+    )
+    cur.execute(
+        f"""
+        INSERT INTO PROD_Agg_Turno (Turno, Cajas, Kg, FermoMinuti, LottiIniciati, LottiChiusi, UltimoTs)
+        SELECT Turno, SUM(Cajas), SUM(Kg), SUM(Minutos),
+               SUM(Tipo = 'lot_started'), SUM(Tipo = 'lot_closed'), MAX(Ts)
+        FROM {TABLA_EVENTOS}
+        GROUP BY Turno
+        """
+    )
+    cur.execute(
+        f"""
+        INSERT INTO PROD_Agg_Linea (Proceso, LottoCorrente, Cajas, Kg, FermoMinuti, UltimoTs)
+        SELECT e.Proceso,
+               (SELECT CASE WHEN u.Tipo = 'lot_started' THEN u.Lotto END FROM {TABLA_EVENTOS} u
+                WHERE u.Proceso = e.Proceso AND u.Tipo IN ('lot_started', 'lot_closed')
+                ORDER BY u.EventoId DESC LIMIT 1),
+               SUM(Cajas), SUM(Kg), SUM(Minutos), MAX(Ts)
+        FROM {TABLA_EVENTOS} e
+        GROUP BY e.Proceso
+        """
+    )
+
+
+def tablas_existen(conn):
+    try:
+        conn.execute(f"SELECT 1 FROM {TABLA_EVENTOS} LIMIT 1")
+        return True
+    except sqlite3.OperationalError:
+        return False
@@ -0,0 +1,350 @@
+"""
+Tablas de resumen (rollups) por hora y por turno, por linea, para tendencias historicas.
+
+Cada fila acumula cajas, kg, lotes cerrados, duracion total de esos lotes (para la
+media) y minutos de detencion. Se actualizan en la misma transaccion que el libro de
+eventos (production_ledger) cuando un lote se cierra o se registra una detencion; un
+lote cuenta completo en la hora y el turno de su cierre. PROD_Rollup_Lotto guarda lo
+ya sumado de cada lote: si un lote se cierra de nuevo solo se suma la diferencia y
+no cuenta como otro lote.
+
+backfill() las reconstruye desde VW_MON_Partita_Storico_Agent mas los lotes cerrados
+en el libro que aun no pasaron al historial. Cajas y kg salen del libro (PROD_Agg_Lotto),
+igual que en la actualizacion incremental; VW_LottiIngresso solo se usa para los lotes
+que el libro no tiene. La vista de tendencia lee solo estas tablas: 90 dias por turno
+son a lo mas 180 filas por linea.
+
+Uso:
+    python production_rollups.py --backfill            # todo el historial
+    python production_rollups.py --backfill --days 90  # solo los ultimos 90 dias
+"""
+import datetime
+import sqlite3
+import time
+
+import clock
+
+_COLUMNAS = """
+        Cajas INTEGER NOT NULL DEFAULT 0,
+        Kg REAL NOT NULL DEFAULT 0,
+        Lotes INTEGER NOT NULL DEFAULT 0,
+        DuracionMin REAL NOT NULL DEFAULT 0,
+        FermoMin REAL NOT NULL DEFAULT 0
+"""
+_SQL_CREAR = [
+    f"""
+    CREATE TABLE IF NOT EXISTS PROD_Rollup_Hora (
+        Hora TEXT NOT NULL,
+        Proceso TEXT NOT NULL,
+        {_COLUMNAS},
+        PRIMARY KEY (Hora, Proceso)
+    ) WITHOUT ROWID
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS PROD_Rollup_Turno (
+        Fecha TEXT NOT NULL,
+        Turno TEXT NOT NULL,
+        Proceso TEXT NOT NULL,
+        {_COLUMNAS},
+        PRIMARY KEY (Fecha, Turno, Proceso)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS PROD_Rollup_Lotto (
+        Proceso TEXT NOT NULL,
+        Lotto TEXT NOT NULL,
+        Cajas INTEGER NOT NULL DEFAULT 0,
+        Kg REAL NOT NULL DEFAULT 0,
+        DuracionMin REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (Proceso, Lotto)
+    ) WITHOUT ROWID
+    """,
+]
+
+_SQL_SUMAR_HORA = """
+    INSERT INTO PROD_Rollup_Hora (Hora, Proceso, Cajas, Kg, Lotes, DuracionMin, FermoMin)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(Hora, Proceso) DO UPDATE SET
+        Cajas = Cajas + excluded.Cajas, Kg = Kg + excluded.Kg, Lotes = Lotes + excluded.Lotes,
+        DuracionMin = DuracionMin + excluded.DuracionMin, FermoMin = FermoMin + excluded.FermoMin
+"""
+_SQL_SUMAR_TURNO = """
+    INSERT INTO PROD_Rollup_Turno (Fecha, Turno, Proceso, Cajas, Kg, Lotes, DuracionMin, FermoMin)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(Fecha, Turno, Proceso) DO UPDATE SET
+        Cajas = Cajas + excluded.Cajas, Kg = Kg + excluded.Kg, Lotes = Lotes + excluded.Lotes,
+        DuracionMin = DuracionMin + excluded.DuracionMin, FermoMin = FermoMin + excluded.FermoMin
+"""
+
+_SQL_LOTE_SUMADO = """
+    INSERT OR REPLACE INTO PROD_Rollup_Lotto (Proceso, Lotto, Cajas, Kg, DuracionMin) VALUES (?, ?, ?, ?, ?)
+"""
+
+_TABLAS = ("PROD_Rollup_Hora", "PROD_Rollup_Turno", "PROD_Rollup_Lotto")
+
+# Turno de una marca de tiempo en SQL (ver expresiones_turno) (dia 07:00-17:00; noche 17:00-07:00 del dia de inicio)
+_SQL_FECHA_TURNO = (
+    "CASE WHEN time({c}) < '07:00:00' THEN date({c}, '-1 day') ELSE date({c}) END"
+)
+_SQL_TIPO_TURNO = (
+    "CASE WHEN time({c}) >= '07:00:00' AND time({c}) < '17:00:00' THEN 'day' ELSE 'night' END"
+)
+
+
+def crear_tablas(cur):
+    for sql in _SQL_CREAR:
+        cur.execute(sql)
+
+
+def reiniciar(cur):
+    for tabla in _TABLAS:
+        cur.execute(f"DROP TABLE IF EXISTS {tabla}")
+    crear_tablas(cur)
+
+
+def expresiones_turno(columna):
+    """(fecha, 'day'|'night') del turno de `columna` como expresiones SQL."""
+    return _SQL_FECHA_TURNO.format(c=columna), _SQL_TIPO_TURNO.format(c=columna)
+
+
+def _hora(ts):
+    return ts.strftime("%Y-%m-%d %H:00")
+
+
+def _turno(ts):
+    """(fecha, 'day'|'night') del turno de `ts`."""
+    hora = ts.time()
+    if datetime.time(7, 0) <= hora < datetime.time(17, 0):
+        return ts.date().isoformat(), "day"
+    fecha = ts.date() if hora >= datetime.time(17, 0) else ts.date() - datetime.timedelta(days=1)
+    return fecha.isoformat(), "night"
+
+
+def _sumar(cur, ts, proceso, cajas=0, kg=0.0, lotes=0, duracion_min=0.0, fermo_min=0.0):
+    fila = (proceso, int(cajas or 0), float(kg or 0.0), int(lotes), float(duracion_min or 0.0), float(fermo_min or 0.0))
+    try:
+        cur.execute(_SQL_SUMAR_HORA, (_hora(ts),) + fila)
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        crear_tablas(cur)
+        cur.execute(_SQL_SUMAR_HORA, (_hora(ts),) + fila)
+    cur.execute(_SQL_SUMAR_TURNO, _turno(ts) + fila)
+
+
+def acumular_lote(cur, proceso, lote, inicio, fin, cajas, kg):
+    """Suma un lote cerrado a la hora y al turno de `fin` (datetimes).
+
+    `cajas`/`kg` son los totales del lote; si ya se habia sumado (cerrado antes) solo
+    se agrega lo que cambio desde ese cierre y no cuenta como otro lote.
+    """
+    duracion = max(0.0, (fin - inicio).total_seconds() / 60.0) if inicio and fin else 0.0
+    cajas, kg = int(cajas or 0), float(kg or 0.0)
+    try:
+        previo = cur.execute(
+            "SELECT Cajas, Kg, DuracionMin FROM PROD_Rollup_Lotto WHERE Proceso = ? AND Lotto = ?",
+            (proceso, lote),
+        ).fetchone()
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        crear_tablas(cur)
+        previo = None
+    c0, k0, d0 = previo or (0, 0.0, 0.0)
+    _sumar(cur, fin, proceso, cajas=cajas - c0, kg=kg - k0, lotes=0 if previo else 1, duracion_min=duracion - d0)
+    cur.execute(_SQL_LOTE_SUMADO, (proceso, lote, cajas, kg, duracion))
+
+
+def acumular_fermo(cur, proceso, ts, minutos):
+    """Suma minutos de detencion a la hora y al turno de `ts`."""
+    _sumar(cur, ts, proceso, fermo_min=minutos)
+
+
+def backfill(conn, dias=None, ahora=None):
+    """Reconstruye los rollups (todo el historial, o los ultimos `dias`). Retorna filas por tabla.
+
+    Se recalculan las horas del rango y los turnos que tienen lotes en el rango
+    (completos, aunque empiecen antes). Sin `dias` el rango empieza en el primer
+    registro vivo: los periodos ya archivados y podados (shift_archive) se conservan.
+    """
+    cur = conn.cursor()
+    crear_tablas(cur)
+    desde = None
+    if dias:
+        ahora = ahora or clock.now_local()
+        desde = (ahora - datetime.timedelta(days=int(dias))).strftime("%Y-%m-%d %H:00:00")
+
+    tiene_libro = True
+    try:
+        cur.execute("SELECT 1 FROM PROD_Agg_Lotto LIMIT 1")
+    except sqlite3.OperationalError:
+        tiene_libro = False
+
+    cur.execute("DROP TABLE IF EXISTS temp._rollup_lotes")
+    cur.execute("""
+        CREATE TEMP TABLE _rollup_lotes (
+            Proceso TEXT, Lotto TEXT, Inicio TEXT, Fin TEXT, Cajas INTEGER, Kg REAL, FermoMin REAL,
+            Hora TEXT, Fecha TEXT, Turno TEXT
+        )
+    """)
+    fuente_libro = """
+        UNION ALL
+        SELECT a.Proceso, a.Lotto, a.Inicio, a.Fin, a.Cajas, a.Kg
+        FROM PROD_Agg_Lotto a
+        WHERE a.Fin IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM VW_MON_Partita_Storico_Agent s
+            WHERE s.ProcessoCodice = a.Proceso AND s.LottoCodice = a.Lotto AND s.LottoFine >= a.Inicio
+        )
+    """ if tiene_libro else ""
+    if tiene_libro:
+        join_libro = "LEFT JOIN PROD_Agg_Lotto a ON a.Proceso = s.ProcessoCodice AND a.Lotto = s.LottoCodice"
+        cajas_kg = """
+                   CASE WHEN a.Proceso IS NOT NULL THEN a.Cajas ELSE COALESCE(v.UnitaIn, 0) END AS Cajas,
+                   CASE WHEN a.Proceso IS NOT NULL THEN a.Kg ELSE COALESCE(v.PesoNetto, 0) / 1000.0 END AS Kg"""
+    else:
+        join_libro = ""
+        cajas_kg = "COALESCE(v.UnitaIn, 0) AS Cajas, COALESCE(v.PesoNetto, 0) / 1000.0 AS Kg"
+    cur.execute(f"""
+        INSERT INTO _rollup_lotes (Proceso, Lotto, Inicio, Fin, Cajas, Kg, FermoMin, Hora, Fecha, Turno)
+        SELECT Proceso, Lotto, Inicio, Fin, Cajas, Kg, 0,
+               strftime('%Y-%m-%d %H:00', Fin),
+               {_SQL_FECHA_TURNO.format(c='Fin')},
+               {_SQL_TIPO_TURNO.format(c='Fin')}
+        FROM (
+            SELECT s.ProcessoCodice AS Proceso, s.LottoCodice AS Lotto, s.LottoInizio AS Inicio,
+                   s.LottoFine AS Fin, {cajas_kg}
+            FROM (SELECT DISTINCT ProcessoCodice, LottoCodice, LottoInizio, LottoFine
+                  FROM VW_MON_Partita_Storico_Agent WHERE LottoFine IS NOT NULL) s
+            {join_libro}
+            LEFT JOIN VW_LottiIngresso v
+              ON v.CodiceLotto = s.LottoCodice AND v.CodiceProcesso = s.ProcessoCodice
+            {fuente_libro}
+        )
+        WHERE Fin IS NOT NULL
+    """)
+    if tiene_libro:
+        try:
+            cur.execute(f"""
+                INSERT INTO _rollup_lotes (Proceso, Lotto, Inicio, Fin, Cajas, Kg, FermoMin, Hora, Fecha, Turno)
+                SELECT Proceso, NULL, NULL, NULL, 0, 0, Minutos,
+                       strftime('%Y-%m-%d %H:00', Ts),
+                       {_SQL_FECHA_TURNO.format(c='Ts')},
+                       {_SQL_TIPO_TURNO.format(c='Ts')}
+                FROM PROD_Eventi WHERE Tipo = 'downtime'
+            """)
+        except sqlite3.OperationalError:
+            pass
+
+    if desde is None:
+        desde = cur.execute("SELECT MIN(Hora) FROM _rollup_lotes").fetchone()[0]
+    if desde is not None:
+        _recalcular_desde(cur, desde[:16])
+    # Lo sumado por lote, para que un cierre posterior solo agregue la diferencia
+    cur.execute("""
+        INSERT OR REPLACE INTO PROD_Rollup_Lotto (Proceso, Lotto, Cajas, Kg, DuracionMin)
+        SELECT Proceso, Lotto, SUM(Cajas), SUM(Kg),
+               SUM(COALESCE((julianday(Fin) - julianday(Inicio)) * 1440.0, 0))
+        FROM _rollup_lotes WHERE Lotto IS NOT NULL AND Fin IS NOT NULL
+        GROUP BY Proceso, Lotto
+    """)
+    cur.execute("DROP TABLE IF EXISTS temp._rollup_lotes")
+    conn.commit()
+    return {
+        "PROD_Rollup_Hora": cur.execute("SELECT COUNT(*) FROM PROD_Rollup_Hora").fetchone()[0],
+        "PROD_Rollup_Turno": cur.execute("SELECT COUNT(*) FROM PROD_Rollup_Turno").fetchone()[0],
+    }
+
+
+def _recalcular_desde(cur, hora):
+    """Reemplaza los rollups desde `hora` ('AAAA-MM-DD HH:00') con los de temp._rollup_lotes."""
+    params = (hora,)
+    cur.execute("DELETE FROM PROD_Rollup_Hora WHERE Hora >= ?", params)
+    cur.execute("""
+        INSERT INTO PROD_Rollup_Hora (Hora, Proceso, Cajas, Kg, Lotes, DuracionMin, FermoMin)
+        SELECT Hora, Proceso, SUM(Cajas), SUM(Kg), SUM(Fin IS NOT NULL),
+               SUM(COALESCE((julianday(Fin) - julianday(Inicio)) * 1440.0, 0)), SUM(FermoMin)
+        FROM _rollup_lotes WHERE Hora >= ?
+        GROUP BY Hora, Proceso
+    """, params)
+
+    cur.execute(
+        "CREATE TEMP TABLE _rollup_turnos AS SELECT DISTINCT Fecha, Turno FROM _rollup_lotes WHERE Hora >= ?",
+        params,
+    )
+    cur.execute("""
+        DELETE FROM PROD_Rollup_Turno
+        WHERE EXISTS (SELECT 1 FROM _rollup_turnos t
+                      WHERE t.Fecha = PROD_Rollup_Turno.Fecha AND t.Turno = PROD_Rollup_Turno.Turno)
+    """)
+    cur.execute("""
+        INSERT INTO PROD_Rollup_Turno (Fecha, Turno, Proceso, Cajas, Kg, Lotes, DuracionMin, FermoMin)
+        SELECT Fecha, Turno, Proceso, SUM(Cajas), SUM(Kg), SUM(Fin IS NOT NULL),
+               SUM(COALESCE((julianday(Fin) - julianday(Inicio)) * 1440.0, 0)), SUM(FermoMin)
+        FROM _rollup_lotes WHERE (Fecha, Turno) IN (SELECT Fecha, Turno FROM _rollup_turnos)
+        GROUP BY Fecha, Turno, Proceso
+    """)
+    cur.execute("DROP TABLE IF EXISTS temp._rollup_turnos")
+
+
+def serie(conn, granularidad="turno", dias=30, proceso=None, ahora=None):
+    """Serie de tendencia desde los rollups: lista de dicts ordenada por periodo.
+
+    granularidad "hora" o "turno"; sin `proceso` se suman todas las lineas.
+    """
+    ahora = ahora or clock.now_local()
+    desde_dt = ahora - datetime.timedelta(days=int(dias))
+    filtro_proceso = "AND Proceso = ?" if proceso else ""
+    if granularidad == "hora":
+        sql = f"""
+            SELECT Hora, SUM(Cajas), SUM(Kg), SUM(Lotes), SUM(DuracionMin), SUM(FermoMin)
+            FROM PROD_Rollup_Hora
+            WHERE Hora >= ? {filtro_proceso}
+            GROUP BY Hora ORDER BY Hora
+        """
+        params = [_hora(desde_dt)]
+    else:
+        sql = f"""
+            SELECT Fecha || ' ' || Turno, SUM(Cajas), SUM(Kg), SUM(Lotes), SUM(DuracionMin), SUM(FermoMin)
+            FROM PROD_Rollup_Turno
+            WHERE Fecha >= ? {filtro_proceso}
+            GROUP BY Fecha, Turno ORDER BY Fecha, Turno
+        """
+        params = [desde_dt.date().isoformat()]
+    if proceso:
+        params.append(proceso)
+    try:
+        filas = conn.execute(sql, params).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    return [
+        {
+            "periodo": f[0],
+            "cajas": int(f[1] or 0),
+            "kg": round(float(f[2] or 0.0), 1),
+            "lotes": int(f[3] or 0),
+            "duracion_media_min": round(float(f[4] or 0.0) / f[3], 1) if f[3] else None,
+            "fermo_min": round(float(f[5] or 0.0), 1),
+        }
+        for f in filas
+    ]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rollups de produccion por hora y turno")
+    parser.add_argument("--db", default="demo_database.db", help="Ruta a la base de datos")
+    parser.add_argument("--backfill", action="store_true", help="Reconstruir los rollups desde el historial")
+    parser.add_argument("--days", type=int, default=None, help="Solo los ultimos N dias (por defecto todo)")
+    args = parser.parse_args()
+
+    if not args.backfill:
+        parser.error("indicar --backfill")
+
+    conn = sqlite3.connect(args.db)
+    try:
+        inicio = time.perf_counter()
+        filas = backfill(conn, dias=args.days, ahora=clock.now_local())
+        print(f"[ROLLUP] Backfill listo en {time.perf_counter() - inicio:.2f}s: {filas}")
+    finally:
+        conn.close()
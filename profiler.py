@@ -0,0 +1,206 @@
+"""
+Perfilado opcional (cProfile) de callbacks y funciones de datos.
+
+Se activa con la variable de entorno PANEL_PROFILE, por ejemplo:
+
+    PANEL_PROFILE=actualizar_panel:0.05,get_detalle_lotti_ingresso:0.2
+
+Cada entrada es "nombre:tasa" (tasa de muestreo entre 0 y 1; sin tasa = 1.0);
+"*" aplica a todas las funciones decoradas con @perfilar. Las muestras se agregan
+por funcion y cada PANEL_PROFILE_INTERVAL_S se escriben en PANEL_PROFILE_DIR un
+.pstats (para pstats/snakeviz) y un .folded (pilas colapsadas para flamegraph.pl
+o speedscope). Sin PANEL_PROFILE el decorador no envuelve nada.
+"""
+import cProfile
+import functools
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+PROFILE_DIR = os.environ.get(
+    "PANEL_PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+)
+PROFILE_INTERVAL_S = float(os.environ.get("PANEL_PROFILE_INTERVAL_S", "300") or 300)
+# Profundidad maxima de las pilas colapsadas
+_FOLDED_MAX_DEPTH = 64
+
+
+def _parse_objetivos(valor):
+    objetivos = {}
+    for parte in str(valor or "").split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        nombre, _, tasa = parte.partition(":")
+        try:
+            tasa_f = float(tasa) if tasa.strip() else 1.0
+        except ValueError:
+            tasa_f = 1.0
+        objetivos[nombre.strip()] = min(1.0, max(0.0, tasa_f))
+    return objetivos
+
+
+PROFILE_TARGETS = _parse_objetivos(os.environ.get("PANEL_PROFILE", ""))
+
+# cProfile no admite dos perfiladores activos a la vez: una sola muestra en curso
+_perfil_activo = threading.Lock()
+_estado_lock = threading.Lock()
+_agregados = {}
+_ultimos = {}
+
+
+def habilitado():
+    return bool(PROFILE_TARGETS)
+
+
+def tasa_para(nombre):
+    if nombre in PROFILE_TARGETS:
+        return PROFILE_TARGETS[nombre]
+    return PROFILE_TARGETS.get("*")
+
+
+def perfilar(nombre=None):
+    """Decorador: perfila la funcion con la tasa configurada en PANEL_PROFILE."""
+
+    def decorador(fn):
+        objetivo = nombre or fn.__name__
+        tasa = tasa_para(objetivo)
+        if not tasa:
+            return fn
+
+        @functools.wraps(fn)
+        def envoltura(*args, **kwargs):
+            if random.random() >= tasa or not _perfil_activo.acquire(blocking=False):
+                return fn(*args, **kwargs)
+            perfil = cProfile.Profile()
+            try:
+                perfil.enable()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    perfil.disable()
+            finally:
+                _perfil_activo.release()
+                _agregar_muestra(objetivo, perfil)
+
+        return envoltura
+
+    return decorador
+
+
+def _agregar_muestra(objetivo, perfil):
+    volcar = False
+    with _estado_lock:
+        agregado = _agregados.get(objetivo)
+        if agregado is None:
+            agregado = {"stats": pstats.Stats(perfil), "muestras": 1, "desde": time.time()}
+            _agregados[objetivo] = agregado
+        else:
+            agregado["stats"].add(perfil)
+            agregado["muestras"] += 1
+        volcar = (time.time() - agregado["desde"]) >= PROFILE_INTERVAL_S
+    if volcar:
+        volcar_perfil(objetivo)
+
+
+def volcar_perfil(objetivo):
+    """Escribe el agregado actual del objetivo a disco y reinicia el intervalo."""
+    with _estado_lock:
+        agregado = _agregados.pop(objetivo, None)
+    if agregado is None:
+        return _ultimos.get(objetivo)
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    sello = time.strftime("%Y%m%d-%H%M%S")
+    base = os.path.join(PROFILE_DIR, f"{objetivo}-{sello}")
+    ruta_pstats = base + ".pstats"
+    ruta_folded = base + ".folded"
+    agregado["stats"].dump_stats(ruta_pstats)
+    with open(ruta_folded, "w", encoding="utf-8") as f:
+        for linea in pilas_colapsadas(agregado["stats"]):
+            f.write(linea + "\n")
+
+    info = {
+        "objetivo": objetivo,
+        "muestras": agregado["muestras"],
+        "desde": agregado["desde"],
+        "hasta": time.time(),
+        "pstats": ruta_pstats,
+        "folded": ruta_folded,
+    }
+    with _estado_lock:
+        _ultimos[objetivo] = info
+    return info
+
+
+def ultimo_perfil(objetivo, volcar=False):
+    """Info del ultimo volcado del objetivo (opcionalmente vuelca el agregado en curso)."""
+    if volcar:
+        return volcar_perfil(objetivo)
+    with _estado_lock:
+        return _ultimos.get(objetivo)
+
+
+def estado():
+    with _estado_lock:
+        en_curso = {k: {"muestras": v["muestras"], "desde": v["desde"]} for k, v in _agregados.items()}
+        ultimos = dict(_ultimos)
+    return {
+        "objetivos": PROFILE_TARGETS,
+        "intervalo_s": PROFILE_INTERVAL_S,
+        "directorio": PROFILE_DIR,
+        "en_curso": en_curso,
+        "ultimos": ultimos,
+    }
+
+
+def _etiqueta(func):
+    archivo, linea, nombre = func
+    if archivo == "~":
+        # Quitar direcciones de memoria ("<function X at 0x...>") para poder agregar pilas
+        return re.sub(r" at 0x[0-9a-fA-F]+", "", nombre)
+    return f"{nombre} ({os.path.basename(archivo)}:{linea})"
+
+
+def pilas_colapsadas(stats):
+    """
+    Convierte un pstats.Stats a pilas colapsadas ("a;b;c microsegundos").
+
+    cProfile solo guarda pares llamador -> llamado, por lo que el tiempo de cada
+    ruta se reparte en proporcion al tiempo acumulado de cada arista.
+    """
+    datos = stats.stats
+    llamados = {}
+    for func, (_cc, _nc, _tt, _ct, llamadores) in datos.items():
+        for llamador, valores in llamadores.items():
+            llamados.setdefault(llamador, {})[func] = valores[3]
+
+    raices = [f for f, v in datos.items() if not any(c in datos for c in v[4])]
+    acumulado = {}
+
+    def recorrer(func, ruta, escala):
+        _cc, _nc, tt, ct, _ = datos[func]
+        ruta = ruta + (func,)
+        propio_us = tt * escala * 1e6
+        if propio_us >= 1:
+            clave = ";".join(_etiqueta(f) for f in ruta)
+            acumulado[clave] = acumulado.get(clave, 0) + propio_us
+        if len(ruta) >= _FOLDED_MAX_DEPTH:
+            return
+        for hijo, ct_arista in llamados.get(func, {}).items():
+            if hijo in ruta or hijo not in datos:
+                continue
+            ct_hijo = datos[hijo][3]
+            if ct_hijo <= 0:
+                continue
+            escala_hijo = escala * ct_arista / ct_hijo
+            if ct_hijo * escala_hijo * 1e6 < 1:
+                continue
+            recorrer(hijo, ruta, escala_hijo)
+
+    for raiz in raices:
+        recorrer(raiz, (), 1.0)
+    return [f"{clave} {int(round(us))}" for clave, us in sorted(acumulado.items()) if us >= 1]
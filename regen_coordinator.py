@@ -0,0 +1,208 @@
+"""
+Coordinador de regeneracion de la base demo (una sola a la vez, entre hilos y procesos).
+
+Callbacks del dashboard, el hilo de simulacion y los subprocesos de run_demo.py
+pueden decidir al mismo tiempo que la base necesita crearse o completarse. Sin
+coordinacion intercalan DELETE/INSERT sobre el mismo archivo. Aqui:
+
+- un lock de archivo (<base>.regen.lock) asegura un solo ganador entre procesos;
+- un registro en memoria por clave (single-flight) hace que los demas hilos del
+  proceso esperen el resultado del ganador o sigan con los datos actuales;
+- despues de tomar los locks se vuelve a verificar si la regeneracion sigue siendo
+  necesaria (otro proceso pudo haberla hecho mientras se esperaba).
+"""
+import os
+import threading
+import time
+
+from metrics import DB_REGEN_SECONDS, DB_REGEN_TOTAL
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class RegenBusyError(RuntimeError):
+    """Otro proceso tiene el lock de regeneracion y no se quiso (o no se alcanzo a) esperar."""
+
+
+class FileLock:
+    """Lock exclusivo sobre un archivo (flock en POSIX, msvcrt.locking en Windows)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def adquirir(self, timeout_s=None, intervalo_s=0.05):
+        """Intenta tomar el lock. timeout_s=None espera indefinidamente, 0 no espera."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        limite = None if timeout_s is None else time.monotonic() + float(timeout_s)
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                self._fd = fd
+                return True
+            except OSError:
+                if limite is not None and time.monotonic() >= limite:
+                    os.close(fd)
+                    return False
+                time.sleep(intervalo_s)
+
+    def liberar(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class _Vuelo:
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class RegenCoordinator:
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self._lock = threading.Lock()
+        self._en_curso = {}
+        self._completados = {}
+        self._ultima = None
+
+    def ejecutar(self, tipo, fn, clave=None, esperar=True, timeout_s=120.0, necesario=None):
+        """Ejecuta fn() como unico regenerador de `clave` (por defecto `tipo`).
+
+        - Si otro hilo del proceso ya la esta ejecutando: con esperar=True espera y
+          retorna su resultado; con esperar=False retorna None de inmediato.
+        - Si otro proceso tiene el lock: espera hasta timeout_s (o no espera si
+          esperar=False) y si no lo obtiene lanza RegenBusyError / retorna None.
+        - `necesario()` se evalua ya con los locks tomados; si retorna False no se
+          ejecuta fn y se retorna None.
+        """
+        clave = clave or tipo
+        with self._lock:
+            vuelo = self._en_curso.get(clave)
+            ganador = vuelo is None
+            if ganador:
+                vuelo = self._en_curso[clave] = _Vuelo()
+
+        if not ganador:
+            if not esperar:
+                DB_REGEN_TOTAL.inc(tipo=tipo, result="in_flight")
+                return None
+            vuelo.listo.wait(timeout_s)
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+
+        inicio = time.perf_counter()
+        resultado_metrica = "error"
+        archivo = FileLock(self.lock_path)
+        try:
+            if not archivo.adquirir(timeout_s if esperar else 0):
+                resultado_metrica = "busy"
+                if esperar:
+                    raise RegenBusyError(f"Regeneracion '{tipo}' en curso en otro proceso ({self.lock_path})")
+                return None
+            try:
+                if necesario is not None and not necesario():
+                    resultado_metrica = "skipped"
+                else:
+                    vuelo.resultado = fn()
+                    resultado_metrica = "ok"
+            finally:
+                archivo.liberar()
+            self.marcar(clave)
+            return vuelo.resultado
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            duracion = time.perf_counter() - inicio
+            if resultado_metrica in ("ok", "error"):
+                DB_REGEN_SECONDS.observe(duracion, tipo=tipo)
+            DB_REGEN_TOTAL.inc(tipo=tipo, result=resultado_metrica)
+            with self._lock:
+                self._en_curso.pop(clave, None)
+                if resultado_metrica in ("ok", "error"):
+                    self._ultima = {
+                        "tipo": tipo,
+                        "clave": clave,
+                        "resultado": resultado_metrica,
+                        "duracion_s": round(duracion, 3),
+                        "ts": time.time(),
+                    }
+            vuelo.listo.set()
+
+    def en_segundo_plano(self, tipo, fn, clave=None, necesario=None):
+        """Como ejecutar(esperar=False) pero en un hilo aparte. Retorna False si ya hay
+        una regeneracion de `clave` en curso en este proceso."""
+        clave = clave or tipo
+        with self._lock:
+            if clave in self._en_curso:
+                return False
+
+        def _correr():
+            try:
+                self.ejecutar(tipo, fn, clave=clave, esperar=False, necesario=necesario)
+            except Exception as e:
+                print(f"[WARN] Regeneracion '{tipo}' fallida: {e}")
+
+        threading.Thread(target=_correr, name=f"regen-{tipo}", daemon=True).start()
+        return True
+
+    def en_curso(self, clave):
+        """True si `clave` se esta regenerando en este proceso."""
+        with self._lock:
+            return clave in self._en_curso
+
+    def marcar(self, clave):
+        """Registrar que `clave` esta al dia (evita re-verificar en cada refresco)."""
+        with self._lock:
+            self._completados[clave] = time.time()
+
+    def olvidar(self):
+        """Descartar las verificaciones recordadas (la base fue reemplazada)."""
+        with self._lock:
+            self._completados.clear()
+
+    def reciente(self, clave, ttl_s):
+        with self._lock:
+            ts = self._completados.get(clave)
+        return ts is not None and (time.time() - ts) < ttl_s
+
+    def estado(self):
+        with self._lock:
+            return {
+                "lock_path": self.lock_path,
+                "en_curso": sorted(self._en_curso),
+                "ultima": dict(self._ultima) if self._ultima else None,
+            }
+
+
+_coordinadores = {}
+_coordinadores_lock = threading.Lock()
+
+
+def para_base(db_path):
+    """Coordinador (unico por proceso) de la base `db_path`."""
+    clave = os.path.abspath(db_path)
+    with _coordinadores_lock:
+        coordinador = _coordinadores.get(clave)
+        if coordinador is None:
+            coordinador = _coordinadores[clave] = RegenCoordinator(clave + ".regen.lock")
+        return coordinador
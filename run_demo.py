@@ -25,9 +25,22 @@ def main():
                        help="Modo de ejecución")
     parser.add_argument("--sim-interval", type=int, default=30,
                        help="Intervalo de simulación en segundos")
+    parser.add_argument("--speed", type=float, default=None,
+                       help="Reloj virtual acelerado (ej: 120 = un turno de 10h en 5 min)")
+    parser.add_argument("--clock-start", default=None,
+                       help="Hora local de inicio del reloj virtual (ej: 2026-01-15T16:50)")
 
     args = parser.parse_args()
 
+    # Reloj virtual compartido: dashboard y simulador heredan el mismo ancla
+    if args.speed or args.clock_start:
+        if args.speed:
+            os.environ["PANEL_CLOCK_SPEED"] = str(args.speed)
+        if args.clock_start:
+            os.environ["PANEL_CLOCK_START"] = args.clock_start
+        os.environ["PANEL_CLOCK_ANCHOR"] = repr(time.time())
+        print(f"[CLOCK] Reloj virtual x{args.speed or 1:g} (inicio: {args.clock_start or 'ahora'})")
+
     print("Panel Dash - AgroIndustria XYZ S.A. (Demo)")
     print("=" * 50)
 
@@ -0,0 +1,382 @@
+"""
+Archivo columnar de turnos cerrados (Arrow IPC) con lectura por memory-map.
+
+Cada turno cerrado se exporta a archivos Arrow IPC particionados por fecha y linea:
+
+    <PANEL_ARCHIVE_DIR>/<tabla>/fecha=AAAA-MM-DD/proceso=CAL001/<day|night>.arrow
+
+con sus filas de VW_LottiIngresso, VW_MON_Partita_Storico_Agent, PROD_Rollup_Hora y
+PROD_Rollup_Turno. Un turno nuevo solo agrega archivos; re-archivar un turno
+reemplaza los suyos (escritura atomica). PROD_Archivio registra que se archivo.
+
+podar() deja en las tablas vivas solo la ventana de retencion (PANEL_RETENTION_DAYS:
+VW_LottiIngresso, historial y los PROD_Lotto/PROD_Unita_OUT de lotes ya borrados), y
+por defecto nunca borra un turno que no este archivado (db_maintenance la ejecuta cada
+dia). Los rollups se conservan completos: son pocos y la vista de tendencia los lee.
+
+leer() abre los archivos con pyarrow.memory_map (sin copiar a memoria hasta que se
+usan las columnas) y descarta particiones por nombre de carpeta antes de abrirlas.
+
+Requiere pyarrow (opcional, `pip install pyarrow`); sin el, archivar/leer lanzan
+RuntimeError y la poda queda deshabilitada, salvo PANEL_RETENTION_REQUIRE_ARCHIVE=0
+(poda sin archivo: lo borrado solo queda en los rollups).
+
+Uso:
+    python shift_archive.py --archive                    # archiva turnos cerrados pendientes
+    python shift_archive.py --archive --prune --retention-days 30
+    python shift_archive.py --summary --days 90          # totales por dia y linea desde el archivo
+"""
+import datetime
+import os
+import sqlite3
+import time
+
+import clock
+import data_freshness
+import production_ledger
+import production_rollups
+from config_demo import env_float
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # pyarrow es opcional
+    pa = None
+    pa_ipc = None
+
+ARCHIVE_DIR = os.environ.get("PANEL_ARCHIVE_DIR", "archive")
+# Dias que quedan en las tablas vivas (la misma retencion para db_maintenance y la CLI)
+RETENTION_DAYS = int(env_float("PANEL_RETENTION_DAYS", 90))
+# Por defecto solo se poda lo ya archivado; "0" permite podar sin pyarrow
+RETENTION_REQUIRE_ARCHIVE = os.environ.get("PANEL_RETENTION_REQUIRE_ARCHIVE", "1") != "0"
+# Horas despues del fin de turno antes de archivarlo (lotes que siguen en curso)
+GRACE_HOURS = env_float("PANEL_ARCHIVE_GRACE_HOURS", 6)
+
+TABLA_MANIFIESTO = "PROD_Archivio"
+
+# tabla -> (columna de linea, columna de tiempo del turno | None, filtro por turno)
+_FUENTES = {
+    "VW_LottiIngresso": ("CodiceProcesso", "DataLettura", None),
+    "VW_MON_Partita_Storico_Agent": ("ProcessoCodice", "LottoInizio", None),
+    "PROD_Rollup_Hora": ("Proceso", None, "Hora >= ? AND Hora < ?"),
+    "PROD_Rollup_Turno": ("Proceso", None, "Fecha = ? AND Turno = ?"),
+}
+# Tablas vivas que se podan (las de mayor volumen)
+_PODABLES = ("VW_LottiIngresso", "VW_MON_Partita_Storico_Agent")
+
+_SQL_MANIFIESTO = f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_MANIFIESTO} (
+        Fecha TEXT NOT NULL,
+        Turno TEXT NOT NULL,
+        Tabla TEXT NOT NULL,
+        Filas INTEGER NOT NULL,
+        Archivos INTEGER NOT NULL,
+        ArchivadoTs TEXT NOT NULL,
+        PRIMARY KEY (Fecha, Turno, Tabla)
+    ) WITHOUT ROWID
+"""
+
+
+def disponible():
+    return pa is not None
+
+
+def poda_deshabilitada(exigir_archivo=None):
+    """Motivo por el que podar() no borraria nada, o None si la poda esta habilitada."""
+    exigir_archivo = RETENTION_REQUIRE_ARCHIVE if exigir_archivo is None else exigir_archivo
+    if RETENTION_DAYS <= 0:
+        return "PANEL_RETENTION_DAYS <= 0"
+    if exigir_archivo and pa is None:
+        return "sin pyarrow no se archiva y PANEL_RETENTION_REQUIRE_ARCHIVE=1 impide podar sin archivo"
+    return None
+
+
+def _requerir_pyarrow():
+    if pa is None:
+        raise RuntimeError("El archivo columnar requiere pyarrow (pip install pyarrow)")
+
+
+def crear_tabla(cur):
+    cur.execute(_SQL_MANIFIESTO)
+
+
+def ventana_turno(fecha, turno):
+    """(inicio, fin) del turno: dia 07:00-17:00, noche 17:00-07:00 del dia siguiente."""
+    dia = datetime.date.fromisoformat(fecha)
+    if turno == "day":
+        inicio = datetime.datetime.combine(dia, datetime.time(7, 0))
+        return inicio, inicio.replace(hour=17)
+    inicio = datetime.datetime.combine(dia, datetime.time(17, 0))
+    return inicio, inicio + datetime.timedelta(hours=14)
+
+
+def _turno_actual(ahora):
+    tipo, fecha = production_ledger.clave_turno(ahora).split("|")
+    return fecha, tipo
+
+
+def turnos_con_datos(conn, hasta=None):
+    """[(fecha, turno)] con filas vivas en VW_LottiIngresso o el historial, en orden."""
+    partes = []
+    for tabla in _PODABLES:
+        columna = _FUENTES[tabla][1]
+        fecha_sql, tipo_sql = production_rollups.expresiones_turno(columna)
+        partes.append(
+            f"SELECT DISTINCT {fecha_sql} AS Fecha, {tipo_sql} AS Turno FROM {tabla} WHERE {columna} IS NOT NULL"
+        )
+    filas = conn.execute(
+        f"SELECT DISTINCT Fecha, Turno FROM ({' UNION '.join(partes)}) ORDER BY Fecha, Turno"
+    ).fetchall()
+    turnos = [(f, t) for f, t in filas if f]
+    if hasta is not None:
+        turnos = [t for t in turnos if t < hasta]
+    return turnos
+
+
+def turnos_archivados(conn):
+    try:
+        filas = conn.execute(
+            f"SELECT Fecha, Turno FROM {TABLA_MANIFIESTO} GROUP BY Fecha, Turno HAVING COUNT(*) = ?",
+            (len(_FUENTES),),
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return set()
+    return {(f, t) for f, t in filas}
+
+
+def _leer_tabla(conn, tabla, fecha, turno):
+    import pandas as pd
+
+    linea, columna, filtro = _FUENTES[tabla]
+    inicio, fin = ventana_turno(fecha, turno)
+    if columna:
+        # Texto de SQLite ('AAAA-MM-DD HH:MM:SS[.ffffff]') compara bien contra el ISO con espacio
+        sql = f"SELECT * FROM {tabla} WHERE {columna} >= ? AND {columna} < ?"
+        params = (inicio.isoformat(sep=" "), fin.isoformat(sep=" "))
+    elif tabla == "PROD_Rollup_Hora":
+        sql = f"SELECT * FROM {tabla} WHERE {filtro}"
+        params = (inicio.strftime("%Y-%m-%d %H:00"), fin.strftime("%Y-%m-%d %H:00"))
+    else:
+        sql = f"SELECT * FROM {tabla} WHERE {filtro}"
+        params = (fecha, turno)
+    try:
+        df = pd.read_sql(sql, conn, params=params)
+    except Exception as e:
+        if "no such table" in str(e):
+            return None, linea
+        raise
+    for col in ("DataLettura", "LottoInizio", "LottoFine", "DataAcquisizione"):
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce", format="mixed")
+    return df, linea
+
+
+def _escribir(ruta, tabla_arrow):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + ".tmp"
+    with pa.OSFile(temporal, "wb") as destino:
+        with pa_ipc.new_file(destino, tabla_arrow.schema) as escritor:
+            escritor.write_table(tabla_arrow)
+    os.replace(temporal, ruta)
+
+
+def archivar_turno(conn, fecha, turno, directorio=None):
+    """Exporta el turno a Arrow IPC y lo registra en el manifiesto. Retorna filas por tabla."""
+    _requerir_pyarrow()
+    directorio = directorio or ARCHIVE_DIR
+    resultado = {}
+    registros = []
+    for tabla in _FUENTES:
+        df, linea = _leer_tabla(conn, tabla, fecha, turno)
+        filas = archivos = 0
+        if df is not None and not df.empty:
+            for proceso, parte in df.groupby(linea, sort=True):
+                ruta = os.path.join(directorio, tabla, f"fecha={fecha}", f"proceso={proceso}", f"{turno}.arrow")
+                _escribir(ruta, pa.Table.from_pandas(parte.reset_index(drop=True), preserve_index=False))
+                filas += len(parte)
+                archivos += 1
+        resultado[tabla] = filas
+        registros.append((fecha, turno, tabla, filas, archivos))
+
+    ts = clock.now_local().isoformat(sep=" ", timespec="seconds")
+    cur = conn.cursor()
+    crear_tabla(cur)
+    cur.executemany(
+        f"""
+        INSERT OR REPLACE INTO {TABLA_MANIFIESTO} (Fecha, Turno, Tabla, Filas, Archivos, ArchivadoTs)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [r + (ts,) for r in registros],
+    )
+    conn.commit()
+    return resultado
+
+
+def archivar_pendientes(conn, ahora=None, directorio=None, limite=None):
+    """Archiva los turnos cerrados hace al menos GRACE_HOURS que aun no estan en el
+    manifiesto. Retorna {"turnos": n, "filas": {tabla: filas}}."""
+    _requerir_pyarrow()
+    ahora = ahora or clock.now_local()
+    limite_fin = ahora - datetime.timedelta(hours=GRACE_HOURS)
+    hechos = turnos_archivados(conn)
+    pendientes = [
+        t for t in turnos_con_datos(conn, hasta=_turno_actual(ahora))
+        if t not in hechos and ventana_turno(*t)[1] <= limite_fin
+    ]
+    if limite:
+        pendientes = pendientes[: int(limite)]
+    totales = {tabla: 0 for tabla in _FUENTES}
+    for fecha, turno in pendientes:
+        for tabla, filas in archivar_turno(conn, fecha, turno, directorio).items():
+            totales[tabla] += filas
+    return {"turnos": len(pendientes), "filas": totales}
+
+
+def podar(conn, retencion_dias=None, ahora=None, exigir_archivo=None):
+    """Borra de las tablas vivas los turnos fuera de la ventana de retencion.
+
+    El corte se alinea al inicio de turno. Con exigir_archivo (por defecto
+    RETENTION_REQUIRE_ARCHIVE) retrocede hasta el primer turno sin archivar, de modo
+    que nada se borra sin estar en el archivo; sin pyarrow entonces no se borra nada. Tambien se borran los PROD_Lotto
+    (y sus PROD_Unita_OUT) anteriores al corte cuyo lote ya no esta en VW_LottiIngresso.
+    Retorna filas borradas por tabla.
+    """
+    retencion_dias = int(retencion_dias if retencion_dias is not None else RETENTION_DAYS)
+    exigir_archivo = RETENTION_REQUIRE_ARCHIVE if exigir_archivo is None else exigir_archivo
+    if (exigir_archivo and pa is None) or retencion_dias <= 0:
+        return {}
+    ahora = ahora or clock.now_local()
+    fecha, turno = _turno_actual(ahora - datetime.timedelta(days=retencion_dias))
+    corte = ventana_turno(fecha, turno)[0]
+    if exigir_archivo:
+        hechos = turnos_archivados(conn)
+        for pendiente in turnos_con_datos(conn, hasta=(fecha, turno)):
+            if pendiente not in hechos:
+                corte = min(corte, ventana_turno(*pendiente)[0])
+                break
+
+    borradas = {}
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        # Se conservan completos los lotes que terminan despues del corte (los rollups
+        # atribuyen cada lote al turno de su cierre y backfill los vuelve a leer)
+        corte_txt = corte.isoformat(sep=" ")
+        cur.execute(
+            """
+            DELETE FROM VW_LottiIngresso
+            WHERE DataLettura < ? AND NOT EXISTS (
+                SELECT 1 FROM VW_MON_Partita_Storico_Agent s
+                WHERE s.ProcessoCodice = VW_LottiIngresso.CodiceProcesso
+                  AND s.LottoCodice = VW_LottiIngresso.CodiceLotto
+                  AND (s.LottoFine IS NULL OR s.LottoFine >= ?)
+            )
+            """,
+            (corte_txt, corte_txt),
+        )
+        borradas["VW_LottiIngresso"] = cur.rowcount
+        cur.execute(
+            "DELETE FROM VW_MON_Partita_Storico_Agent WHERE LottoInizio < ? AND LottoFine < ?",
+            (corte_txt, corte_txt),
+        )
+        borradas["VW_MON_Partita_Storico_Agent"] = cur.rowcount
+        if cur.rowcount:
+            data_freshness.marcar_borrado(cur, "VW_MON_Partita_Storico_Agent")
+        huerfanos = """
+            SELECT LOT_ID FROM PROD_Lotto
+            WHERE LOT_Data_Inizio < ? AND NOT EXISTS (
+                SELECT 1 FROM VW_LottiIngresso v WHERE v.CodiceLotto = PROD_Lotto.LOT_Codice_Lotto
+            )
+        """
+        cur.execute(f"DELETE FROM PROD_Unita_OUT WHERE UOUT_Lotto_FK IN ({huerfanos})", (corte_txt,))
+        borradas["PROD_Unita_OUT"] = cur.rowcount
+        cur.execute(f"DELETE FROM PROD_Lotto WHERE LOT_ID IN ({huerfanos})", (corte_txt,))
+        borradas["PROD_Lotto"] = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    borradas["corte"] = corte.isoformat(sep=" ")
+    return borradas
+
+
+def _particiones(directorio, tabla, desde=None, hasta=None, procesos=None):
+    base = os.path.join(directorio, tabla)
+    if not os.path.isdir(base):
+        return []
+    rutas = []
+    for carpeta_fecha in sorted(os.listdir(base)):
+        fecha = carpeta_fecha.partition("=")[2]
+        if (desde and fecha < desde) or (hasta and fecha > hasta):
+            continue
+        for carpeta_proceso in sorted(os.listdir(os.path.join(base, carpeta_fecha))):
+            proceso = carpeta_proceso.partition("=")[2]
+            if procesos and proceso not in procesos:
+                continue
+            carpeta = os.path.join(base, carpeta_fecha, carpeta_proceso)
+            rutas.extend(os.path.join(carpeta, n) for n in sorted(os.listdir(carpeta)) if n.endswith(".arrow"))
+    return rutas
+
+
+def leer(tabla, desde=None, hasta=None, procesos=None, columnas=None, directorio=None):
+    """Tabla Arrow con las filas archivadas de `tabla` (fechas de turno AAAA-MM-DD inclusive).
+
+    Los archivos se abren con memory-map; solo se materializan las `columnas` pedidas.
+    """
+    _requerir_pyarrow()
+    directorio = directorio or ARCHIVE_DIR
+    partes = []
+    for ruta in _particiones(directorio, tabla, desde, hasta, procesos):
+        with pa.memory_map(ruta, "r") as fuente:
+            parte = pa_ipc.open_file(fuente).read_all()
+        partes.append(parte.select(columnas) if columnas else parte)
+    if not partes:
+        return None
+    return pa.concat_tables(partes, promote_options="default")
+
+
+def resumen_diario(desde=None, hasta=None, procesos=None, directorio=None):
+    """Cajas y kg por dia de turno y linea desde los rollups archivados (DataFrame)."""
+    tabla = leer("PROD_Rollup_Turno", desde, hasta, procesos,
+                 columnas=["Fecha", "Proceso", "Cajas", "Kg", "Lotes"], directorio=directorio)
+    if tabla is None:
+        return None
+    agrupado = tabla.group_by(["Fecha", "Proceso"]).aggregate(
+        [("Cajas", "sum"), ("Kg", "sum"), ("Lotes", "sum")]
+    )
+    return agrupado.to_pandas().sort_values(["Fecha", "Proceso"]).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Archivo columnar de turnos cerrados")
+    parser.add_argument("--db", default="demo_database.db", help="Ruta a la base de datos")
+    parser.add_argument("--dir", default=None, help=f"Carpeta del archivo (por defecto {ARCHIVE_DIR})")
+    parser.add_argument("--archive", action="store_true", help="Archivar turnos cerrados pendientes")
+    parser.add_argument("--prune", action="store_true", help="Podar las tablas vivas fuera de la retencion")
+    parser.add_argument("--retention-days", type=int, default=None, help=f"Dias en vivo (por defecto {RETENTION_DAYS})")
+    parser.add_argument("--summary", action="store_true", help="Totales por dia y linea desde el archivo")
+    parser.add_argument("--days", type=int, default=30, help="Dias del resumen")
+    args = parser.parse_args()
+
+    if not (args.archive or args.prune or args.summary):
+        parser.error("indicar --archive, --prune o --summary")
+    if (args.archive or args.summary or (args.prune and RETENTION_REQUIRE_ARCHIVE)) and not disponible():
+        raise SystemExit("[ERROR] El archivo columnar requiere pyarrow (pip install pyarrow)")
+
+    if args.archive or args.prune:
+        conn = sqlite3.connect(args.db, timeout=30)
+        try:
+            if args.archive:
+                inicio = time.perf_counter()
+                r = archivar_pendientes(conn, directorio=args.dir)
+                print(f"[ARCHIVO] {r['turnos']} turnos archivados en {time.perf_counter() - inicio:.2f}s: {r['filas']}")
+            if args.prune:
+                print(f"[ARCHIVO] Poda: {podar(conn, args.retention_days)}")
+        finally:
+            conn.close()
+    if args.summary:
+        desde = (clock.now_local() - datetime.timedelta(days=args.days)).date().isoformat()
+        df = resumen_diario(desde=desde, directorio=args.dir)
+        print(df.to_string(index=False) if df is not None else "[ARCHIVO] Sin datos archivados")
@@ -0,0 +1,115 @@
+"""
+Ritmo real de produccion (cajas/h y kg/h) medido desde los contadores del turno.
+
+UnitaSvuotateOra / PesoSvuotatoOra de VW_MON_Produttivita_Turno_Corrente son un valor
+fijo por turno; este motor mide el ritmo con los incrementos observados de
+UnitaSvuotate y PesoSvuotato entre ticks. Por cada ventana (15 y 60 minutos) guarda
+una cola de incrementos con su suma corriente: cada tick agrega un incremento y
+descarta los que salieron de la ventana, O(1) amortizado, sin releer nada.
+
+- instantaneo: suma de la ventana / tiempo cubierto por la ventana;
+- turno: acumulado del turno / tiempo desde TurnoInizio.
+Mientras la ventana cubra menos de PANEL_RATE_MIN_SPAN_S no hay ritmo medido y el
+panel muestra las columnas de la vista.
+"""
+import collections
+import threading
+
+from config_demo import env_float
+
+
+VENTANAS_MIN = (15, 60)
+RATE_MIN_SPAN_S = env_float("PANEL_RATE_MIN_SPAN_S", 120)
+RATE_MAX_GAP_S = env_float("PANEL_RATE_MAX_GAP_S", 900)  # hueco entre ticks que reinicia las ventanas
+
+
+class SlidingWindowSum:
+    """Suma de incrementos (cajas, kg) de los ultimos `ventana_s` segundos."""
+
+    __slots__ = ("ventana_s", "_cola", "cajas", "kg", "desde")
+
+    def __init__(self, ventana_s):
+        self.ventana_s = float(ventana_s)
+        self._cola = collections.deque()
+        self.cajas = 0.0
+        self.kg = 0.0
+        self.desde = None  # inicio del tramo observado
+
+    def reiniciar(self, ts):
+        self._cola.clear()
+        self.cajas = self.kg = 0.0
+        self.desde = ts
+
+    def agregar(self, ts, d_cajas, d_kg):
+        self._cola.append((ts, d_cajas, d_kg))
+        self.cajas += d_cajas
+        self.kg += d_kg
+        limite = ts - self.ventana_s
+        while self._cola and self._cola[0][0] <= limite:
+            _, c, k = self._cola.popleft()
+            self.cajas -= c
+            self.kg -= k
+        if self.desde is None or self.desde < limite:
+            self.desde = limite
+
+    def tasa_h(self, ts):
+        """(cajas/h, kg/h, segundos cubiertos) o None si cubre menos de RATE_MIN_SPAN_S."""
+        if self.desde is None:
+            return None
+        cubierto = ts - self.desde
+        if cubierto < RATE_MIN_SPAN_S:
+            return None
+        return self.cajas * 3600.0 / cubierto, self.kg * 3600.0 / cubierto, cubierto
+
+
+class ThroughputEngine:
+    def __init__(self, ventanas_min=VENTANAS_MIN):
+        self._lock = threading.Lock()
+        self._ventanas = {int(m): SlidingWindowSum(m * 60.0) for m in ventanas_min}
+        self._ultimo = None  # (ts, cajas, kg)
+        self._turno = None
+
+    def observar(self, ts, cajas, kg, turno=None):
+        """Agrega la lectura de los contadores del turno (ts en segundos)."""
+        cajas = float(cajas or 0)
+        kg = float(kg or 0.0)
+        with self._lock:
+            if self._ultimo is not None and ts <= self._ultimo[0]:
+                return
+            reinicio = (
+                self._ultimo is None
+                or turno != self._turno
+                or cajas < self._ultimo[1]
+                or kg < self._ultimo[2]
+                or ts - self._ultimo[0] > RATE_MAX_GAP_S
+            )
+            if reinicio:
+                for ventana in self._ventanas.values():
+                    ventana.reiniciar(ts)
+            else:
+                d_cajas = cajas - self._ultimo[1]
+                d_kg = kg - self._ultimo[2]
+                for ventana in self._ventanas.values():
+                    ventana.agregar(ts, d_cajas, d_kg)
+            self._ultimo = (ts, cajas, kg)
+            self._turno = turno
+
+    def ritmo(self, ts, inicio_turno_ts=None):
+        """{"cajas_h_15", "kg_h_15", "cajas_h_60", ..., "cajas_h_turno", "kg_h_turno"} (None si no hay datos)."""
+        with self._lock:
+            ultimo = self._ultimo
+            resultado = {}
+            for minutos, ventana in self._ventanas.items():
+                tasa = ventana.tasa_h(ts) if ultimo else None
+                resultado[f"cajas_h_{minutos}"] = round(tasa[0], 1) if tasa else None
+                resultado[f"kg_h_{minutos}"] = round(tasa[1], 1) if tasa else None
+        transcurrido = (ts - inicio_turno_ts) if (ultimo and inicio_turno_ts is not None) else 0
+        if transcurrido >= RATE_MIN_SPAN_S:
+            resultado["cajas_h_turno"] = round(ultimo[1] * 3600.0 / transcurrido, 1)
+            resultado["kg_h_turno"] = round(ultimo[2] * 3600.0 / transcurrido, 1)
+        else:
+            resultado["cajas_h_turno"] = resultado["kg_h_turno"] = None
+        return resultado
+
+
+MOTOR = ThroughputEngine()